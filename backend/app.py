@@ -3,30 +3,29 @@ import os
 import json
 import time
 import datetime
-from pathlib import Path
-from typing import List, Optional
+from typing import Optional
 
 # 第三方库导入
+import click
 from dotenv import load_dotenv
 import requests
 import jwt as pyjwt
-from werkzeug.security import generate_password_hash, check_password_hash
-import mysql.connector
-from mysql.connector import Error
 
 # Flask相关
-from flask import Flask, request, jsonify, Response
+from flask import Blueprint, Flask, request, jsonify, Response, current_app, g
 from flask_cors import CORS
 
-# LangChain相关
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain_community.llms import Tongyi
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
-
-# 自定义模块
-from rag_service import RAGService
+# 自定义模块（LangChain、numpy等重依赖在对应组件首次使用时才导入）
+from auth import init_auth, login_required
+from batch_jobs import StoryJobRunner, UpstreamThrottled
+from metrics import TOKENS_STREAMED, init_metrics, observe, register_stats, span
+from profiler import RequestProfiler, follow_threads
+from cache_service import ReadThroughCache, create_cache_backend
+from password_hasher import HasherBusy, PasswordHasher
+from startup import LazyComponent, Startup
+from storage import SEARCH_SOURCES, StorageError, create_storage
+from stream_hub import StreamHub, parse_last_event_id
+from stream_relay import UpstreamReader, coalesce_frames, gzip_frames, story_deltas
 # 在顶部导入后立即配置日志
 import logging
 logging.basicConfig(
@@ -36,39 +35,13 @@ logging.basicConfig(
 
 # 然后创建logger实例（这会让import不再灰色）
 logger = logging.getLogger(__name__)
-logger.info("应用初始化开始")  # 实际使用
 # 加载环境变量
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
-# 初始化 RAG
-rag = RAGService()
-app.logger.info("正在初始化 RAG 系统...")  # 使用 Flask 自带的 logger
-
-try:
-    rag_status = rag.init_rag(data_dir="story_data")  # 确保目录存在
-    app.logger.info(f"RAG 初始化状态: {rag_status}")
-
-    if rag_status.get("status") != "success":
-        app.logger.error(f"RAG 初始化失败: {rag_status}")
-        # 可以在这里决定是否要终止启动
-except Exception as e:
-    app.logger.error(f"RAG 初始化异常: {str(e)}", exc_info=True)
-
 # 通义千问API配置
-app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET') or 'your-secret-key'
-app.config['TONGYI_API_KEY'] = os.getenv('DASHSCOPE_API_KEY')
 DASHSCOPE_API_KEY = os.getenv('DASHSCOPE_API_KEY')
 DASHSCOPE_API_URL = 'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation'
 
-# 初始化LangChain组件
-llm = Tongyi(
-    dashscope_api_key=app.config['TONGYI_API_KEY'],
-    model_name="qwen-turbo",
-    temperature=0.7
-)
-
 # 故事生成模板
 story_template = """#角色
 -你是一个儿童心理大师兼职儿童故事专家，懂得很多儿童心理知识，很会做心理分析，能根据儿童的描述来评估他们的心理状态，并且能够在对儿童完成心理分析后给他们讲述故事。
@@ -93,220 +66,296 @@ story_template = """#角色
 用户输入：{message}
 """
 
-story_prompt = PromptTemplate(
-    input_variables=["age", "theme", "requirements", "length"],
-    template=story_template
+
+# 存储后端：mysql（默认）或 sqlite（单机/测试部署），首次使用时才建立连接
+def _create_storage():
+    dbconfig = {
+        "host": os.getenv('MYSQL_HOST', 'localhost'),
+        "port": int(os.getenv('MYSQL_PORT', 3306)),
+        "user": os.getenv('MYSQL_USER', 'root'),
+        "password": os.getenv('MYSQL_PASSWORD'),
+        "database": os.getenv('MYSQL_DB', 'story_app'),
+        "autocommit": True,
+        "connect_timeout": 5
+    }
+    return create_storage(
+        os.getenv('STORAGE_BACKEND', 'mysql'),
+        path=os.getenv('SQLITE_PATH', 'story_app.db'),
+        dbconfig=dbconfig,
+        pool={
+            'min_size': int(os.getenv('MYSQL_POOL_MIN', 2)),
+            'max_size': int(os.getenv('MYSQL_POOL_MAX', 10)),
+            'validate_after': float(os.getenv('MYSQL_POOL_VALIDATE_AFTER', 30)),
+            'idle_timeout': float(os.getenv('MYSQL_POOL_IDLE_TIMEOUT', 300)),
+            'checkout_timeout': float(os.getenv('MYSQL_POOL_CHECKOUT_TIMEOUT', 5)),
+            'leak_threshold': float(os.getenv('MYSQL_POOL_LEAK_THRESHOLD', 60)),
+        }
+    )
+
+
+# RAG检索（LangChain + Chroma），索引在后台启动钩子中构建
+def _create_rag():
+    from rag_service import RAGService
+    return RAGService()
+
+
+# 情感分析：词典快速打分，其余分批并发请求模型，逐条消息按内容哈希缓存
+def _create_sentiment_service():
+    from sentiment_lexicon import LexiconScorer
+    from sentiment_service import SentimentService
+    return SentimentService(
+        storage.get(),
+        api_key=DASHSCOPE_API_KEY,
+        api_url=DASHSCOPE_API_URL,
+        batch_size=int(os.getenv('SENTIMENT_BATCH_SIZE', 20)),
+        max_workers=int(os.getenv('SENTIMENT_MAX_WORKERS', 4)),
+        # 本地词典先打分，低置信度的消息才请求模型；SENTIMENT_LEXICON=0 时全部走模型
+        lexicon=LexiconScorer() if os.getenv('SENTIMENT_LEXICON', '1') == '1' else None,
+        min_confidence=float(os.getenv('SENTIMENT_MIN_CONFIDENCE', 0.7)),
+        # 后台打分写回消息行后，聊天记录与情感趋势的缓存随之失效
+        on_recorded=lambda user_ids: [history_cache.invalidate(uid, 'chat_history', 'sentiment_trend')
+                                      for uid in user_ids]
+    )
+
+
+# 多轮对话上下文：滚动摘要 + 最近几轮原文，固定token预算；未配置API Key时使用抽取式摘要
+def _create_conversation_context():
+    from conversation_context import ConversationContext, DashScopeSummarizer
+    return ConversationContext(
+        storage.get(),
+        summarize=DashScopeSummarizer(DASHSCOPE_API_KEY, DASHSCOPE_API_URL) if DASHSCOPE_API_KEY else None,
+        token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 1200)),
+        summary_tokens=int(os.getenv('CONTEXT_SUMMARY_TOKENS', 400)),
+        recent_turns=int(os.getenv('CONTEXT_RECENT_TURNS', 3)),
+        message_tokens=int(os.getenv('CONTEXT_MESSAGE_TOKENS', 200))
+    )
+
+
+# 冷归档（默认关闭）：超过ARCHIVE_AFTER_DAYS天的故事与聊天正文压缩后移入history_archive，读取时按需解压
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', 0))
+
+
+def _create_archive_service():
+    from archive_service import ArchiveService
+    return ArchiveService(
+        storage.get(),
+        min_age_days=ARCHIVE_AFTER_DAYS or 180,
+        batch_size=int(os.getenv('ARCHIVE_BATCH_SIZE', 200)),
+        pause=float(os.getenv('ARCHIVE_BATCH_PAUSE', 0.1)),
+        search_chars=int(os.getenv('ARCHIVE_SEARCH_CHARS', 500))
+    )
+
+
+# 批量预生成故事：有界worker池共享限速，与交互式生成共用上游配额，需给在线请求留出余量
+STORY_JOB_MAX_PROMPTS = int(os.getenv('STORY_JOB_MAX_PROMPTS', 500))
+STORY_JOB_TIMEOUT = float(os.getenv('STORY_JOB_TIMEOUT', 120))
+# 执行任务的进程：启动时会把running的条目重置为pending，多进程部署时只在一个进程中设为1，
+# 其余进程设为0，只接收提交与查询，条目由执行进程轮询领取
+STORY_JOB_RUNNER = os.getenv('STORY_JOB_RUNNER', '1') == '1'
+
+
+def _create_story_jobs():
+    return StoryJobRunner(
+        storage.get(),
+        generate=generate_story_text,
+        workers=int(os.getenv('STORY_JOB_WORKERS', 4)),
+        requests_per_minute=float(os.getenv('STORY_JOB_RPM', 30)),
+        burst=int(os.getenv('STORY_JOB_BURST', 1)),
+        batch_size=int(os.getenv('STORY_JOB_BATCH_SIZE', 20)),
+        max_attempts=int(os.getenv('STORY_JOB_MAX_ATTEMPTS', 3)),
+        on_stored=on_stories_stored
+    )
+
+
+# 语义缓存（默认关闭）：相似的提示词直接回放已生成的故事，省去一次完整的上游生成
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE', '0') == '1'
+
+
+def _create_semantic_cache():
+    from semantic_cache import DashScopeEmbedder, HashingEmbedder, SemanticStoryCache
+    embedder = (DashScopeEmbedder(DASHSCOPE_API_KEY) if os.getenv('SEMANTIC_CACHE_EMBEDDER') == 'dashscope'
+                else HashingEmbedder())
+    return SemanticStoryCache(
+        storage.get(),
+        embedder=embedder,
+        threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.9)),
+        scope=os.getenv('SEMANTIC_CACHE_SCOPE', 'user'),
+        max_age=float(os.getenv('SEMANTIC_CACHE_MAX_AGE_DAYS', 30)) * 86400,
+        max_replays_per_user=int(os.getenv('SEMANTIC_CACHE_MAX_REPLAYS_PER_USER', 1)),
+        max_replays=int(os.getenv('SEMANTIC_CACHE_MAX_REPLAYS', 20)),
+        explore=float(os.getenv('SEMANTIC_CACHE_EXPLORE', 0.1)),
+        chunk_chars=int(os.getenv('SEMANTIC_CACHE_CHUNK_CHARS', 8)),
+        chunk_interval=float(os.getenv('SEMANTIC_CACHE_CHUNK_INTERVAL', 0.03))
+    )
+
+
+def on_stories_stored(user_ids):
+    """故事写入后失效历史缓存，并把新故事加入语义缓存索引"""
+    for uid in user_ids:
+        history_cache.invalidate(uid, 'story_history')
+    if SEMANTIC_CACHE_ENABLED and startup.done('semantic_cache'):
+        semantic_cache.sync()
+
+
+storage = LazyComponent('storage', _create_storage)
+rag = LazyComponent('rag', _create_rag)
+sentiment_service = LazyComponent('sentiment_service', _create_sentiment_service)
+story_jobs = LazyComponent('story_jobs', _create_story_jobs)
+semantic_cache = LazyComponent('semantic_cache', _create_semantic_cache)
+conversation_context = LazyComponent('conversation_context', _create_conversation_context)
+archive_service = LazyComponent('archive_service', _create_archive_service)
+
+# 可续传的故事流：断线后带Last-Event-ID重连，从缓冲中补发并继续，不再重复调用模型
+stream_hub = StreamHub(
+    buffer_size=int(os.getenv('STREAM_BUFFER_EVENTS', 4096)),
+    grace_period=float(os.getenv('STREAM_GRACE_SECONDS', 60)),
+    retention=float(os.getenv('STREAM_RETENTION_SECONDS', 300))
+)
+# 上游增量合并成帧的字节数与时间窗口；客户端支持时对事件流gzip压缩
+STREAM_COALESCE_BYTES = int(os.getenv('STREAM_COALESCE_BYTES', 64))
+STREAM_COALESCE_DELAY = float(os.getenv('STREAM_COALESCE_MS', 40)) / 1000
+STREAM_GZIP = os.getenv('STREAM_GZIP', '1') == '1'
+
+
+# 历史与对话列表的读穿缓存，写入后按 (用户, 数据类型) 精确失效
+history_cache = ReadThroughCache(
+    create_cache_backend(
+        os.getenv('CACHE_BACKEND', 'lru'),
+        url=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+        max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 2048))
+    ),
+    ttl=float(os.getenv('CACHE_TTL', 300))
 )
 
-story_chain = story_prompt | llm
+# 密码哈希在独立进程池中计算（进程池首次使用时创建），排队过多时直接返回503
+password_hasher = PasswordHasher(
+    method=os.getenv('PASSWORD_HASH_METHOD', 'scrypt'),
+    workers=int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+    max_pending=int(os.getenv('PASSWORD_HASH_MAX_PENDING', 32))
+)
 
-# # 文本分割器
-# text_splitter = RecursiveCharacterTextSplitter(
-#     chunk_size=1000,
-#     chunk_overlap=200
-# )
 
-import mysql.connector.pooling
+# 启动钩子：建表在第一个请求前同步执行，RAG索引在后台构建，完成前故事生成不带检索素材
+startup = Startup()
 
-# MySQL 连接池配置
-dbconfig = {
-    "host": os.getenv('MYSQL_HOST', 'localhost'),
-    "port": int(os.getenv('MYSQL_PORT', 3306)),
-    "user": os.getenv('MYSQL_USER', 'root'),
-    "password": os.getenv('MYSQL_PASSWORD'),
-    "database": os.getenv('MYSQL_DB', 'story_app'),
-    "pool_name": "story_pool",
-    "pool_size": 5,
-    "autocommit": True,
-    "connect_timeout": 5
-}
 
-connection_pool = mysql.connector.pooling.MySQLConnectionPool(**dbconfig)
+@startup.hook('storage')
+def init_storage():
+    storage.init_schema()
+    return {'backend': storage.name}
 
 
-def get_mysql_connection():
-    max_retries = 3
-    last_error = None
-    conn = None
+@startup.hook('rag', background=True)
+def init_rag():
+    rag_status = rag.init_rag(data_dir="story_data")  # 确保目录存在
+    if rag_status.get("status") == "error":
+        raise RuntimeError(rag_status.get("error"))
+    return rag_status
 
-    for attempt in range(max_retries):
-        try:
-            conn = connection_pool.get_connection()
-            # 验证连接是否有效
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT 1")
-                cursor.fetchall()  # 确保读取所有结果
-
-            # 检查连接是否超过1小时未使用
-            if hasattr(conn, '_creation_time'):
-                if time.time() - conn._creation_time > 3600:
-                    conn.reconnect()
-            else:
-                conn._creation_time = time.time()
-            return conn
-
-        except mysql.connector.Error as err:
-            last_error = err
-            app.logger.error(f"数据库连接尝试 {attempt + 1}/{max_retries} 失败: {err}")
-            if attempt < max_retries - 1:
-                time.sleep(1)  # 等待1秒后重试
-            if conn and conn.is_connected():
-                conn.close()
-
-    # 所有重试都失败后抛出最后一个错误
-    raise mysql.connector.PoolError(f"无法获取数据库连接: {last_error}")
-
-
-# 初始化数据库
-def init_db():
-    try:
-        # 测试数据库连接是否可用
-        try:
-            conn = get_mysql_connection()
-            if conn is None:
-                raise mysql.connector.PoolError("无法获取数据库连接")
-        except mysql.connector.Error as e:
-            app.logger.error(f"数据库连接测试失败: {str(e)}")
-            raise
 
-        try:
-            with conn.cursor() as cursor:
-                # 创建users表（必须先创建，因为其他表引用它）
-                cursor.execute("""
-                               CREATE TABLE IF NOT EXISTS users
-                               (
-                                   id
-                                   INT
-                                   AUTO_INCREMENT
-                                   PRIMARY
-                                   KEY,
-                                   username
-                                   VARCHAR
-                               (
-                                   255
-                               ) UNIQUE NOT NULL,
-                                   password VARCHAR
-                               (
-                                   255
-                               ) NOT NULL
-                                   )
-                               """)
-
-                # 创建conversations表
-                cursor.execute("""
-                               CREATE TABLE IF NOT EXISTS conversations
-                               (
-                                   id
-                                   INT
-                                   AUTO_INCREMENT
-                                   PRIMARY
-                                   KEY,
-                                   user_id
-                                   INT
-                                   NOT
-                                   NULL,
-                                   title
-                                   VARCHAR
-                               (
-                                   255
-                               ) NOT NULL,
-                                   created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                                   FOREIGN KEY
-                               (
-                                   user_id
-                               ) REFERENCES users
-                               (
-                                   id
-                               ) ON DELETE CASCADE
-                                   )
-                               """)
-
-                # 创建chat_history表
-                cursor.execute("""
-                               CREATE TABLE IF NOT EXISTS chat_history
-                               (
-                                   id
-                                   INT
-                                   AUTO_INCREMENT
-                                   PRIMARY
-                                   KEY,
-                                   user_id
-                                   INT
-                                   NOT
-                                   NULL,
-                                   role
-                                   ENUM
-                               (
-                                   'user',
-                                   'assistant'
-                               ) NOT NULL,
-                                   content TEXT NOT NULL,
-                                   timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                                   conversation_id INT,
-                                   FOREIGN KEY
-                               (
-                                   user_id
-                               ) REFERENCES users
-                               (
-                                   id
-                               ) ON DELETE CASCADE,
-                                   FOREIGN KEY
-                               (
-                                   conversation_id
-                               ) REFERENCES conversations
-                               (
-                                   id
-                               )
-                                 ON DELETE CASCADE
-                                   )
-                               """)
-
-                # 创建story_history表
-                cursor.execute("""
-                               CREATE TABLE IF NOT EXISTS story_history
-                               (
-                                   id
-                                   INT
-                                   AUTO_INCREMENT
-                                   PRIMARY
-                                   KEY,
-                                   user_id
-                                   INT
-                                   NOT
-                                   NULL,
-                                   input_prompt
-                                   TEXT,
-                                   thinking
-                                   TEXT,
-                                   story
-                                   TEXT,
-                                   timestamp
-                                   DATETIME
-                                   DEFAULT
-                                   CURRENT_TIMESTAMP,
-                                   FOREIGN
-                                   KEY
-                               (
-                                   user_id
-                               ) REFERENCES users
-                               (
-                                   id
-                               ) ON DELETE CASCADE
-                                   )
-                               """)
-        except Error as e:
-            app.logger.error(f"数据库初始化失败: {str(e)}")
-            raise
-        conn.commit()
-    except Error as e:
-        app.logger.error(f"数据库初始化失败: {str(e)}")
-        raise
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
-
-
-init_db()
+if STORY_JOB_RUNNER:
+    @startup.hook('story_jobs', background=True)
+    def start_story_jobs():
+        # 恢复上次进程中断时未完成的条目
+        return story_jobs.start()
+
+
+if SEMANTIC_CACHE_ENABLED:
+    @startup.hook('semantic_cache', background=True)
+    def build_semantic_cache():
+        return semantic_cache.sync()
+
+
+if ARCHIVE_AFTER_DAYS > 0:
+    @startup.hook('archive', background=True)
+    def start_archive():
+        return archive_service.start(float(os.getenv('ARCHIVE_INTERVAL_HOURS', 24)))
+
+
+def ensure_started():
+    # 数据库未就绪时除健康检查外的请求直接返回503
+    if not startup.ensure_started() and request.endpoint != 'api.health':
+        response = jsonify({'error': 'SERVICE_STARTING', 'message': '服务启动中，请稍后重试'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+
+def hasher_busy_response():
+    response = jsonify({'error': 'SERVER_BUSY', 'message': '登录人数较多，请稍后重试'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+def cached_json_response(user_id, kind, loader, **shape):
+    """读穿缓存返回JSON列表，携带ETag，内容未变时返回304"""
+    entry = history_cache.get_or_load(user_id, kind, shape, lambda: current_app.json.dumps(loader()))
+    response = current_app.response_class(entry['body'], mimetype='application/json')
+    response.set_etag(entry['etag'])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+# 所有接口与命令行命令都注册在蓝图上，由create_app()挂到应用
+api = Blueprint('api', __name__, cli_group=None)
+
+
+def require_storage():
+    """命令行命令不经过请求钩子，执行前显式完成数据库初始化"""
+    if not startup.ensure_started(background=False):
+        raise click.ClickException(f"数据库初始化失败: {startup.status('storage').get('error')}")
+
+
+@api.cli.command('repair-conversation-summaries')
+@click.option('--user-id', type=int, default=None, help='只修复指定用户的对话')
+def repair_conversation_summaries_command(user_id):
+    """回填/修复conversations上的消息计数、最后更新时间与预览"""
+    require_storage()
+    refreshed = storage.refresh_conversation_summaries(user_id)
+    click.echo(f"已修复 {refreshed} 个对话的摘要")
+
+
+@api.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """重建故事与聊天记录的全文检索索引（SQLite后端）"""
+    require_storage()
+    indexed = storage.rebuild_search_index()
+    click.echo(f"已索引 {indexed} 条记录")
+
+
+@api.cli.command('backfill-sentiment')
+@click.option('--limit', type=int, default=None, help='最多处理的消息数')
+def backfill_sentiment_command(limit):
+    """为尚未打分的历史消息补充情感结果并累加到每日汇总"""
+    require_storage()
+    recorded = 0
+    while limit is None or recorded < limit:
+        size = 500 if limit is None else min(500, limit - recorded)
+        messages = storage.list_unscored_messages(size)
+        if not messages:
+            break
+        recorded += sentiment_service.record(messages)
+    click.echo(f"已为 {recorded} 条消息补充情感结果")
+
+
+@api.cli.command('rebuild-sentiment-daily')
+def rebuild_sentiment_daily_command():
+    """按消息上已记录的情感结果重建每日汇总"""
+    require_storage()
+    rows = storage.rebuild_sentiment_daily()
+    click.echo(f"已重建 {rows} 行每日情感汇总")
+
+
+@api.cli.command('compact-history')
+@click.option('--days', type=float, default=None, help='归档超过该天数的记录，默认ARCHIVE_AFTER_DAYS或180')
+@click.option('--max-batches', type=int, default=None, help='最多处理的批数')
+def compact_history_command(days, max_batches):
+    """把较早的故事与聊天正文压缩归档，并报告节省的空间"""
+    require_storage()
+    report = archive_service.compact(max_batches, min_age_days=days)
+    click.echo(f"已归档 {report['rows']} 条记录（{report['batches']} 批），"
+               f"{report['raw_bytes']} -> {report['stored_bytes']} 字节，节省 {report['saved_bytes']} 字节")
+    for source, totals in report['totals'].items():
+        click.echo(f"  {source}: 共 {totals['rows']} 条，{totals['raw_bytes']} -> {totals['stored_bytes']} 字节")
 
 
 # JWT
@@ -315,103 +364,157 @@ def create_token(user_id):
         'user_id': user_id,
         'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
     }
-    return pyjwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+    return pyjwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
 
 
 # 保存消息与故事
-def save_chat_message(user_id, role, content, conversation_id=None):
-    conn = get_mysql_connection()
-    cursor = conn.cursor()
+def save_chat_message(user_id, role, content, conversation_id=None, verify_owner=False):
+    """verify_owner为True且对话不属于该用户时返回None"""
+    message_id = storage.save_chat_message(user_id, role, content, conversation_id, verify_owner=verify_owner)
+    if message_id is None:
+        return None
+    history_cache.invalidate(user_id, 'chat_history', *(['conversations'] if conversation_id else []))
+    sentiment_service.submit(message_id, content)
     if conversation_id:
-        cursor.execute(
-            "INSERT INTO chat_history (user_id, role, content, conversation_id) VALUES (%s, %s, %s, %s)",
-            (user_id, role, content, conversation_id)
-        )
-    else:
-        cursor.execute(
-            "INSERT INTO chat_history (user_id, role, content) VALUES (%s, %s, %s)",
-            (user_id, role, content)
-        )
-    conn.commit()
-    conn.close()
+        conversation_context.submit(conversation_id)
+    return message_id
 
 
 def save_story_history(user_id, input_prompt, thinking, story):
-    conn = get_mysql_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO story_history (user_id, input_prompt, thinking, story) VALUES (%s, %s, %s, %s)",
-        (user_id, input_prompt, thinking, story)
-    )
-    conn.commit()
-    conn.close()
+    story_id = storage.save_story_history(user_id, input_prompt, thinking, story)
+    history_cache.invalidate(user_id, 'story_history')
+    return story_id
 
 
-# 注册接口
-@app.route('/api/rag_status', methods=['GET'])
+def build_story_prompt(prompt: str, conversation: str = '') -> str:
+    """故事模板加上之前的对话与RAG检索到的素材；索引未就绪或检索失败时不加素材"""
+    base = story_template.format(message=prompt)
+    if conversation:
+        base += f"\n之前的对话（据此延续孩子的情绪与反馈）:\n{conversation}\n"
+    try:
+        rag_docs = rag.search(prompt) if startup.done('rag') else []
+        with span('prompt_build'):
+            context = "\n---\n".join([d.page_content for d in rag_docs])
+            return f"{base}\n\n相关素材参考:\n{context}"
+    except Exception as e:
+        logger.error(f"RAG检索失败: {str(e)}")
+        return base
+
+
+def dashscope_headers(stream: bool) -> dict:
+    headers = {
+        "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    if stream:
+        headers["X-DashScope-SSE"] = "enable"
+    return headers
+
+
+def story_payload(enhanced_prompt: str, stream: bool) -> dict:
+    return {
+        "model": "qwen-turbo",
+        "input": {
+            "messages": [{
+                "role": "user",
+                "content": enhanced_prompt
+            }]
+        },
+        "parameters": {
+            "incremental_output": stream,
+            "temperature": 0.8,
+            "top_p": 0.9
+        }
+    }
+
+
+def split_story(full_text: str):
+    """模型输出按 '思考过程 - 故事' 拆分，返回 (思考过程, 故事)"""
+    thinking, story = ('', full_text)
+    if '-' in full_text:
+        parts = full_text.split('-', 1)
+        if len(parts) == 2:
+            thinking, story = parts
+    return thinking.strip(), story.strip()
+
+
+def generate_story_text(prompt: str):
+    """非流式生成一个故事，供批量任务复用同一套RAG与提示词，返回 (思考过程, 故事)"""
+    response = requests.post(DASHSCOPE_API_URL, json=story_payload(build_story_prompt(prompt), stream=False),
+                             headers=dashscope_headers(stream=False), timeout=STORY_JOB_TIMEOUT)
+    if response.status_code == 429:
+        raise UpstreamThrottled(float(response.headers.get('Retry-After', 5)))
+    response.raise_for_status()
+    result = response.json()
+    if 'output' not in result or 'text' not in result['output']:
+        raise ValueError('无效的API响应格式')
+    return split_story(result['output']['text'])
+
+
+# 就绪检查：数据库初始化完成后返回200，RAG索引在后台构建，其状态仅供参考
+@api.route('/api/health', methods=['GET'])
+def health():
+    hooks = startup.status()
+    failed = any(hook['state'] == 'error' and not hook['background'] for hook in hooks.values())
+    return jsonify({
+        'status': 'ok' if startup.ready else ('error' if failed else 'starting'),
+        'uptime': round(time.time() - startup.started_at, 3),
+        'startup': hooks
+    }), 200 if startup.ready else 503
+
+
+@api.route('/api/rag_status', methods=['GET'])
 def rag_status():
-    return jsonify(rag.get_status())
+    return jsonify(startup.status('rag'))
+
+
+# 注册接口
 
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
     username = data.get('username')
     password = data.get('password')
     if not username or not password:
         return jsonify({'error': '用户名和密码不能为空'}), 400
-    hashed_password = generate_password_hash(password)
     try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username=%s", (username,))
-        if cursor.fetchone():
+        hashed_password = password_hasher.hash(password)
+        user_id = storage.create_user(username, hashed_password)
+        if user_id is None:
             return jsonify({'error': 'REGISTER_ERROR', 'message': '用户名已存在', 'action': 'redirect_to_login'}), 400
-        cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed_password))
-        conn.commit()
-        user_id = cursor.lastrowid
-        conn.close()
         token = create_token(user_id)
         return jsonify({'token': token, 'user_id': user_id}), 201
-    except Error as e:
+    except HasherBusy:
+        return hasher_busy_response()
+    except StorageError as e:
         return jsonify({'error': '数据库错误', 'message': str(e)}), 500
 
 
 # 登录接口
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get('username')
     password = data.get('password')
     try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, password FROM users WHERE username=%s", (username,))
-        user = cursor.fetchone()
-        conn.close()
-        if not user or not check_password_hash(user[1], password):
+        user = storage.get_user_by_username(username)
+        if not user or not password_hasher.verify(user['password'], password):
             return jsonify({'error': 'LOGIN_ERROR', 'message': '用户名或密码错误'}), 401
-        token = create_token(user[0])
-        return jsonify({'token': token, 'user_id': user[0]})
-    except Error as e:
+        if password_hasher.needs_rehash(user['password']):
+            # 哈希参数调整后，在用户下次登录时透明升级
+            password_hasher.rehash_later(password, lambda new_hash: storage.update_password(user['id'], new_hash))
+        token = create_token(user['id'])
+        return jsonify({'token': token, 'user_id': user['id']})
+    except HasherBusy:
+        return hasher_busy_response()
+    except StorageError as e:
         return jsonify({'error': '数据库错误', 'message': str(e)}), 500
 
 
 # 调用通义千问API
-@app.route('/api/ask', methods=['POST'])
+@api.route('/api/ask', methods=['POST'])
+@login_required
 def ask_question():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': '未提供有效的认证token'}), 401
-
-    token = auth_header.split(' ')[1]
-
-    try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-    except pyjwt.ExpiredSignatureError:
-        return jsonify({'error': 'token已过期'}), 401
-    except pyjwt.InvalidTokenError:
-        return jsonify({'error': '无效的token'}), 401
-
     data = request.get_json()
     if not data or 'question' not in data:
         return jsonify({'error': '缺少问题参数'}), 400
@@ -421,7 +524,7 @@ def ask_question():
     try:
         url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
         headers = {
-            "Authorization": f"Bearer {app.config['TONGYI_API_KEY']}",
+            "Authorization": f"Bearer {current_app.config['TONGYI_API_KEY']}",
             "Content-Type": "application/json"
         }
         payload = {
@@ -449,166 +552,203 @@ def ask_question():
         })
 
     except requests.exceptions.RequestException as e:
-        app.logger.error(f'调用通义千问API失败: {str(e)}')
+        current_app.logger.error(f'调用通义千问API失败: {str(e)}')
         return jsonify({'error': f'调用AI服务失败: {str(e)}'}), 500
     except ValueError as e:
-        app.logger.error(f'API响应解析失败: {str(e)}')
+        current_app.logger.error(f'API响应解析失败: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
 
+def stream_response(stream, after_seq=0):
+    # 生成器主体在生产线程（上游读取在其派生线程）中执行，性能分析需同时采样
+    follow_threads(stream.producer_name)
+    frames = stream_hub.subscribe(stream, after_seq)
+    if STREAM_GZIP and 'gzip' in request.accept_encodings:
+        response = Response(gzip_frames(frames), mimetype='text/event-stream')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(frames, mimetype='text/event-stream')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['X-Stream-Id'] = stream.id
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def cached_story_response(user_id, prompt, hit):
+    def replay():
+        yield from semantic_cache.replay(hit)
+        with span('finalize'):
+            save_story_history(user_id, prompt, hit['thinking'], hit['story'])
+            save_chat_message(user_id, 'assistant', hit['story'])
+
+    response = stream_response(stream_hub.start(user_id, replay()))
+    response.headers['X-Story-Cache'] = f"hit; story_id={hit['story_id']}; similarity={hit['similarity']:.3f}"
+    return response
+
+
 # 故事生成接口（流式）
-@app.route('/api/generate_story', methods=['POST'])
+@api.route('/api/generate_story', methods=['POST'])
+@login_required
 def generate_story():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': '未提供有效的认证token'}), 401
+    user_id = g.user_id
 
-    token = auth_header.split(' ')[1]
-    try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = payload['user_id']
-    except pyjwt.ExpiredSignatureError:
-        return jsonify({'error': 'token已过期'}), 401
-    except pyjwt.InvalidTokenError:
-        return jsonify({'error': '无效的token'}), 401
+    # 断线重连：带Last-Event-ID时从原来的流续传，不重新生成
+    resume = parse_last_event_id(request.headers.get('Last-Event-ID'))
+    if resume:
+        stream = stream_hub.get(user_id, resume[0])
+        if stream is None or not stream.can_resume(resume[1]):
+            return jsonify({'error': 'STREAM_EXPIRED', 'message': '故事流已过期，请重新生成'}), 410
+        return stream_response(stream, resume[1])
 
     # 获取请求数据
     data = request.get_json()
     if not data or 'prompt' not in data:
         return jsonify({'error': '缺少prompt参数'}), 400
 
-    # 保存用户输入
-    save_chat_message(user_id, 'user', data['prompt'])
-
-    # 使用RAG检索相关素材
-    try:
-        rag_docs = rag.search(data['prompt']) if rag else []
-        context = "\n---\n".join([d.page_content for d in rag_docs])
+    # 保存用户输入；带conversation_id时校验对话归属
+    conversation_id = data.get('conversation_id')
+    message_id = save_chat_message(user_id, 'user', data['prompt'], conversation_id, verify_owner=True)
+    if message_id is None:
+        return jsonify({'error': '无效的对话ID'}), 400
+
+    # 语义缓存命中时回放已有故事，同样记入故事历史；fresh为true时强制重新生成
+    # 多轮对话中的故事依赖上下文，不走缓存
+    if SEMANTIC_CACHE_ENABLED and not data.get('fresh') and not conversation_id and startup.done('semantic_cache'):
+        with span('semantic_cache_lookup'):
+            hit = semantic_cache.lookup(user_id, data['prompt'])
+        if hit:
+            return cached_story_response(user_id, data['prompt'], hit)
+
+    # 多轮对话带上滚动摘要与最近几轮，长度不随对话轮数增长
+    conversation = ''
+    if conversation_id:
+        with span('conversation_context'):
+            conversation = conversation_context.build(conversation_id, before_id=message_id)
 
-        # 构建增强提示词
-        enhanced_prompt = f"{story_template}\n\n相关素材参考:\n{context}".format(
-            message=data['prompt']
-        )
-    except Exception as e:
-        # RAG检索失败时回退到原始提示词
-        enhanced_prompt = story_template.format(message=data['prompt'])
-        app.logger.error(f"RAG检索失败: {str(e)}")
-
-    # 准备API请求
-    headers = {
-        "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-        "Content-Type": "application/json",
-        "X-DashScope-SSE": "enable"
-    }
-    payload = {
-        "model": "qwen-turbo",
-        "input": {
-            "messages": [{
-                "role": "user",
-                "content": enhanced_prompt
-            }]
-        },
-        "parameters": {
-            "incremental_output": True,
-            "temperature": 0.8,
-            "top_p": 0.9
-        }
-    }
+    # 使用RAG检索相关素材构建增强提示词
+    enhanced_prompt = build_story_prompt(data['prompt'], conversation)
+    headers = dashscope_headers(stream=True)
+    payload = story_payload(enhanced_prompt, stream=True)
 
     result_buffer = []
 
     def generate():
+        started = time.perf_counter()
+        output_tokens = 0
+
+        def upstream_text(response):
+            nonlocal output_tokens
+            chunks = response.iter_content(chunk_size=None)
+            for text, tokens in story_deltas(chunks, lambda e: logger.error(f"流数据解析错误: {str(e)}")):
+                if not result_buffer:
+                    observe('upstream_ttft', time.perf_counter() - started)
+                # usage.output_tokens为累计值，缺失时按片段数计
+                output_tokens = tokens if tokens is not None else output_tokens + 1
+                result_buffer.append(text)
+                yield text
+
         try:
-            with requests.post(DASHSCOPE_API_URL, json=payload, headers=headers, stream=True, timeout=30) as response:
+            with span('upstream_connect'):
+                response = requests.post(DASHSCOPE_API_URL, json=payload, headers=headers, stream=True, timeout=30)
+            with response:
                 response.raise_for_status()
-
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith('data:'):
-                            try:
-                                data_chunk = json.loads(decoded_line[5:])
-                                if 'output' in data_chunk and 'text' in data_chunk['output']:
-                                    text = data_chunk['output']['text']
-                                    result_buffer.append(text)
-                                    yield f"data: {json.dumps({'text': text})}\n\n"
-                            except (json.JSONDecodeError, KeyError) as e:
-                                app.logger.error(f"流数据解析错误: {str(e)}")
-                                continue
+                # 直接解析原始字节流，细碎的增量合并成较大的帧再推送；上游读取在独立线程中，停顿时也按时发出
+                yield from coalesce_frames(UpstreamReader(upstream_text(response)),
+                                           STREAM_COALESCE_BYTES, STREAM_COALESCE_DELAY)
         except Exception as e:
-            app.logger.error(f"流式请求失败: {str(e)}")
+            logger.error(f"流式请求失败: {str(e)}")
             yield f"data: {json.dumps({'error': '故事生成中断'})}\n\n"
+        finally:
+            observe('stream', time.perf_counter() - started)
+            TOKENS_STREAMED.labels('generate_story').inc(output_tokens)
 
     def finalize():
-        full_text = ''.join(result_buffer)
-        thinking, story = ('', full_text)
-        if '-' in full_text:
-            parts = full_text.split('-', 1)
-            if len(parts) == 2:
-                thinking, story = parts
-        save_story_history(user_id, data['prompt'], thinking.strip(), story.strip())
-        save_chat_message(user_id, 'assistant', story.strip())
+        thinking, story = split_story(''.join(result_buffer))
+        save_story_history(user_id, data['prompt'], thinking, story)
+        save_chat_message(user_id, 'assistant', story, conversation_id)
+        if SEMANTIC_CACHE_ENABLED and startup.done('semantic_cache'):
+            semantic_cache.sync()
 
     def generate_with_finalization():
         for chunk in generate():
             yield chunk
-        finalize()
+        with span('finalize'):
+            finalize()
+
+    # 上游读取在生产线程中进行，客户端断开不会中断生成
+    return stream_response(stream_hub.start(user_id, generate_with_finalization()))
+
+
+# 批量故事任务：提交一组提示词，后台按限速生成并写入故事历史
+@api.route('/api/story_jobs', methods=['POST'])
+@login_required
+def create_story_job():
+    data = request.get_json(silent=True) or {}
+    prompts = data.get('prompts')
+    if not isinstance(prompts, list) or not prompts:
+        return jsonify({'error': 'prompts应为非空列表'}), 400
+    if len(prompts) > STORY_JOB_MAX_PROMPTS:
+        return jsonify({'error': f'单个任务最多{STORY_JOB_MAX_PROMPTS}个提示词'}), 400
+    prompts = [prompt.strip() if isinstance(prompt, str) else '' for prompt in prompts]
+    if not all(prompts):
+        return jsonify({'error': '提示词不能为空'}), 400
 
-    return Response(generate_with_finalization(), mimetype='text/event-stream')
+    try:
+        job_id = story_jobs.submit(g.user_id, prompts)
+    except StorageError as e:
+        return jsonify({'error': '数据库错误', 'message': str(e)}), 500
+    return jsonify({'id': job_id, 'status': 'pending', 'total': len(prompts)}), 202
 
 
-@app.route('/api/save_chat', methods=['POST'])
-def save_chat():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        app.logger.error('未提供token')
-        return jsonify({'error': '未提供token'}), 401
+@api.route('/api/story_jobs', methods=['GET'])
+@login_required
+def list_story_jobs():
+    try:
+        return jsonify(story_jobs.list_jobs(g.user_id))
+    except StorageError as e:
+        return jsonify({'error': '数据库错误', 'message': str(e)}), 500
+
 
-    token = auth_header.split(' ')[1]
+@api.route('/api/story_jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_story_job(job_id):
     try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = payload['user_id']
-    except pyjwt.InvalidTokenError as e:
-        app.logger.error(f'无效token: {str(e)}')
-        return jsonify({'error': '无效token'}), 401
+        job = story_jobs.get_job(g.user_id, job_id)
+    except StorageError as e:
+        return jsonify({'error': '数据库错误', 'message': str(e)}), 500
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
+
+@api.route('/api/story_jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_story_job(job_id):
+    try:
+        if not story_jobs.cancel(g.user_id, job_id):
+            return jsonify({'error': '任务不存在或已结束'}), 404
+    except StorageError as e:
+        return jsonify({'error': '数据库错误', 'message': str(e)}), 500
+    return jsonify({'id': job_id, 'status': 'cancelled'})
+
+
+@api.route('/api/save_chat', methods=['POST'])
+@login_required
+def save_chat():
+    user_id = g.user_id
 
     data = request.get_json()
     if not data or 'content' not in data or 'role' not in data:
-        app.logger.error('缺少必要参数')
+        current_app.logger.error('缺少必要参数')
         return jsonify({'error': '缺少必要参数'}), 400
 
-    conn = None
+    conversation_id = data.get('conversation_id')
     try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-
-        # 检查conversation_id是否存在
-        conversation_id = data.get('conversation_id')
-        if conversation_id:
-            # 验证conversation_id属于当前用户
-            cursor.execute("SELECT id FROM conversations WHERE id=%s AND user_id=%s",
-                           (conversation_id, user_id))
-            if not cursor.fetchone():
-                app.logger.error(f'无效的conversation_id: {conversation_id}')
-                return jsonify({'error': '无效的对话ID'}), 400
-
-            sql = """
-                  INSERT INTO chat_history
-                      (user_id, role, content, conversation_id)
-                  VALUES (%s, %s, %s, %s) \
-                  """
-            params = (user_id, data['role'], data['content'], conversation_id)
-        else:
-            sql = """
-                  INSERT INTO chat_history
-                      (user_id, role, content)
-                  VALUES (%s, %s, %s) \
-                  """
-            params = (user_id, data['role'], data['content'])
-
-        cursor.execute(sql, params)
-        conn.commit()
-        message_id = cursor.lastrowid
+        # 同一事务中校验conversation_id属于当前用户、写入消息并更新对话摘要
+        message_id = save_chat_message(user_id, data['role'], data['content'], conversation_id, verify_owner=True)
+        if message_id is None:
+            current_app.logger.error(f'无效的conversation_id: {conversation_id}')
+            return jsonify({'error': '无效的对话ID'}), 400
 
         return jsonify({
             'id': message_id,
@@ -616,178 +756,119 @@ def save_chat():
             'conversation_id': conversation_id
         }), 201
 
-    except Error as e:
-        app.logger.error(f'数据库错误: {str(e)}')
+    except StorageError as e:
+        current_app.logger.error(f'数据库错误: {str(e)}')
         return jsonify({
             'error': '数据库错误',
-            'message': str(e),
-            'sql': sql,
-            'params': params
+            'message': str(e)
         }), 500
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
 
 
 # 查询故事历史
-@app.route('/api/story_history', methods=['GET'])
+@api.route('/api/story_history', methods=['GET'])
+@login_required
 def story_history():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': '未提供token'}), 401
-    token = auth_header.split(' ')[1]
-    try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = payload['user_id']
-    except pyjwt.InvalidTokenError:
-        return jsonify({'error': '无效token'}), 401
-
-    conn = get_mysql_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM story_history WHERE user_id=%s ORDER BY timestamp DESC", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return jsonify(rows)
+    user_id = g.user_id
+    return cached_json_response(user_id, 'story_history', lambda: storage.list_story_history(user_id))
 
 
 # 查询聊天历史
-@app.route('/api/chat_history', methods=['GET'])
+@api.route('/api/chat_history', methods=['GET'])
+@login_required
 def chat_history():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': '未提供token'}), 401
-    token = auth_header.split(' ')[1]
+    user_id = g.user_id
+    return cached_json_response(user_id, 'chat_history', lambda: storage.list_chat_history(user_id))
+
+
+# 检索故事与聊天历史
+@api.route('/api/search', methods=['GET'])
+@login_required
+def search_history():
+    user_id = g.user_id
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '缺少q参数'}), 400
+    source = request.args.get('type', 'all')
+    if source != 'all' and source not in SEARCH_SOURCES:
+        return jsonify({'error': 'type只能为all、story或chat'}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = min(max(request.args.get('page_size', 20, type=int), 1), 50)
+
+    started = time.perf_counter()
     try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = payload['user_id']
-    except pyjwt.InvalidTokenError:
-        return jsonify({'error': '无效token'}), 401
+        result = storage.search_history(
+            user_id, query,
+            sources=SEARCH_SOURCES if source == 'all' else (source,),
+            limit=page_size,
+            offset=(page - 1) * page_size
+        )
+    except StorageError as e:
+        return jsonify({'error': '数据库错误', 'message': str(e)}), 500
 
-    conn = get_mysql_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM chat_history WHERE user_id=%s ORDER BY timestamp DESC", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return jsonify(rows)
+    return jsonify({
+        'query': query,
+        'page': page,
+        'page_size': page_size,
+        'total': result['total'],
+        'hits': result['hits'],
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
+    })
 
 
 # 创建新对话
-@app.route('/api/conversations', methods=['POST'])
+@api.route('/api/conversations', methods=['POST'])
+@login_required
 def create_conversation():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': '未提供token'}), 401
-    token = auth_header.split(' ')[1]
-    try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = payload['user_id']
-    except pyjwt.InvalidTokenError:
-        return jsonify({'error': '无效token'}), 401
+    user_id = g.user_id
 
     data = request.get_json()
     if not data or 'title' not in data:
         return jsonify({'error': '缺少title参数'}), 400
 
     try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO conversations (user_id, title) VALUES (%s, %s)",
-            (user_id, data['title'])
-        )
-        conn.commit()
-        conversation_id = cursor.lastrowid
-        conn.close()
+        conversation_id = storage.create_conversation(user_id, data['title'])
+        history_cache.invalidate(user_id, 'conversations')
         return jsonify({
             'id': conversation_id,
             'title': data['title'],
             'created_at': datetime.datetime.now().isoformat()
         }), 201
-    except Error as e:
+    except StorageError as e:
         return jsonify({'error': '数据库错误', 'message': str(e)}), 500
 
 
 # 获取用户所有对话
-@app.route('/api/conversations', methods=['GET'])
+@api.route('/api/conversations', methods=['GET'])
+@login_required
 def get_conversations():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': '未提供token'}), 401
-    token = auth_header.split(' ')[1]
-    try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = payload['user_id']
-    except pyjwt.InvalidTokenError:
-        return jsonify({'error': '无效token'}), 401
-
-    conn = get_mysql_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-                   SELECT c.id,
-                          c.title,
-                          c.created_at,
-                          COUNT(m.id)      as message_count,
-                          MAX(m.timestamp) as last_updated
-                   FROM conversations c
-                            LEFT JOIN chat_history m ON c.id = m.conversation_id
-                   WHERE c.user_id = %s
-                   GROUP BY c.id
-                   ORDER BY last_updated DESC
-                   """, (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return jsonify(rows)
-
-
-@app.route('/api/delete_chat', methods=['DELETE'])
+    user_id = g.user_id
+    return cached_json_response(user_id, 'conversations', lambda: storage.list_conversations(user_id))
+
+
+@api.route('/api/delete_chat', methods=['DELETE'])
+@login_required
 def delete_chat():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': '未提供token'}), 401
-    token = auth_header.split(' ')[1]
-    try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user_id = payload['user_id']
-    except pyjwt.InvalidTokenError:
-        return jsonify({'error': '无效token'}), 401
+    user_id = g.user_id
 
     data = request.get_json()
     if not data or 'message_id' not in data:
         return jsonify({'error': '缺少message_id参数'}), 400
 
     try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "DELETE FROM chat_history WHERE id=%s AND user_id=%s",
-            (data['message_id'], user_id)
-        )
-        conn.commit()
-        affected_rows = cursor.rowcount
-        conn.close()
-
-        if affected_rows == 0:
+        deleted, conversation_id = storage.delete_chat_message(user_id, data['message_id'])
+        if not deleted:
             return jsonify({'error': '未找到消息或无权删除'}), 404
+        history_cache.invalidate(user_id, 'chat_history', 'sentiment_trend',
+                                 *(['conversations'] if conversation_id else []))
         return jsonify({'success': True}), 200
-    except Error as e:
+    except StorageError as e:
         return jsonify({'error': '数据库错误', 'message': str(e)}), 500
 
 
-@app.route('/api/analyze_sentiment2', methods=['POST'])
+@api.route('/api/analyze_sentiment2', methods=['POST'])
+@login_required
 def analyze_sentiment2():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({'error': '未提供有效的认证token'}), 401
-
-    token = auth_header.split(' ')[1]
-
-    try:
-        payload = pyjwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-    except pyjwt.ExpiredSignatureError:
-        return jsonify({'error': 'token已过期'}), 401
-    except pyjwt.InvalidTokenError:
-        return jsonify({'error': '无效的token'}), 401
-
     try:
         data = request.get_json()
         messages = data.get('messages', [])
@@ -795,126 +876,12 @@ def analyze_sentiment2():
         if not messages:
             return jsonify({'error': '没有提供消息内容'}), 400
 
-        # 收集所有消息的时间戳
-        timestamps = []
-        for msg in messages:
-            timestamp = msg.get('timestamp')
-            # 确保时间戳是有效的日期格式
-            if timestamp and isinstance(timestamp, str) and 'T' in timestamp:
-                try:
-                    # 验证并标准化时间格式
-                    dt = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                    timestamps.append(dt.isoformat())
-                except ValueError:
-                    timestamps.append(datetime.datetime.now().isoformat())
-            else:
-                # 没有时间戳或格式无效，使用当前时间
-                timestamps.append(datetime.datetime.now().isoformat())
-
-        # 改进的提示词，确保返回正确的JSON格式
-        prompt = f"""请分析以下对话的情感倾向,严格按照要求返回JSON格式数据:
-        {{
-            "overall": {{
-                "label": "负面/中性/正面", 
-                "score": 0.85,  // 0-1之间的小数
-                "recommendation": "建议内容"
-            }},
-            "daily": [
-                {{
-                    "date": "YYYY-MM-DD",  // 仅日期部分，不要时间
-                    "label": "负面/中性/正面", 
-                    "score": 0.75  // 0-1之间的小数
-                }}
-            ],
-            "samples": [
-                {{
-                    "content": "消息内容", 
-                    "sentiment": {{
-                        "label": "负面/中性/正面", 
-                        "score": 0.9  // 0-1之间的小数
-                    }}
-                }}
-            ]
-        }}
-
-        重要说明：
-        1. 所有score必须是0-1之间的小数
-        2. label只能使用"负面"、"中性"、"正面"三种值
-        3. 样本消息从原始对话中选取最具代表性的3-5条
-        4. 每日情感变化按日期分组分析
-        5. 日期格式必须为YYYY-MM-DD(不要时间部分)
-
-        对话记录:
-        {chr(10).join([f"{msg.get('timestamp', '未知时间')} {msg['role']}: {msg['content']}" for msg in messages])}"""
-
-        headers = {
-            "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "model": "qwen-turbo",
-            "input": {
-                "messages": [{
-                    "role": "user",
-                    "content": prompt
-                }]
-            }
-        }
-
-        response = requests.post(
-            DASHSCOPE_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        response.raise_for_status()
-
-        result = response.json()
-        if 'output' not in result or 'text' not in result['output']:
-            raise ValueError('无效的API响应格式')
-
-        try:
-            analysis_result = json.loads(result['output']['text'])
-
-            # 修正分数值
-            def fix_scores(data):
-                if isinstance(data, dict):
-                    for key, value in data.items():
-                        if key == 'score' and isinstance(value, (int, float)) and value > 1:
-                            data[key] = value / 100.0
-                        elif key == 'date' and isinstance(value, str) and 'T' in value:
-                            # 确保日期格式正确
-                            data[key] = value.split('T')[0]
-                        else:
-                            fix_scores(value)
-                elif isinstance(data, list):
-                    for item in data:
-                        fix_scores(item)
-
-            fix_scores(analysis_result)
-
-            # 添加时间戳到样本消息
-            if 'samples' in analysis_result:
-                for i, sample in enumerate(analysis_result['samples']):
-                    if i < len(timestamps):
-                        sample['timestamp'] = timestamps[i]
-
-            # 确保daily日期格式正确
-            for day in analysis_result.get('daily', []):
-                if 'date' in day and isinstance(day['date'], str):
-                    if 'T' in day['date']:
-                        day['date'] = day['date'].split('T')[0]
-                    elif len(day['date']) > 10:
-                        day['date'] = day['date'][:10]
-
-            return jsonify(analysis_result)
-        except json.JSONDecodeError:
-            return jsonify({
-                'error': 'API返回格式不正确',
-                'raw_response': result['output']['text']
-            }), 500
-
+        return jsonify(sentiment_service.analyze(messages))
+    except ValueError as e:
+        return jsonify({
+            'error': 'API返回格式不正确',
+            'details': str(e)
+        }), 500
     except requests.exceptions.RequestException as e:
         return jsonify({
             'error': '请求AI服务失败',
@@ -929,22 +896,102 @@ def analyze_sentiment2():
         }), 500
 
 
-@app.route('/api/db_status', methods=['GET'])
+@api.route('/api/sentiment_trend', methods=['GET'])
+@login_required
+def sentiment_trend():
+    """按日期范围返回每日情感趋势，直接读取增量维护的汇总表"""
+    user_id = g.user_id
+
+    try:
+        end = datetime.date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.date.today()
+        start = (datetime.date.fromisoformat(request.args['start']) if request.args.get('start')
+                 else end - datetime.timedelta(days=29))
+    except ValueError:
+        return jsonify({'error': '日期格式应为YYYY-MM-DD'}), 400
+    if start > end:
+        return jsonify({'error': '开始日期不能晚于结束日期'}), 400
+
+    from sentiment_service import summarize_daily
+
+    def load():
+        rows = storage.list_sentiment_daily(user_id, start, end)
+        return {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'overall': summarize_daily(rows),
+            'daily': [{'date': row['day'].isoformat(), **summarize_daily([row])} for row in rows]
+        }
+
+    try:
+        return cached_json_response(user_id, 'sentiment_trend', load, start=start.isoformat(), end=end.isoformat())
+    except StorageError as e:
+        return jsonify({'error': '数据库错误', 'message': str(e)}), 500
+
+
+@api.route('/api/db_status', methods=['GET'])
 def db_status():
     try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
-        conn.close()
+        storage.ping()
+        stats = storage.stats()
         return jsonify({
             'status': 'healthy',
-            'pool_size': connection_pool.pool_size,
-            'active_connections': len(connection_pool._cnx_queue._queue)
+            'backend': storage.name,
+            'pool_size': stats.get('size'),
+            'active_connections': stats.get('in_use'),
+            'pool': stats,
+            'cache': history_cache.stats(),
+            'password_hasher': password_hasher.stats(),
+            'auth': current_app.extensions['token_verifier'].stats()
         })
-    except Error as e:
+    except StorageError as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+def create_app(config: Optional[dict] = None) -> Flask:
+    """应用工厂：只注册路由与钩子，不连接数据库、不构建索引，导入与创建都很快"""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET') or 'your-secret-key'
+    app.config['TONGYI_API_KEY'] = DASHSCOPE_API_KEY
+    app.config.update(config or {})
+    CORS(app)
+
+    # 各阶段耗时直方图、Server-Timing响应头与 /metrics 抓取端点
+    init_metrics(app)
+
+    # 按需性能分析：签名请求头 / 管理员预约 / 每N个请求抽样，均未配置时不生效
+    RequestProfiler(
+        output_dir=os.getenv('PROFILE_DIR', 'profiles'),
+        secret=os.getenv('PROFILE_SECRET'),
+        sample_every=int(os.getenv('PROFILE_SAMPLE_EVERY', 0)),
+        admin_ids=[int(uid) for uid in os.getenv('PROFILE_ADMIN_IDS', '').split(',') if uid.strip()],
+        fmt=os.getenv('PROFILE_FORMAT', 'collapsed')
+    ).init_app(app)
+
+    # 统一的token校验：@login_required 写入 g.user_id，解码结果缓存到token过期
+    token_verifier = init_auth(app, max_entries=int(os.getenv('AUTH_CACHE_ENTRIES', 4096)))
+
+    # 第一个请求到达时执行启动钩子
+    app.extensions['startup'] = startup
+    app.before_request(ensure_started)
+    app.register_blueprint(api)
+
+    # 未初始化的组件不为导出指标而提前创建
+    register_stats('storage', lambda: storage.stats() if storage.initialized else {})
+    register_stats('history_cache', history_cache.stats)
+    register_stats('auth', token_verifier.stats)
+    register_stats('password_hasher', password_hasher.stats)
+    register_stats('story_jobs', lambda: story_jobs.stats() if story_jobs.initialized else {})
+    register_stats('semantic_cache', lambda: semantic_cache.stats() if semantic_cache.initialized else {})
+    register_stats('story_streams', stream_hub.stats)
+    register_stats('conversation_context',
+                   lambda: conversation_context.stats() if conversation_context.initialized else {})
+    register_stats('archive', lambda: archive_service.stats() if archive_service.initialized else {})
+    return app
+
+
+app = create_app()
+
+
 if __name__ == '__main__':
+    startup.ensure_started()
     app.run(port=5000, debug=True)
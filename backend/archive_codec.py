@@ -0,0 +1,83 @@
+import functools
+import zlib
+from typing import List, Optional
+
+try:
+    import zstandard
+except ImportError:  # 未安装时退回zlib，已用zstd归档的数据需要安装后才能读取
+    zstandard = None
+
+ZSTD = 'zstd'
+ZLIB = 'zlib'
+DEFAULT_CODEC = ZSTD if zstandard is not None else ZLIB
+
+# payload首字节标记压缩算法，解压时无需查询字典表
+_MARKERS = {ZSTD: b's', ZLIB: b'z'}
+_CODECS = {marker: codec for codec, marker in _MARKERS.items()}
+# zlib预置字典的上限
+ZLIB_DICT_SIZE = 32 * 1024
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError('读取zstd归档需要安装zstandard')
+
+
+@functools.lru_cache(maxsize=16)
+def _zstd_dict(dictionary: bytes):
+    """只缓存解析后的字典；ZstdCompressor/ZstdDecompressor不能被多个线程同时使用，每次调用单独创建"""
+    _require_zstd()
+    return zstandard.ZstdCompressionDict(dictionary)
+
+
+def _zstd_compressor(dictionary: Optional[bytes], level: int):
+    _require_zstd()
+    return zstandard.ZstdCompressor(level=level, dict_data=_zstd_dict(dictionary) if dictionary else None,
+                                    write_checksum=False)
+
+
+def _zstd_decompressor(dictionary: Optional[bytes]):
+    _require_zstd()
+    return zstandard.ZstdDecompressor(dict_data=_zstd_dict(dictionary) if dictionary else None)
+
+
+def train_dictionary(samples: List[bytes], size: int = 64 * 1024, codec: str = DEFAULT_CODEC) -> bytes:
+    """用样本训练压缩字典
+
+    zstd使用zstandard的字典训练；zlib没有训练接口，取样本中重复出现的片段
+    拼成不超过32KB的预置字典，最常见的放在末尾（距离越近编码越短）。
+    """
+    if codec == ZSTD:
+        _require_zstd()
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    counts = {}
+    for sample in samples:
+        text = sample.decode('utf-8', 'ignore')
+        for i in range(0, max(len(text) - 7, 1), 4):
+            piece = text[i:i + 8]
+            counts[piece] = counts.get(piece, 0) + 1
+    frequent = sorted((piece for piece, n in counts.items() if n > 1), key=counts.get)
+    dictionary = ''.join(frequent).encode('utf-8')
+    return dictionary[-min(size, ZLIB_DICT_SIZE):]
+
+
+def compress(data: bytes, dictionary: Optional[bytes] = None, codec: str = DEFAULT_CODEC,
+             level: Optional[int] = None) -> bytes:
+    if codec == ZSTD:
+        body = _zstd_compressor(dictionary or None, 19 if level is None else level).compress(data)
+    else:
+        options = {'zdict': dictionary} if dictionary else {}
+        compressor = zlib.compressobj(9 if level is None else level, zlib.DEFLATED, -15, 9, **options)
+        body = compressor.compress(data) + compressor.flush()
+    return _MARKERS[codec] + body
+
+
+def decompress(payload: bytes, dictionary: Optional[bytes] = None) -> bytes:
+    payload = bytes(payload)
+    codec, body = _CODECS[payload[:1]], payload[1:]
+    if codec == ZSTD:
+        return _zstd_decompressor(dictionary or None).decompress(body)
+    options = {'zdict': dictionary} if dictionary else {}
+    decompressor = zlib.decompressobj(-15, **options)
+    return decompressor.decompress(body) + decompressor.flush()
@@ -0,0 +1,129 @@
+import datetime
+import logging
+import threading
+import time
+from typing import Optional
+
+import archive_codec
+from metrics import span
+from storage import ARCHIVE_SEARCH_CHARS, StorageError, pack_archive_fields
+
+ARCHIVE_SOURCES = ('story', 'chat')
+
+
+class ArchiveService:
+    """冷归档：把超过min_age_days天的故事与聊天正文压缩后移入history_archive
+
+    - 每批最多batch_size条：读取与压缩在事务之外，写入归档与清空原表正文在一个短事务中，批间暂停pause秒
+    - 故事与聊天各用一份训练得到的字典（zstd；未安装zstandard时为zlib预置字典），首次归档时用最早的记录训练
+    - 读取历史时由storage只解压本次返回的行，接口无感知
+
+    原表保留元数据与正文前search_chars个字，计数、情感汇总、对话预览与全文检索照常工作
+    （归档记录只能检索到正文前缀）。
+    清空的空间由数据库复用，缩小文件需另行VACUUM / OPTIMIZE TABLE。
+    """
+
+    def __init__(self, storage, min_age_days: float = 180, batch_size: int = 200, pause: float = 0.1,
+                 codec: str = archive_codec.DEFAULT_CODEC, level: Optional[int] = None,
+                 dict_size: int = 64 * 1024, dict_samples: int = 1000, min_dict_samples: int = 50,
+                 search_chars: int = ARCHIVE_SEARCH_CHARS):
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.min_age_days = min_age_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.codec = codec
+        self.level = level
+        self.dict_size = dict_size
+        self.dict_samples = dict_samples
+        self.min_dict_samples = min_dict_samples
+        self.search_chars = search_chars
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_report = None
+
+    def compact(self, max_batches: Optional[int] = None, min_age_days: Optional[float] = None) -> dict:
+        """归档到期的记录，返回本次归档的条数、原始/压缩后字节数与节省的空间"""
+        started = time.perf_counter()
+        days = self.min_age_days if min_age_days is None else min_age_days
+        before = datetime.datetime.now() - datetime.timedelta(days=days)
+        report = {'rows': 0, 'batches': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+        for source in ARCHIVE_SOURCES:
+            dict_id, dictionary, codec = self._dictionary(source, before)
+            after_id = 0
+            while not self._stop.is_set() and (max_batches is None or report['batches'] < max_batches):
+                rows = self.storage.list_archive_candidates(source, before, after_id, self.batch_size)
+                if not rows:
+                    break
+                after_id = rows[-1]['id']
+                packed = {}
+                with span('archive_compress'):
+                    for row in rows:
+                        data = pack_archive_fields(source, row)
+                        packed[row['id']] = (row['id'], dict_id,
+                                             archive_codec.compress(data, dictionary, codec, self.level), len(data))
+                for doc_id in self.storage.archive_rows(source, list(packed.values()), self.search_chars):
+                    report['rows'] += 1
+                    report['raw_bytes'] += packed[doc_id][3]
+                    report['stored_bytes'] += len(packed[doc_id][2])
+                report['batches'] += 1
+                self._stop.wait(self.pause)
+
+        report['saved_bytes'] = report['raw_bytes'] - report['stored_bytes']
+        report['ratio'] = round(report['raw_bytes'] / report['stored_bytes'], 2) if report['stored_bytes'] else None
+        report['elapsed'] = round(time.perf_counter() - started, 3)
+        report['totals'] = self.storage.archive_stats()
+        self._last_report = report
+        if report['rows']:
+            self.logger.info(f"归档 {report['rows']} 条记录，节省 {report['saved_bytes']} 字节"
+                             f"（压缩比 {report['ratio']}），耗时 {report['elapsed']}s")
+        return report
+
+    def start(self, interval_hours: float = 24) -> dict:
+        """后台每隔interval_hours小时归档一次，可作为启动钩子"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, args=(interval_hours * 3600,),
+                                            name='history-archive', daemon=True)
+            self._thread.start()
+        return {'min_age_days': self.min_age_days, 'codec': self.codec}
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {'codec': self.codec, 'min_age_days': self.min_age_days, 'last_report': self._last_report}
+
+    def _loop(self, interval: float):
+        while not self._stop.is_set():
+            try:
+                self.compact()
+            except StorageError as e:
+                self.logger.error(f"归档历史记录失败: {e}")
+            except Exception as e:
+                # 压缩或字典数据异常时记录后等下一轮，不结束后台线程
+                self.logger.error(f"归档历史记录出错: {e}", exc_info=True)
+            self._stop.wait(interval)
+
+    def _dictionary(self, source, before):
+        """返回 (字典ID, 字典, 算法)；还没有该算法的字典时用最早的待归档记录训练，样本不足时不用字典
+
+        已归档的行记录各自的字典ID，切换算法后旧数据仍按原字典解压。
+        """
+        existing = self.storage.get_archive_dictionary(source)
+        if existing and existing['codec'] == self.codec:
+            return existing['id'], existing['data'], existing['codec']
+        samples = [pack_archive_fields(source, row)
+                   for row in self.storage.list_archive_candidates(source, before, 0, self.dict_samples)]
+        if len(samples) < self.min_dict_samples:
+            return None, None, self.codec
+        try:
+            with span('archive_train_dict'):
+                data = archive_codec.train_dictionary(samples, self.dict_size, self.codec)
+        except Exception as e:
+            self.logger.warning(f"训练 {source} 归档字典失败，本次不使用字典: {e}")
+            return None, None, self.codec
+        dict_id = self.storage.save_archive_dictionary(source, self.codec, data)
+        self.logger.info(f"已用 {len(samples)} 条{source}记录训练 {self.codec} 字典（{len(data)} 字节）")
+        return dict_id, data, self.codec
@@ -0,0 +1,126 @@
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+import jwt as pyjwt
+from flask import current_app, g, jsonify, request
+
+
+class TokenRevoked(pyjwt.InvalidTokenError):
+    """token已被吊销"""
+
+
+class TokenVerifier:
+    """校验JWT并在进程内缓存解码后的claims，直到token过期
+
+    同一token重复请求时跳过签名校验与解码；吊销检查在每次请求时都会执行，
+    缓存命中的token同样生效。
+    """
+
+    def __init__(self, secret_key: str, algorithms=('HS256',), max_entries: int = 4096):
+        self.logger = logging.getLogger(__name__)
+        self.secret_key = secret_key
+        self.algorithms = list(algorithms)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._revocation_checks: List[Callable[[dict], bool]] = []
+        self._metrics = {'decoded': 0, 'cache_hits': 0, 'rejected': 0, 'seconds_total': 0.0}
+
+    def add_revocation_check(self, check: Callable[[dict], bool]):
+        """注册吊销检查，check(claims)返回True表示token已失效"""
+        self._revocation_checks.append(check)
+
+    def verify(self, token: str) -> dict:
+        """返回claims，过期抛出ExpiredSignatureError，无效或已吊销抛出InvalidTokenError"""
+        start = time.perf_counter()
+        try:
+            claims = self._cached(token)
+            if claims is None:
+                claims = pyjwt.decode(token, self.secret_key, algorithms=self.algorithms)
+                self._metrics['decoded'] += 1
+                self._store(token, claims)
+            for check in self._revocation_checks:
+                if check(claims):
+                    raise TokenRevoked('token已被吊销')
+            return claims
+        except pyjwt.InvalidTokenError:
+            self._metrics['rejected'] += 1
+            raise
+        finally:
+            self._metrics['seconds_total'] += time.perf_counter() - start
+
+    def forget(self, token: str):
+        """从缓存移除token（例如主动吊销后）"""
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._metrics, cached=len(self._entries))
+
+    def _cached(self, token) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                raise pyjwt.ExpiredSignatureError('Signature has expired')
+            self._entries.move_to_end(token)
+            self._metrics['cache_hits'] += 1
+            return claims
+
+    def _store(self, token, claims):
+        # 没有exp的token无法确定缓存期限，每次都重新校验
+        if 'exp' not in claims:
+            return
+        with self._lock:
+            self._entries[token] = (claims, float(claims['exp']))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def bearer_token() -> Optional[str]:
+    """从Authorization头取出Bearer token"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def init_auth(app, **options) -> TokenVerifier:
+    """按app.config['SECRET_KEY']创建校验器并注册到app.extensions"""
+    verifier = TokenVerifier(app.config['SECRET_KEY'], **options)
+    app.extensions['token_verifier'] = verifier
+    return verifier
+
+
+def login_required(view):
+    """校验token后把用户写入g.user_id / g.token_claims，耗时记录在g.auth_ms"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = bearer_token()
+        if token is None:
+            return jsonify({'error': '未提供有效的认证token'}), 401
+        verifier: TokenVerifier = current_app.extensions['token_verifier']
+        start = time.perf_counter()
+        try:
+            claims = verifier.verify(token)
+        except pyjwt.ExpiredSignatureError:
+            return jsonify({'error': 'token已过期'}), 401
+        except pyjwt.InvalidTokenError:
+            return jsonify({'error': '无效的token'}), 401
+        finally:
+            g.auth_ms = (time.perf_counter() - start) * 1000
+        if 'user_id' not in claims:
+            return jsonify({'error': '无效的token'}), 401
+        g.user_id = claims['user_id']
+        g.token_claims = claims
+        return view(*args, **kwargs)
+    return wrapper
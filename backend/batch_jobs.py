@@ -0,0 +1,219 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional, Tuple
+
+from metrics import span
+from storage import StorageError
+
+
+class UpstreamThrottled(Exception):
+    """上游返回限流：所有worker暂停retry_after秒后重试同一条目，不计入失败次数"""
+
+    def __init__(self, retry_after: float = 5.0):
+        super().__init__(f"上游限流，{retry_after}秒后重试")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """令牌桶：平均每分钟requests_per_minute次调用，最多burst次突发，为0时不限速"""
+
+    def __init__(self, requests_per_minute: float, burst: int = 1):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> bool:
+        """阻塞直到拿到令牌，stop被设置时返回False"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.interval:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+                    self._updated = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if not self.interval:
+                        return True
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) * self.interval
+            if stop is None:
+                time.sleep(wait)
+            elif stop.wait(wait):
+                return False
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class StoryJobRunner:
+    """批量预生成故事：条目持久化在story_job_items中，有界worker池并发生成，结果批量写回
+
+    - 分发线程按需领取待处理条目（标记为running），本地队列最多积压2倍worker数
+    - 所有worker共享一个令牌桶，限制对上游模型的调用频率
+    - 写回线程把成功的故事合并为一次批量插入，与条目状态、任务计数在同一事务提交
+    - 进程重启后running的条目回到pending，任务从中断处继续
+
+    限速按进程计算，且启动时会重置所有running的条目，多进程部署时只应在一个进程中启动
+    （app中由STORY_JOB_RUNNER控制）。
+    """
+
+    def __init__(self, storage, generate: Callable[[str], Tuple[str, str]], workers: int = 4,
+                 requests_per_minute: float = 60, burst: int = 1, batch_size: int = 20,
+                 flush_interval: float = 2.0, max_attempts: int = 3, poll_interval: float = 5.0,
+                 on_stored: Optional[Callable[[Iterable[int]], None]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.generate = generate
+        self.workers = workers
+        self.limiter = RateLimiter(requests_per_minute, burst)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.on_stored = on_stored
+        self._work = queue.Queue(maxsize=workers * 2)
+        self._results = queue.Queue()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._dispatcher = None
+        self._flusher = None
+        self._metrics = {'generated': 0, 'failed': 0, 'retried': 0, 'throttled': 0, 'flushes': 0}
+
+    def start(self) -> dict:
+        """恢复中断的条目并启动线程，可作为启动钩子"""
+        if self._dispatcher is not None:
+            return {'workers': self.workers}
+        recovered = self.storage.reset_running_story_job_items()
+        if recovered:
+            self.logger.info(f"恢复了 {recovered} 个未完成的故事任务条目")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='story-job-dispatch', daemon=True)
+        self._flusher = threading.Thread(target=self._flush_loop, name='story-job-flush', daemon=True)
+        self._workers = [threading.Thread(target=self._worker_loop, name=f'story-job-worker-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in [self._dispatcher, self._flusher, *self._workers]:
+            thread.start()
+        return {'workers': self.workers, 'recovered': recovered}
+
+    def submit(self, user_id, prompts) -> int:
+        job_id = self.storage.create_story_job(user_id, list(prompts))
+        self._wake.set()
+        return job_id
+
+    def get_job(self, user_id, job_id) -> Optional[dict]:
+        return self.storage.get_story_job(user_id, job_id)
+
+    def list_jobs(self, user_id, limit: int = 20):
+        return self.storage.list_story_jobs(user_id, limit)
+
+    def cancel(self, user_id, job_id) -> bool:
+        """已领取到本地队列的条目仍会生成完，其余不再处理"""
+        return self.storage.cancel_story_job(user_id, job_id)
+
+    def stats(self) -> dict:
+        return dict(self._metrics, workers=self.workers, queued=self._work.qsize(),
+                    unflushed=self._results.qsize())
+
+    def stop(self, timeout: float = 5.0):
+        """停止领取新条目，等待进行中的生成结束并写回；本地队列中未开始的条目下次启动时恢复"""
+        self._stop.set()
+        self._wake.set()
+        for thread in [self._dispatcher, *self._workers]:
+            if thread is not None:
+                thread.join(timeout)
+        if self._flusher is not None:
+            self._results.put(None)
+            self._flusher.join(timeout)
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            free = self._work.maxsize - self._work.qsize()
+            # 本地队列降到一半以下才补充，一次领取多条以减少事务数
+            if free >= self.workers:
+                try:
+                    for item in self.storage.claim_story_job_items(free):
+                        self._work.put(item)
+                except StorageError as e:
+                    self.logger.error(f"领取故事任务条目失败: {e}")
+            self._wake.wait(self.poll_interval)
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                item = self._work.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if self._work.qsize() <= self.workers:
+                self._wake.set()
+            result = self._generate(item)
+            if result is None:
+                break
+            self._results.put(result)
+
+    def _generate(self, item):
+        """返回 (条目, (思考过程, 故事), None) 或 (条目, None, 错误信息)；停止时返回None"""
+        while True:
+            if not self.limiter.acquire(self._stop):
+                return None
+            try:
+                with span('story_job_generate'):
+                    return item, self.generate(item['prompt']), None
+            except UpstreamThrottled as e:
+                self._metrics['throttled'] += 1
+                self.limiter.pause(e.retry_after)
+            except Exception as e:
+                self.logger.warning(f"故事任务条目 {item['id']} 第{item['attempts']}次生成失败: {e}")
+                return item, None, str(e)[:255]
+
+    def _flush_loop(self):
+        buffer, first_at, closing = [], 0.0, False
+        while not closing:
+            timeout = None if not buffer else max(0.0, first_at + self.flush_interval - time.monotonic())
+            try:
+                result = self._results.get(timeout=timeout)
+                if result is None:
+                    closing = True
+                else:
+                    if not buffer:
+                        first_at = time.monotonic()
+                    buffer.append(result)
+            except queue.Empty:
+                pass
+            if buffer and (closing or len(buffer) >= self.batch_size
+                           or time.monotonic() - first_at >= self.flush_interval):
+                buffer = self._flush(buffer)
+                first_at = time.monotonic()
+
+    def _flush(self, buffer):
+        """写回成功返回空列表，失败时保留结果等下次重试"""
+        done = [(item, *story) for item, story, _ in buffer if story is not None]
+        failed = [(item, error, item['attempts'] < self.max_attempts) for item, story, error in buffer
+                  if story is None]
+        try:
+            user_ids = self.storage.finish_story_job_items(done, failed)
+        except StorageError as e:
+            self.logger.error(f"写回 {len(buffer)} 条故事任务结果失败，稍后重试: {e}")
+            return buffer
+        retried = sum(1 for _, _, retry in failed if retry)
+        self._metrics['flushes'] += 1
+        self._metrics['generated'] += len(done)
+        self._metrics['retried'] += retried
+        self._metrics['failed'] += len(failed) - retried
+        if retried:
+            self._wake.set()
+        if user_ids and self.on_stored is not None:
+            try:
+                self.on_stored(user_ids)
+            except Exception as e:
+                # 结果已写回，回调失败（如语义缓存同步出错）只记录，不结束写回线程
+                self.logger.error(f"故事写回后的回调失败: {e}", exc_info=True)
+        return []
@@ -0,0 +1,95 @@
+"""登录吞吐基准测试：对比在请求线程中计算密码哈希与交给进程池计算
+
+同时运行一个模拟SSE推送的线程（每隔interval毫秒序列化并"发送"一个片段），
+统计登录并发期间推送间隔的延迟，衡量哈希计算对流式响应的影响。
+
+用法:
+    python benchmarks/auth_benchmark.py
+    python benchmarks/auth_benchmark.py --concurrency 16 --duration 5 --workers 4
+    python benchmarks/auth_benchmark.py --method pbkdf2:sha256:600000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from password_hasher import HasherBusy, PasswordHasher
+
+
+def stream_ticks(stop, interval, delays):
+    """按固定间隔推送片段，记录每次比预定时间晚了多少毫秒"""
+    chunk = {'type': 'content', 'data': '从前有一只小兔子，' * 4}
+    next_tick = time.perf_counter()
+    while not stop.is_set():
+        next_tick += interval
+        json.dumps(chunk, ensure_ascii=False)
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+        delays.append((time.perf_counter() - next_tick) * 1000)
+
+
+def login_loop(hasher, stored, stop, counters, lock):
+    while not stop.is_set():
+        try:
+            ok = hasher.verify(stored, 'secret')
+            key = 'ok' if ok else 'failed'
+        except HasherBusy:
+            key = 'busy'
+            time.sleep(0.01)
+        with lock:
+            counters[key] += 1
+
+
+def run(label, hasher, stored, concurrency, duration, interval):
+    stop = threading.Event()
+    lock = threading.Lock()
+    counters = {'ok': 0, 'failed': 0, 'busy': 0}
+    delays = []
+
+    hasher.verify(stored, 'secret')  # 预热进程池
+    threads = [threading.Thread(target=stream_ticks, args=(stop, interval, delays))]
+    threads += [threading.Thread(target=login_loop, args=(hasher, stored, stop, counters, lock))
+                for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    delays.sort()
+    print(f"{label:<14} 登录 {counters['ok'] / elapsed:8.1f} 次/秒  拒绝 {counters['busy']:5d}  "
+          f"推送延迟 p50 {statistics.median(delays):7.2f} ms  "
+          f"p95 {delays[int(len(delays) * 0.95)]:7.2f} ms  max {delays[-1]:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', default='scrypt')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发登录线程数')
+    parser.add_argument('--duration', type=float, default=3.0, help='每种模式运行的秒数')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='进程池大小')
+    parser.add_argument('--max-pending', type=int, default=32)
+    parser.add_argument('--interval', type=float, default=20.0, help='模拟推送间隔(毫秒)')
+    args = parser.parse_args()
+
+    inline = PasswordHasher(method=args.method, workers=0, max_pending=args.concurrency)
+    stored = inline.hash('secret')
+    print(f"方法 {args.method}，并发 {args.concurrency}，推送间隔 {args.interval:.0f} ms\n")
+
+    run('空闲(仅推送)', inline, stored, 0, args.duration, args.interval / 1000)
+    run('请求线程计算', inline, stored, args.concurrency, args.duration, args.interval / 1000)
+    pool = PasswordHasher(method=args.method, workers=args.workers, max_pending=args.max_pending)
+    try:
+        run(f'进程池({args.workers})', pool, stored, args.concurrency, args.duration, args.interval / 1000)
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
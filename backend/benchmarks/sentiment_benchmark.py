@@ -0,0 +1,98 @@
+"""情感打分基准测试：词典打分的吞吐量，以及与模型标注的一致率
+
+用法:
+    python benchmarks/sentiment_benchmark.py
+    python benchmarks/sentiment_benchmark.py --repeat 200 --min-confidence 0.7
+    DASHSCOPE_API_KEY=... python benchmarks/sentiment_benchmark.py --relabel
+
+样本集每行一条 {"content", "label"}。--relabel 会先用模型重新标注样本并写回文件，
+之后的一致率即为词典与模型标注的一致率。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sentiment_lexicon import LABELS, LexiconScorer
+
+SAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sentiment_samples.jsonl')
+DASHSCOPE_API_URL = 'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation'
+
+
+def load_samples(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def relabel(samples, path):
+    """用模型为样本重新标注（不启用词典，也不读取已有缓存）"""
+    from sentiment_service import SentimentService
+    from storage import create_storage
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        storage = create_storage('sqlite', path=os.path.join(tmpdir, 'bench.db'))
+        storage.init_schema()
+        service = SentimentService(storage, api_key=os.environ['DASHSCOPE_API_KEY'], api_url=DASHSCOPE_API_URL)
+        scored = service.score_messages([sample['content'] for sample in samples])
+        storage.close()
+    with open(path, 'w', encoding='utf-8') as f:
+        for sample, (label, _) in zip(samples, scored):
+            f.write(json.dumps({'content': sample['content'], 'label': label}, ensure_ascii=False) + '\n')
+    return [{'content': sample['content'], 'label': label} for sample, (label, _) in zip(samples, scored)]
+
+
+def throughput(scorer, contents, repeat):
+    batch = contents * repeat
+    start = time.perf_counter()
+    scorer.score_batch(batch)
+    elapsed = time.perf_counter() - start
+    return len(batch) / elapsed, elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', default=SAMPLES_PATH)
+    parser.add_argument('--repeat', type=int, default=100, help='吞吐量测试时样本重复的次数')
+    parser.add_argument('--min-confidence', type=float, default=0.7)
+    parser.add_argument('--relabel', action='store_true', help='先用模型重新标注样本')
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    if args.relabel:
+        samples = relabel(samples, args.samples)
+    contents = [sample['content'] for sample in samples]
+    references = [sample['label'] for sample in samples]
+
+    scorer = LexiconScorer()
+    rate, elapsed = throughput(scorer, contents, args.repeat)
+    print(f"吞吐量: {rate:,.0f} 条/秒 ({len(contents) * args.repeat} 条, {elapsed:.1f} ms)")
+
+    results = scorer.score(contents)
+    confident = [i for i, (_, score) in enumerate(results) if score >= args.min_confidence]
+    agree = sum(results[i][0] == references[i] for i in range(len(samples)))
+    agree_confident = sum(results[i][0] == references[i] for i in confident)
+    print(f"全部样本一致率: {agree / len(samples):.1%} ({agree}/{len(samples)})")
+    print(f"词典直接给出结果: {len(confident) / len(samples):.1%} ({len(confident)}/{len(samples)})，"
+          f"其余 {len(samples) - len(confident)} 条交给模型")
+    if confident:
+        print(f"高置信度样本一致率: {agree_confident / len(confident):.1%} ({agree_confident}/{len(confident)})")
+
+    print("\n分label一致率:")
+    for label in LABELS:
+        indexes = [i for i, reference in enumerate(references) if reference == label]
+        if indexes:
+            matched = sum(results[i][0] == label for i in indexes)
+            print(f"  {label}: {matched}/{len(indexes)}")
+
+    mismatched = [i for i in confident if results[i][0] != references[i]]
+    if mismatched:
+        print("\n高置信度但不一致的样本:")
+        for i in mismatched:
+            print(f"  [{references[i]} -> {results[i][0]} {results[i][1]:.2f}] {contents[i]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""启动基准测试：导入app模块的耗时，以及从启动进程到 /api/health 首次返回200的耗时
+
+每项在全新的子进程中测量，取多次运行的中位数；任一项超出预算时以退出码1结束，
+可以直接放进CI防止启动变慢（例如又在导入时加载了LangChain或连接数据库）。
+默认使用临时目录中的SQLite，不依赖MySQL；--backend mysql 时沿用当前环境变量。
+
+用法:
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --runs 5 --import-budget 0.8 --healthy-budget 2.5
+    python benchmarks/startup_benchmark.py --top 15    # 同时列出导入最慢的模块
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def child_env(workdir, backend):
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, PYTHONDONTWRITEBYTECODE='1')
+    if backend == 'sqlite':
+        env.update(STORAGE_BACKEND='sqlite', SQLITE_PATH=os.path.join(workdir, 'story_app.db'))
+    return env
+
+
+def measure_import(env, workdir):
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env, workdir, top):
+    """-X importtime 的累计耗时，只看顶层模块"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        if cumulative.isdigit() and not name.startswith(' ') and '.' not in name:
+            modules.append((int(cumulative) / 1e6, name))
+    return sorted(modules, reverse=True)[:top]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_healthy(env, workdir, timeout):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}/api/health'
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port)],
+                              cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f'服务进程已退出，退出码 {server.returncode}')
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f'{timeout:.0f} 秒内没有得到健康响应')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--backend', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--import-budget', type=float, default=1.0, help='导入app模块的预算(秒)')
+    parser.add_argument('--healthy-budget', type=float, default=3.0, help='启动到首次健康响应的预算(秒)')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--top', type=int, default=0, help='列出导入最慢的N个顶层模块')
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        env = child_env(workdir, args.backend)
+        for label, measure, budget in (
+            ('导入app', lambda: measure_import(env, workdir), args.import_budget),
+            ('首次健康响应', lambda: measure_healthy(env, workdir, args.timeout), args.healthy_budget),
+        ):
+            samples = [measure() for _ in range(args.runs)]
+            median = statistics.median(samples)
+            over = median > budget
+            failed |= over
+            print(f"{label:<10} 中位数 {median * 1000:8.1f} ms  最大 {max(samples) * 1000:8.1f} ms  "
+                  f"预算 {budget * 1000:8.1f} ms  {'超出预算' if over else 'OK'}")
+
+        if args.top:
+            print(f"\n导入最慢的 {args.top} 个顶层模块（累计）:")
+            for seconds, name in slowest_imports(env, workdir, args.top):
+                print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
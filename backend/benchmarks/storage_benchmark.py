@@ -0,0 +1,103 @@
+"""存储后端基准测试：对比MySQL与SQLite在各接口对应存储操作上的延迟
+
+用法:
+    python benchmarks/storage_benchmark.py --backends sqlite
+    MYSQL_DB=story_bench python benchmarks/storage_benchmark.py --backends sqlite mysql
+
+MySQL会写入测试用户与记录，请指向专用的测试库。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage import create_storage
+
+
+def build_storage(kind, tmpdir):
+    if kind == 'sqlite':
+        return create_storage('sqlite', path=os.path.join(tmpdir, 'bench.db'))
+    return create_storage('mysql', dbconfig={
+        "host": os.getenv('MYSQL_HOST', 'localhost'),
+        "port": int(os.getenv('MYSQL_PORT', 3306)),
+        "user": os.getenv('MYSQL_USER', 'root'),
+        "password": os.getenv('MYSQL_PASSWORD'),
+        "database": os.getenv('MYSQL_DB', 'story_bench'),
+        "autocommit": True,
+        "connect_timeout": 5
+    })
+
+
+def measure(fn, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'mean': statistics.fmean(samples),
+        'p50': samples[len(samples) // 2],
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+def run(kind, iterations, history_size, tmpdir):
+    storage = build_storage(kind, tmpdir)
+    storage.init_schema()
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    user_id = storage.create_user(f"{prefix}_main", 'hash')
+    conversation_id = storage.create_conversation(user_id, '基准对话')
+    for i in range(history_size):
+        storage.save_chat_message(user_id, 'user', f'历史消息{i}', conversation_id)
+        storage.save_story_history(user_id, f'提示{i}', '思考', '从前有一只小兔子' * 20)
+
+    message_ids = []
+
+    def save_chat(i):
+        message_ids.append(storage.save_chat_message(user_id, 'user', f'消息{i}', conversation_id, verify_owner=True))
+
+    cases = [
+        ('POST /api/register', lambda i: storage.create_user(f"{prefix}_{i}", 'hash')),
+        ('POST /api/login', lambda i: storage.get_user_by_username(f"{prefix}_main")),
+        ('POST /api/save_chat', save_chat),
+        ('POST /api/generate_story (finalize)',
+         lambda i: storage.save_story_history(user_id, f'提示{i}', '思考', '故事' * 200)),
+        ('POST /api/conversations', lambda i: storage.create_conversation(user_id, f'对话{i}')),
+        ('GET /api/conversations', lambda i: storage.list_conversations(user_id)),
+        ('GET /api/chat_history', lambda i: storage.list_chat_history(user_id)),
+        ('GET /api/story_history', lambda i: storage.list_story_history(user_id)),
+        ('DELETE /api/delete_chat', lambda i: storage.delete_chat_message(user_id, message_ids[i])),
+    ]
+    results = [(name, measure(fn, iterations)) for name, fn in cases]
+    storage.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['sqlite'], choices=['sqlite', 'mysql'])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--history-size', type=int, default=200, help='预置的历史记录条数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        all_results = {kind: dict(run(kind, args.iterations, args.history_size, tmpdir)) for kind in args.backends}
+
+    endpoints = list(next(iter(all_results.values())).keys())
+    header = f"{'endpoint':<40}" + ''.join(f"{kind + ' p50/p95 (ms)':>26}" for kind in args.backends)
+    print(header)
+    print('-' * len(header))
+    for endpoint in endpoints:
+        cells = ''.join(
+            f"{all_results[kind][endpoint]['p50']:>12.3f} / {all_results[kind][endpoint]['p95']:<11.3f}"
+            for kind in args.backends)
+        print(f"{endpoint:<40}{cells}")
+
+
+if __name__ == '__main__':
+    main()
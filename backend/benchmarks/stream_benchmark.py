@@ -0,0 +1,118 @@
+"""流式转发基准测试：每个故事的CPU耗时、帧数、输出字节数，以及单核每秒可推送的帧数
+
+用法:
+    python benchmarks/stream_benchmark.py
+    python benchmarks/stream_benchmark.py --stories 500 --story-chars 1500 --gap-ms 25
+
+用合成的通义流式响应（每段1-3个字、按随机字节数分块到达）对比:
+- legacy: 旧的逐行解码 + json.loads + json.dumps，每个增量一帧
+- relay:  字节级增量解析 + 按 --coalesce-bytes / --coalesce-ms 合并成帧
+- relay+gzip: 在relay基础上逐帧gzip压缩
+每一帧都经过StreamHub（生产线程发布、订阅者读取）并逐帧写入/dev/null，
+CPU时间包含这些按帧计的开销。合并的时间窗口使用模拟时钟，每段增量之间前进 --gap-ms 毫秒。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stream_hub import StreamHub
+from stream_relay import coalesce_frames, gzip_frames, story_deltas
+
+WORDS = '从前有一只小兔子它住在森林里每天早上都会去河边喝水有一天它遇到了一只迷路的小熊'
+
+
+def synth_story(rng, story_chars):
+    """返回上游原始字节分块列表"""
+    events, produced, tokens = [], 0, 0
+    while produced < story_chars:
+        text = ''.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+        produced += len(text)
+        tokens += 1
+        payload = {'output': {'text': text, 'finish_reason': 'null'}, 'usage': {'output_tokens': tokens}}
+        events.append(f"id:{tokens}\nevent:result\n:HTTP_STATUS/200\n"
+                      f"data:{json.dumps(payload, ensure_ascii=False)}\n\n".encode())
+    raw = b''.join(events)
+    chunks, start = [], 0
+    while start < len(raw):
+        size = rng.randint(64, 512)
+        chunks.append(raw[start:start + size])
+        start += size
+    return chunks
+
+
+def iter_lines(chunks):
+    """与requests.Response.iter_lines相同的按行切分"""
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def legacy(chunks, args):
+    for line in iter_lines(chunks):
+        if line:
+            decoded_line = line.decode('utf-8')
+            if decoded_line.startswith('data:'):
+                data_chunk = json.loads(decoded_line[5:])
+                if 'output' in data_chunk and 'text' in data_chunk['output']:
+                    yield f"data: {json.dumps({'text': data_chunk['output']['text']})}\n\n"
+
+
+def relay(chunks, args):
+    clock = [0.0]
+
+    def deltas():
+        for text, _ in story_deltas(chunks):
+            clock[0] += args.gap_ms / 1000
+            yield text
+
+    return coalesce_frames(deltas(), args.coalesce_bytes, args.coalesce_ms / 1000, clock=lambda: clock[0])
+
+
+def run(mode, stories, args, gzip=False):
+    hub = StreamHub()
+    fd = os.open(os.devnull, os.O_WRONLY)
+    frames = size = 0
+    start = time.process_time()
+    try:
+        for chunks in stories:
+            events = hub.subscribe(hub.start('bench', mode(chunks, args)))
+            output = gzip_frames(events) if gzip else (event.encode('utf-8') for event in events)
+            for frame in output:
+                frames += 1
+                size += os.write(fd, frame)
+    finally:
+        os.close(fd)
+    return time.process_time() - start, frames, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stories', type=int, default=200)
+    parser.add_argument('--story-chars', type=int, default=1200, help='每个故事的字数')
+    parser.add_argument('--coalesce-bytes', type=int, default=64)
+    parser.add_argument('--coalesce-ms', type=float, default=40.0)
+    parser.add_argument('--gap-ms', type=float, default=20.0, help='模拟的上游增量间隔(毫秒)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stories = [synth_story(rng, args.story_chars) for _ in range(args.stories)]
+    print(f"{args.stories} 个故事，每个约 {args.story_chars} 字，"
+          f"上游 {sum(map(len, stories)) / args.stories:.0f} 块/故事")
+    print(f"{'模式':<12}{'CPU/故事(ms)':>14}{'帧/故事':>10}{'字节/故事':>12}{'帧/秒/核':>14}")
+    for name, mode, gzip in [('legacy', legacy, False), ('relay', relay, False), ('relay+gzip', relay, True)]:
+        cpu, frames, size = run(mode, stories, args, gzip)
+        print(f"{name:<12}{cpu / args.stories * 1000:>14.2f}{frames / args.stories:>10.0f}"
+              f"{size / args.stories:>12,.0f}{frames / cpu if cpu else 0:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
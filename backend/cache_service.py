@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class LRUCacheBackend:
+    """进程内LRU缓存后端（单节点）"""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # 版本计数器单独存放，不参与LRU淘汰，避免版本回退后命中旧数据
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict, ttl: float):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisCacheBackend:
+    """多节点共享缓存后端，基于Redis"""
+
+    def __init__(self, url: str, prefix: str = 'story_app:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("使用共享缓存需要安装redis: pip install redis") from e
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self._client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: dict, ttl: float):
+        self._client.set(self.prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    def delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+    def get_counter(self, key: str) -> int:
+        raw = self._client.get(self.prefix + key)
+        return int(raw) if raw is not None else 0
+
+    def incr(self, key: str) -> int:
+        return int(self._client.incr(self.prefix + key))
+
+
+class LocalSharedBackend(RedisCacheBackend):
+    """共享后端的本地替身，用于测试：与Redis后端一样按JSON序列化存取，多个缓存实例可共用同一个store"""
+
+    def __init__(self, store: Optional[dict] = None, prefix: str = 'story_app:'):
+        self.prefix = prefix
+        self._store = store if store is not None else {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._store.get(self.prefix + key)
+            if item is None:
+                return None
+            raw, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._store[self.prefix + key]
+                return None
+            return json.loads(raw)
+
+    def set(self, key: str, value: dict, ttl: float):
+        with self._lock:
+            self._store[self.prefix + key] = (json.dumps(value), time.monotonic() + ttl)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._store.pop(self.prefix + key, None)
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            item = self._store.get(self.prefix + key)
+            return int(item[0]) if item else 0
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            item = self._store.get(self.prefix + key)
+            value = (int(item[0]) if item else 0) + 1
+            self._store[self.prefix + key] = (str(value), None)
+            return value
+
+
+class ReadThroughCache:
+    """按用户与查询形态缓存序列化后的列表结果
+
+    失效采用版本号：写入时递增 (用户, 数据类型) 的版本，旧版本的条目自然失效，
+    无需枚举键，对共享后端同样适用。
+    """
+
+    def __init__(self, backend, ttl: float = 300.0):
+        self.logger = logging.getLogger(__name__)
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _version_key(user_id, kind: str) -> str:
+        return f"ver:{kind}:{user_id}"
+
+    def _entry_key(self, user_id, kind: str, shape: dict, version: int) -> str:
+        shape_digest = hashlib.sha1(
+            json.dumps(shape, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+        return f"data:{kind}:{user_id}:{version}:{shape_digest}"
+
+    def get_or_load(self, user_id, kind: str, shape: dict, loader: Callable[[], str]) -> dict:
+        """返回 {'body': 序列化结果, 'etag': 内容摘要}，未命中时调用loader加载"""
+        # 先读版本再加载，加载期间发生的写入会递增版本，不会留下脏数据
+        key = None
+        try:
+            version = self.backend.get_counter(self._version_key(user_id, kind))
+            key = self._entry_key(user_id, kind, shape, version)
+            entry = self.backend.get(key)
+        except Exception as e:
+            self.logger.warning(f"读取缓存失败，直接查询数据库: {e}")
+            entry = None
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        body = loader()
+        entry = {'body': body, 'etag': hashlib.sha1(body.encode('utf-8')).hexdigest()}
+        # 版本号读取失败时不写入，避免写到错误的版本下
+        if key is not None:
+            try:
+                self.backend.set(key, entry, self.ttl)
+            except Exception as e:
+                self.logger.warning(f"写入缓存失败: {e}")
+        return entry
+
+    def invalidate(self, user_id, *kinds: str):
+        """数据写入后使该用户指定类型的缓存失效"""
+        for kind in kinds:
+            try:
+                self.backend.incr(self._version_key(user_id, kind))
+            except Exception as e:
+                self.logger.error(f"缓存失效失败 {kind}:{user_id}: {e}")
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def create_cache_backend(kind: str, **options):
+    """根据配置创建缓存后端: lru / redis / local_shared"""
+    if kind == 'redis':
+        return RedisCacheBackend(options['url'])
+    if kind == 'local_shared':
+        return LocalSharedBackend()
+    return LRUCacheBackend(max_entries=options.get('max_entries', 2048))
@@ -0,0 +1,179 @@
+import logging
+import queue
+import threading
+from typing import Callable, List, Optional
+
+import requests
+
+from storage import StorageError
+
+ROLE_NAMES = {'user': '孩子', 'assistant': '故事助手'}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文等非ASCII字符每字约1个token，ASCII约4个字符1个token"""
+    ascii_count = len(text.encode('ascii', 'ignore'))
+    return len(text) - ascii_count + (ascii_count + 3) // 4
+
+
+def clip_tokens(text: str, max_tokens: int) -> str:
+    """截取不超过max_tokens的前缀，截断时以省略号结尾"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) < max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + '…'
+
+
+def format_message(message: dict, max_tokens: int) -> str:
+    return f"{ROLE_NAMES.get(message['role'], message['role'])}: {clip_tokens(message['content'], max_tokens)}"
+
+
+def extractive_summary(previous: str, messages: List[dict], max_tokens: int) -> str:
+    """不调用模型的摘要：保留孩子说过的话与故事开头，超出预算时丢弃最早的内容"""
+    lines = [previous] if previous else []
+    lines += [format_message(m, 60 if m['role'] == 'user' else 30) for m in messages]
+    text = '\n'.join(lines)
+    while estimate_tokens(text) > max_tokens and '\n' in text:
+        text = text.split('\n', 1)[1]
+    return clip_tokens(text, max_tokens)
+
+
+class DashScopeSummarizer:
+    """用通义模型把旧摘要与新折叠的消息压缩成新的摘要"""
+
+    prompt = ("下面是儿童故事助手与孩子之前的对话摘要和后续的对话。请合并成一段不超过{limit}字的新摘要，"
+              "保留孩子的情绪变化、喜好、对故事的评价和提出的要求，以及已经讲过的故事主题，不要编造。\n\n"
+              "已有摘要:\n{previous}\n\n后续对话:\n{dialogue}\n\n新摘要:")
+
+    def __init__(self, api_key: str, api_url: str, model: str = 'qwen-turbo', timeout: float = 30.0):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.model = model
+        self.timeout = timeout
+
+    def __call__(self, previous: str, messages: List[dict], max_tokens: int) -> str:
+        dialogue = '\n'.join(format_message(m, 200) for m in messages)
+        response = requests.post(
+            self.api_url,
+            json={'model': self.model, 'input': {'messages': [{'role': 'user', 'content': self.prompt.format(
+                limit=max_tokens, previous=previous or '（无）', dialogue=dialogue)}]}},
+            headers={'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        result = response.json()
+        if 'output' not in result or 'text' not in result['output']:
+            raise ValueError('无效的API响应格式')
+        return clip_tokens(result['output']['text'].strip(), max_tokens)
+
+
+class ConversationContext:
+    """多轮对话的上下文：滚动摘要 + 最近几轮原文，总量不超过token_budget
+
+    - 摘要按对话存储在conversation_contexts中，记录已折叠到的消息ID
+    - 消息保存后在后台检查：未折叠的消息超过recent_turns轮时，把最早的部分并入摘要
+    - 构建上下文只读一行摘要和最多recent_turns轮消息，提示词长度不随对话变长而增长
+    摘要失败时退回extractive_summary，不影响故事生成。
+    """
+
+    def __init__(self, storage, summarize: Optional[Callable[[str, List[dict], int], str]] = None,
+                 token_budget: int = 1200, summary_tokens: int = 400, recent_turns: int = 3,
+                 message_tokens: int = 200, fold_batch: int = 20, max_folds: int = 5):
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.summarize = summarize or extractive_summary
+        self.token_budget = token_budget
+        self.summary_tokens = min(summary_tokens, token_budget)
+        self.recent_messages = recent_turns * 2
+        self.message_tokens = message_tokens
+        self.fold_batch = fold_batch
+        self.max_folds = max_folds
+        self._pending = queue.Queue()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._metrics = {'built': 0, 'folds': 0, 'fallbacks': 0, 'context_tokens': 0}
+
+    def build(self, conversation_id, before_id=None) -> str:
+        """before_id之前的对话上下文（不含当前消息），没有内容时返回空字符串"""
+        context = self.storage.get_conversation_context(conversation_id)
+        messages = self.storage.list_conversation_messages(
+            conversation_id, after_id=context['summarized_until'], before_id=before_id,
+            limit=self.recent_messages, latest=True)
+
+        summary = clip_tokens(context['summary'], self.summary_tokens) if context['summary'] else ''
+        used = estimate_tokens(summary)
+        recent = []
+        for message in reversed(messages):
+            line = format_message(message, self.message_tokens)
+            cost = estimate_tokens(line)
+            if used + cost > self.token_budget:
+                break
+            recent.append(line)
+            used += cost
+
+        parts = []
+        if summary:
+            parts.append(f"此前对话摘要:\n{summary}")
+        if recent:
+            parts.append("最近的对话:\n" + '\n'.join(reversed(recent)))
+        self._metrics['built'] += 1
+        self._metrics['context_tokens'] = used
+        return '\n\n'.join(parts)
+
+    def update(self, conversation_id) -> int:
+        """把超出最近recent_turns轮的消息并入摘要，每次最多折叠fold_batch条，返回折叠的消息数"""
+        folded = 0
+        for _ in range(self.max_folds):
+            context = self.storage.get_conversation_context(conversation_id)
+            messages = self.storage.list_conversation_messages(
+                conversation_id, after_id=context['summarized_until'], limit=self.recent_messages + self.fold_batch)
+            fold = messages[:len(messages) - self.recent_messages]
+            if not fold:
+                break
+            try:
+                summary = self.summarize(context['summary'], fold, self.summary_tokens)
+            except Exception as e:
+                # 模型响应格式异常（AttributeError、TypeError等）同样退回，不影响后台线程
+                self.logger.warning(f"对话 {conversation_id} 摘要失败，改用抽取式摘要: {e}")
+                self._metrics['fallbacks'] += 1
+                summary = extractive_summary(context['summary'], fold, self.summary_tokens)
+            if not self.storage.save_conversation_context(conversation_id, summary, fold[-1]['id'],
+                                                          context['summarized_until']):
+                break
+            folded += len(fold)
+            self._metrics['folds'] += 1
+        return folded
+
+    def submit(self, conversation_id):
+        """消息保存后排队更新摘要，同一对话排队期间只处理一次"""
+        with self._lock:
+            if conversation_id in self._queued:
+                return
+            self._queued.add(conversation_id)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._worker_loop, name='conversation-context', daemon=True)
+                self._worker.start()
+        self._pending.put(conversation_id)
+
+    def stats(self) -> dict:
+        return dict(self._metrics, queued=self._pending.qsize(), token_budget=self.token_budget)
+
+    def _worker_loop(self):
+        while True:
+            conversation_id = self._pending.get()
+            with self._lock:
+                self._queued.discard(conversation_id)
+            try:
+                self.update(conversation_id)
+            except StorageError as e:
+                self.logger.error(f"更新对话 {conversation_id} 的摘要失败: {e}")
+            except Exception as e:
+                # 单个对话出错只跳过该对话，线程继续处理后续对话
+                self.logger.error(f"更新对话 {conversation_id} 的摘要出错: {e}", exc_info=True)
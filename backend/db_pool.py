@@ -0,0 +1,239 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import errors
+
+
+class _Slot:
+    """池中的一条物理连接及其使用记录"""
+    __slots__ = ('conn', 'created_at', 'last_used', 'checked_out_at', 'owner', 'leak_reported')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+        self.checked_out_at = None
+        self.owner = None
+        self.leak_reported = False
+
+
+class ConnectionPool:
+    """MySQL连接池：空闲超时后才校验连接、在min/max之间伸缩、通过上下文管理器保证归还"""
+
+    def __init__(self, connect_args: dict, min_size: int = 2, max_size: int = 10,
+                 validate_after: float = 30.0, idle_timeout: float = 300.0,
+                 max_lifetime: float = 3600.0, checkout_timeout: float = 5.0,
+                 leak_threshold: float = 60.0, on_checkout=None):
+        self.logger = logging.getLogger(__name__)
+        # 每次借出连接后以等待秒数回调，用于外部指标
+        self.on_checkout = on_checkout
+
+        self._connect_args = dict(connect_args)
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.validate_after = validate_after
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.leak_threshold = leak_threshold
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._total = 0
+        self._metrics = {
+            'checkouts': 0,
+            'checkout_timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'created': 0,
+            'closed': 0,
+            'validations': 0,
+            'validation_failures': 0,
+            'leak_warnings': 0,
+        }
+
+        for _ in range(self.min_size):
+            self._total += 1
+            try:
+                self._idle.append(self._open())
+            except errors.Error:
+                self._total -= 1
+                raise
+
+    @contextmanager
+    def connection(self):
+        """借出一条连接，退出时无论是否异常都会归还"""
+        slot = self._checkout()
+        broken = False
+        try:
+            yield slot.conn
+        except (errors.OperationalError, errors.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._checkin(slot, broken)
+
+    def stats(self) -> dict:
+        """导出连接池指标"""
+        with self._cond:
+            self._report_leaks()
+            checkouts = self._metrics['checkouts']
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._total,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'checkouts': checkouts,
+                'checkout_timeouts': self._metrics['checkout_timeouts'],
+                'wait_ms_avg': round(self._metrics['wait_time_total'] / checkouts * 1000, 3) if checkouts else 0.0,
+                'wait_ms_max': round(self._metrics['wait_time_max'] * 1000, 3),
+                'created': self._metrics['created'],
+                'closed': self._metrics['closed'],
+                'validations': self._metrics['validations'],
+                'validation_failures': self._metrics['validation_failures'],
+                'leak_warnings': self._metrics['leak_warnings'],
+            }
+
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接在归还时关闭）"""
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.popleft())
+            self.min_size = 0
+
+    def _open(self) -> _Slot:
+        conn = mysql.connector.connect(**self._connect_args)
+        with self._cond:
+            self._metrics['created'] += 1
+        return _Slot(conn)
+
+    def _close(self, slot: _Slot):
+        """调用方需持有锁或已将slot移出池"""
+        self._total -= 1
+        self._metrics['closed'] += 1
+        try:
+            slot.conn.close()
+        except errors.Error:
+            pass
+
+    def _checkout(self) -> _Slot:
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        slot = None
+        with self._cond:
+            self._report_leaks()
+            while True:
+                if self._idle:
+                    # LIFO：优先复用最近归还的连接，让多余连接空闲老化后被回收
+                    slot = self._idle.pop()
+                    break
+                if self._total < self.max_size:
+                    self._total += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics['checkout_timeouts'] += 1
+                    raise errors.PoolError(
+                        f"获取数据库连接超时: {self.checkout_timeout}s 内没有可用连接 (max_size={self.max_size})")
+                self._cond.wait(remaining)
+
+        try:
+            slot = self._ensure_usable(slot)
+        except errors.Error as e:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise errors.PoolError(f"无法获取数据库连接: {e}")
+
+        waited = time.monotonic() - start
+        with self._cond:
+            slot.checked_out_at = time.monotonic()
+            slot.owner = threading.current_thread().name
+            slot.leak_reported = False
+            self._in_use[id(slot)] = slot
+            self._metrics['checkouts'] += 1
+            self._metrics['wait_time_total'] += waited
+            self._metrics['wait_time_max'] = max(self._metrics['wait_time_max'], waited)
+        if self.on_checkout:
+            self.on_checkout(waited)
+        return slot
+
+    def _ensure_usable(self, slot):
+        """新建连接，或在空闲超过阈值/超过最大寿命时校验、替换连接"""
+        if slot is None:
+            return self._open()
+
+        now = time.monotonic()
+        if now - slot.created_at > self.max_lifetime:
+            self._discard(slot)
+            return self._open()
+
+        if now - slot.last_used > self.validate_after:
+            with self._cond:
+                self._metrics['validations'] += 1
+            try:
+                slot.conn.ping(reconnect=True, attempts=1, delay=0)
+            except errors.Error as e:
+                with self._cond:
+                    self._metrics['validation_failures'] += 1
+                self.logger.warning(f"空闲连接校验失败，重新建立连接: {e}")
+                self._discard(slot)
+                return self._open()
+        return slot
+
+    def _discard(self, slot):
+        """关闭失效连接但保留其在池中的名额"""
+        with self._cond:
+            self._metrics['closed'] += 1
+        try:
+            slot.conn.close()
+        except errors.Error:
+            pass
+
+    def _checkin(self, slot, broken=False):
+        if not broken:
+            try:
+                if slot.conn.in_transaction:
+                    slot.conn.rollback()
+            except errors.Error:
+                broken = True
+
+        with self._cond:
+            self._in_use.pop(id(slot), None)
+            held = time.monotonic() - slot.checked_out_at
+            if held > self.leak_threshold and not slot.leak_reported:
+                self._metrics['leak_warnings'] += 1
+                self.logger.warning(f"连接被 {slot.owner} 占用 {held:.1f}s 后才归还")
+
+            if broken:
+                self._close(slot)
+            else:
+                slot.last_used = time.monotonic()
+                slot.checked_out_at = None
+                slot.owner = None
+                self._idle.append(slot)
+            self._shrink()
+            self._cond.notify()
+
+    def _shrink(self):
+        """回收空闲过久的多余连接，保持不少于min_size"""
+        now = time.monotonic()
+        while (self._idle and self._total > self.min_size
+               and now - self._idle[0].last_used > self.idle_timeout):
+            self._close(self._idle.popleft())
+
+    def _report_leaks(self):
+        now = time.monotonic()
+        for slot in self._in_use.values():
+            if not slot.leak_reported and now - slot.checked_out_at > self.leak_threshold:
+                slot.leak_reported = True
+                self._metrics['leak_warnings'] += 1
+                self.logger.warning(
+                    f"疑似连接泄漏: {slot.owner} 已占用连接 {now - slot.checked_out_at:.1f}s")
@@ -11,6 +11,19 @@ CREATE TABLE IF NOT EXISTS users (
     password VARCHAR(255) NOT NULL
 );
 
+-- 创建对话表（message_count/last_updated/last_message 随消息写入维护）
+CREATE TABLE IF NOT EXISTS conversations (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    message_count INT NOT NULL DEFAULT 0,
+    last_updated DATETIME NULL,
+    last_message VARCHAR(255) NULL,
+    INDEX idx_conversations_user_updated (user_id, last_updated),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
 -- 创建聊天历史表
 CREATE TABLE IF NOT EXISTS chat_history (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -18,7 +31,12 @@ CREATE TABLE IF NOT EXISTS chat_history (
     role ENUM('user', 'assistant') NOT NULL,
     content TEXT NOT NULL,
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    conversation_id INT,
+    sentiment_label VARCHAR(8) NULL,
+    sentiment_score DECIMAL(5, 4) NULL,
+    archived TINYINT NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
 );
 
 -- 创建故事历史表
@@ -29,5 +47,85 @@ CREATE TABLE IF NOT EXISTS story_history (
     thinking TEXT,
     story TEXT,
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    archived TINYINT NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- 情感分析结果缓存，按消息内容哈希去重
+CREATE TABLE IF NOT EXISTS sentiment_cache (
+    content_hash CHAR(64) PRIMARY KEY,
+    label VARCHAR(8) NOT NULL,
+    score DECIMAL(5, 4) NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 每用户每日情感汇总，随消息打分与删除增量维护
+CREATE TABLE IF NOT EXISTS sentiment_daily (
+    user_id INT NOT NULL,
+    day DATE NOT NULL,
+    message_count INT NOT NULL DEFAULT 0,
+    score_sum DOUBLE NOT NULL DEFAULT 0,
+    negative_count INT NOT NULL DEFAULT 0,
+    negative_score DOUBLE NOT NULL DEFAULT 0,
+    neutral_count INT NOT NULL DEFAULT 0,
+    neutral_score DOUBLE NOT NULL DEFAULT 0,
+    positive_count INT NOT NULL DEFAULT 0,
+    positive_score DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
+
+-- 冷归档：较早记录的正文压缩后移到这里，原表只保留元数据与供检索的正文前缀（archived=1）
+CREATE TABLE IF NOT EXISTS history_archive (
+    source VARCHAR(8) NOT NULL,
+    doc_id INT NOT NULL,
+    dict_id INT NULL,
+    payload MEDIUMBLOB NOT NULL,
+    raw_size INT NOT NULL,
+    PRIMARY KEY (source, doc_id)
+);
+
+CREATE TABLE IF NOT EXISTS archive_dicts (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    source VARCHAR(8) NOT NULL,
+    codec VARCHAR(8) NOT NULL,
+    data MEDIUMBLOB NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 多轮对话的滚动摘要，summarized_until为已并入摘要的最后一条消息ID
+CREATE TABLE IF NOT EXISTS conversation_contexts (
+    conversation_id INT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    summarized_until INT NOT NULL,
+    updated_at DATETIME NULL,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+);
+
+-- 批量故事任务与条目，条目状态持久化以便进程重启后继续
+CREATE TABLE IF NOT EXISTS story_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    status ENUM('pending', 'running', 'completed', 'cancelled') NOT NULL DEFAULT 'pending',
+    total INT NOT NULL,
+    completed INT NOT NULL DEFAULT 0,
+    failed INT NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME NULL,
+    INDEX idx_story_jobs_user (user_id, id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS story_job_items (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    job_id INT NOT NULL,
+    position INT NOT NULL,
+    prompt TEXT NOT NULL,
+    status ENUM('pending', 'running', 'done', 'failed', 'cancelled') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    error VARCHAR(255) NULL,
+    updated_at DATETIME NULL,
+    INDEX idx_story_job_items_status (status, id),
+    INDEX idx_story_job_items_job (job_id, position),
+    FOREIGN KEY (job_id) REFERENCES story_jobs(id) ON DELETE CASCADE
+);
@@ -0,0 +1,104 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from flask import Response, g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# 独立的registry，只导出本服务的指标
+registry = CollectorRegistry()
+
+# 覆盖从微秒级SQL到数十秒的流式生成
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    'story_stage_seconds', '请求各阶段耗时', ['stage'], buckets=_BUCKETS, registry=registry)
+REQUEST_SECONDS = Histogram(
+    'story_http_request_seconds', '请求耗时（流式接口为响应头返回前的耗时）',
+    ['endpoint', 'method', 'status'], buckets=_BUCKETS, registry=registry)
+TOKENS_STREAMED = Counter(
+    'story_tokens_streamed_total', '流式返回的模型输出token数', ['endpoint'], registry=registry)
+
+
+def observe(stage: str, seconds: float):
+    """记录一个阶段的耗时；在请求上下文中同时计入该请求的Server-Timing"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if has_request_context():
+        timings = g.setdefault('stage_timings', {})
+        total, count = timings.get(stage, (0.0, 0))
+        timings[stage] = (total + seconds, count + 1)
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+class _StatsCollector:
+    """把各组件stats()中的数值导出为gauge，抓取时才读取"""
+
+    def __init__(self):
+        self.sources: Dict[str, Callable[[], dict]] = {}
+
+    def collect(self):
+        for name, source in list(self.sources.items()):
+            try:
+                stats = source()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                family = GaugeMetricFamily(f'story_{name}_{key}', f'{name}.stats()["{key}"]')
+                family.add_metric([], value)
+                yield family
+
+
+_stats_collector = _StatsCollector()
+registry.register(_stats_collector)
+
+
+def register_stats(name: str, source: Callable[[], dict]):
+    """注册一个stats()来源，例如连接池、缓存"""
+    _stats_collector.sources[name] = source
+
+
+def server_timing_header(timings: dict, total_seconds: float) -> str:
+    parts = []
+    for stage, (seconds, count) in timings.items():
+        entry = f"{stage};dur={seconds * 1000:.2f}"
+        if count > 1:
+            entry += f';desc="{count}x"'
+        parts.append(entry)
+    parts.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ', '.join(parts)
+
+
+def init_metrics(app, path: str = '/metrics'):
+    """注册请求计时钩子、Server-Timing响应头与Prometheus抓取端点"""
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        if 'auth_ms' in g:
+            observe('auth', g.auth_ms / 1000)
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, request.method, str(response.status_code)).observe(elapsed)
+        response.headers['Server-Timing'] = server_timing_header(g.get('stage_timings', {}), elapsed)
+        return response
+
+    @app.route(path, methods=['GET'])
+    def prometheus_metrics():
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,277 @@
+from mysql.connector import Error
+
+from db_pool import ConnectionPool
+from metrics import observe
+from storage import SEARCH_SOURCES, Session, Storage, StorageError
+from text_search import query_terms
+
+
+class MySQLStorage(Storage):
+    """MySQL存储实现，连接来自db_pool.ConnectionPool"""
+
+    name = 'mysql'
+    for_update = ' FOR UPDATE'
+
+    def __init__(self, dbconfig: dict, **pool_options):
+        super().__init__()
+        try:
+            self.pool = ConnectionPool(dbconfig, on_checkout=lambda waited: observe('db_checkout', waited),
+                                       **pool_options)
+        except Error as e:
+            raise StorageError(f"无法连接MySQL: {e}") from e
+
+    def _read(self, fn):
+        try:
+            with self.pool.connection() as conn, conn.cursor(dictionary=True) as cursor:
+                return fn(Session(cursor))
+        except Error as e:
+            raise StorageError(str(e)) from e
+
+    def _write(self, fn):
+        try:
+            with self.pool.connection() as conn, conn.cursor(dictionary=True) as cursor:
+                conn.start_transaction()
+                result = fn(Session(cursor))
+                conn.commit()
+                return result
+        except Error as e:
+            raise StorageError(str(e)) from e
+
+    def stats(self) -> dict:
+        return self.pool.stats()
+
+    def search_history(self, user_id, query, sources=SEARCH_SOURCES, limit=20, offset=0):
+        """基于ngram解析器的FULLTEXT索引检索，InnoDB随写入自动维护索引"""
+        terms = query_terms(query)
+        if not terms:
+            return {'total': 0, 'hits': []}
+
+        parts, params = [], []
+        if 'story' in sources:
+            parts.append("""
+                SELECT 'story' AS source, id AS doc_id, timestamp,
+                       MATCH(input_prompt, story) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+                FROM story_history
+                WHERE user_id = %s AND MATCH(input_prompt, story) AGAINST (%s IN NATURAL LANGUAGE MODE)
+            """)
+            params += [query, user_id, query]
+        if 'chat' in sources:
+            parts.append("""
+                SELECT 'chat' AS source, id AS doc_id, timestamp,
+                       MATCH(content) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+                FROM chat_history
+                WHERE user_id = %s AND MATCH(content) AGAINST (%s IN NATURAL LANGUAGE MODE)
+            """)
+            params += [query, user_id, query]
+        union = ' UNION ALL '.join(parts)
+
+        def work(db):
+            total = db.execute(f"SELECT COUNT(*) AS n FROM ({union}) AS matched", params).scalar()
+            rows = db.execute(f"{union} ORDER BY score DESC, timestamp DESC LIMIT %s OFFSET %s",
+                              params + [limit, offset]).fetchall()
+            ranked = [(row['source'], row['doc_id'], row['score']) for row in rows]
+            return {'total': total, 'hits': self._load_search_hits(db, ranked, terms)}
+        return self._read(work)
+
+    def _upsert_increment(self, keys, columns) -> str:
+        updates = ', '.join(f"{column} = {column} + VALUES({column})" for column in columns)
+        return f"ON DUPLICATE KEY UPDATE {updates}"
+
+    def close(self):
+        self.pool.close_all()
+
+    def init_schema(self):
+        def work(db):
+            # 创建users表（必须先创建，因为其他表引用它）
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    username VARCHAR(255) UNIQUE NOT NULL,
+                    password VARCHAR(255) NOT NULL
+                )
+            """)
+
+            # 创建conversations表
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    title VARCHAR(255) NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    message_count INT NOT NULL DEFAULT 0,
+                    last_updated DATETIME NULL,
+                    last_message VARCHAR(255) NULL,
+                    INDEX idx_conversations_user_updated (user_id, last_updated),
+                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+                )
+            """)
+
+            # 旧库升级：为conversations补充对话摘要字段
+            summary_added = False
+            summary_added |= self._ensure_column(db, 'conversations', 'message_count', 'INT NOT NULL DEFAULT 0')
+            summary_added |= self._ensure_column(db, 'conversations', 'last_updated', 'DATETIME NULL')
+            summary_added |= self._ensure_column(db, 'conversations', 'last_message', 'VARCHAR(255) NULL')
+            self._ensure_index(db, 'conversations', 'idx_conversations_user_updated', '(user_id, last_updated)')
+
+            # 创建chat_history表
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS chat_history (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    role ENUM('user', 'assistant') NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    conversation_id INT,
+                    sentiment_label VARCHAR(8) NULL,
+                    sentiment_score DECIMAL(5, 4) NULL,
+                    archived TINYINT NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+                    FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+                )
+            """)
+
+            self._ensure_column(db, 'chat_history', 'sentiment_label', 'VARCHAR(8) NULL')
+            self._ensure_column(db, 'chat_history', 'sentiment_score', 'DECIMAL(5, 4) NULL')
+            self._ensure_column(db, 'chat_history', 'archived', 'TINYINT NOT NULL DEFAULT 0')
+
+            # 创建story_history表
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS story_history (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    input_prompt TEXT,
+                    thinking TEXT,
+                    story TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    archived TINYINT NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+                )
+            """)
+            self._ensure_column(db, 'story_history', 'archived', 'TINYINT NOT NULL DEFAULT 0')
+
+            # 中文全文检索索引（ngram解析器）
+            self._ensure_index(db, 'story_history', 'ft_story_history', '(input_prompt, story) WITH PARSER ngram',
+                               kind='FULLTEXT')
+            self._ensure_index(db, 'chat_history', 'ft_chat_history', '(content) WITH PARSER ngram',
+                               kind='FULLTEXT')
+
+            # 情感分析结果缓存，按消息内容哈希去重
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS sentiment_cache (
+                    content_hash CHAR(64) PRIMARY KEY,
+                    label VARCHAR(8) NOT NULL,
+                    score DECIMAL(5, 4) NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 每用户每日情感汇总，随消息打分与删除增量维护
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS sentiment_daily (
+                    user_id INT NOT NULL,
+                    day DATE NOT NULL,
+                    message_count INT NOT NULL DEFAULT 0,
+                    score_sum DOUBLE NOT NULL DEFAULT 0,
+                    negative_count INT NOT NULL DEFAULT 0,
+                    negative_score DOUBLE NOT NULL DEFAULT 0,
+                    neutral_count INT NOT NULL DEFAULT 0,
+                    neutral_score DOUBLE NOT NULL DEFAULT 0,
+                    positive_count INT NOT NULL DEFAULT 0,
+                    positive_score DOUBLE NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, day),
+                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+                )
+            """)
+
+            # 冷归档：较早记录的正文压缩后移到这里，原表只保留元数据与供检索的正文前缀（archived=1）
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS history_archive (
+                    source VARCHAR(8) NOT NULL,
+                    doc_id INT NOT NULL,
+                    dict_id INT NULL,
+                    payload MEDIUMBLOB NOT NULL,
+                    raw_size INT NOT NULL,
+                    PRIMARY KEY (source, doc_id)
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS archive_dicts (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    source VARCHAR(8) NOT NULL,
+                    codec VARCHAR(8) NOT NULL,
+                    data MEDIUMBLOB NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 多轮对话的滚动摘要，summarized_until为已并入摘要的最后一条消息ID
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_contexts (
+                    conversation_id INT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    summarized_until INT NOT NULL,
+                    updated_at DATETIME NULL,
+                    FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+                )
+            """)
+
+            # 批量故事任务与条目，条目状态持久化以便进程重启后继续
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS story_jobs (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    status ENUM('pending', 'running', 'completed', 'cancelled') NOT NULL DEFAULT 'pending',
+                    total INT NOT NULL,
+                    completed INT NOT NULL DEFAULT 0,
+                    failed INT NOT NULL DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME NULL,
+                    INDEX idx_story_jobs_user (user_id, id),
+                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS story_job_items (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    job_id INT NOT NULL,
+                    position INT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    status ENUM('pending', 'running', 'done', 'failed', 'cancelled') NOT NULL DEFAULT 'pending',
+                    attempts INT NOT NULL DEFAULT 0,
+                    error VARCHAR(255) NULL,
+                    updated_at DATETIME NULL,
+                    INDEX idx_story_job_items_status (status, id),
+                    INDEX idx_story_job_items_job (job_id, position),
+                    FOREIGN KEY (job_id) REFERENCES story_jobs (id) ON DELETE CASCADE
+                )
+            """)
+            return summary_added
+
+        if self._write(work):
+            # 新增摘要字段后回填一次已有对话
+            refreshed = self.refresh_conversation_summaries()
+            self.logger.info(f"已回填 {refreshed} 个对话的摘要")
+
+    @staticmethod
+    def _ensure_column(db, table, column, definition):
+        """字段不存在时追加，返回是否新增"""
+        exists = db.execute(
+            "SELECT COUNT(*) AS n FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, column)
+        ).scalar()
+        if exists:
+            return False
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+
+    @staticmethod
+    def _ensure_index(db, table, index, columns, kind=''):
+        """索引不存在时创建，kind可为UNIQUE/FULLTEXT"""
+        exists = db.execute(
+            "SELECT COUNT(*) AS n FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+            (table, index)
+        ).scalar()
+        if not exists:
+            db.execute(f"CREATE {kind + ' ' if kind else ''}INDEX {index} ON {table} {columns}")
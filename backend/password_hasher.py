@@ -0,0 +1,122 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from typing import Callable
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """等待中的哈希任务已达上限，调用方应返回503让客户端稍后重试"""
+
+
+def _hash(password: str, method: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+def _verify(stored_hash: str, password: str) -> bool:
+    return check_password_hash(stored_hash, password)
+
+
+def _hash_parameters(stored_hash: str) -> str:
+    # werkzeug格式为 method$salt$hash，method部分包含算法与参数
+    return stored_hash.split('$', 1)[0]
+
+
+def _method_parameters(method: str) -> str:
+    """按werkzeug的默认值补全方法名中省略的参数，得到与生成的哈希相同的前缀，无需实际计算哈希"""
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return f"scrypt:{2 ** 15}:8:1"
+    if name == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+class PasswordHasher:
+    """在独立进程池中计算密码哈希，避免CPU密集的PBKDF2/scrypt占用请求线程的GIL
+
+    等待中的任务超过max_pending时立即拒绝（HasherBusy），不无限排队；
+    workers为0时在调用线程中直接计算，便于测试与单进程调试。
+    """
+
+    def __init__(self, method: str = 'scrypt', workers: int = 2, max_pending: int = 32,
+                 timeout: float = 10.0):
+        self.logger = logging.getLogger(__name__)
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._current_parameters = _method_parameters(method)
+        self._metrics = {'hashed': 0, 'verified': 0, 'rehashed': 0, 'rejected': 0}
+
+    def hash(self, password: str) -> str:
+        self._metrics['hashed'] += 1
+        return self._wait(self._submit(_hash, password, self.method))
+
+    def verify(self, stored_hash: str, password: str) -> bool:
+        self._metrics['verified'] += 1
+        return self._wait(self._submit(_verify, stored_hash, password))
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        """已存储的哈希是否使用了旧的算法或参数"""
+        return _hash_parameters(stored_hash) != self._current_parameters
+
+    def rehash_later(self, password: str, save: Callable[[str], None]):
+        """后台用当前参数重新计算哈希并交给save保存，不阻塞登录响应；繁忙时跳过，下次登录再试"""
+        try:
+            future = self._submit(_hash, password, self.method)
+        except HasherBusy:
+            return
+
+        def done(f: Future):
+            try:
+                save(f.result())
+                self._metrics['rehashed'] += 1
+            except Exception as e:
+                self.logger.error(f"密码哈希升级失败: {e}")
+        future.add_done_callback(done)
+
+    def stats(self) -> dict:
+        return dict(self._metrics, workers=self.workers, method=self.method)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _wait(self, future: Future):
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HasherBusy('密码校验超时') from None
+
+    def _submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            self._metrics['rejected'] += 1
+            raise HasherBusy('密码校验请求过多')
+        try:
+            future = self._pool_submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _pool_submit(self, fn, *args) -> Future:
+        if not self.workers:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self._lock:
+            if self._executor is None:
+                # 使用spawn启动子进程，不继承Flask进程中已有的线程、锁与数据库连接
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return self._executor.submit(fn, *args)
+
@@ -0,0 +1,223 @@
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from flask import g, jsonify, request
+
+from auth import login_required
+
+
+class SamplingProfiler:
+    """按固定间隔采样指定线程的调用栈，结果为 {调用栈(根到叶): 采样次数}
+
+    可用follow追加按名称前缀匹配的线程（如流式响应的生产线程及其读取线程），各线程的样本合并在同一结果中。
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.name_prefixes = ()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def follow(self, name_prefix: str):
+        self.name_prefixes = self.name_prefixes + (name_prefix,)
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            thread_ids = {self.thread_id}
+            if self.name_prefixes:
+                thread_ids.update(thread.ident for thread in threading.enumerate()
+                                  if thread.name.startswith(self.name_prefixes))
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+
+
+def follow_threads(name_prefix: str):
+    """当前请求正在被分析时，同时采样名称以name_prefix开头的线程；未分析时不做任何事"""
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.follow(name_prefix)
+
+
+def write_collapsed(path: str, stacks: Counter):
+    """collapsed格式，每行 "帧;帧;帧 次数"，可直接用于flamegraph.pl与speedscope"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in stacks.most_common():
+            f.write(';'.join(frame.replace(';', ':') for frame in stack) + f" {count}\n")
+
+
+def write_speedscope(path: str, stacks: Counter, name: str, interval: float):
+    frames, index = [], {}
+    samples, weights = [], []
+    for stack, count in stacks.items():
+        sample = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame})
+            sample.append(index[frame])
+        samples.append(sample)
+        weights.append(count * interval * 1000)
+    document = {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled', 'name': name, 'unit': 'milliseconds',
+            'startValue': 0, 'endValue': sum(weights), 'samples': samples, 'weights': weights,
+        }],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f)
+
+
+def sign_profile_request(secret: str, path: str, timestamp: Optional[int] = None) -> str:
+    """生成X-Profile-Request头的值: "时间戳:HMAC-SHA256(时间戳:路径)" """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}:{path}".encode(), hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+class RequestProfiler:
+    """按需对单个请求做采样分析，覆盖视图函数与流式响应的生成器主体
+
+    触发方式（均未配置时不注册任何钩子，没有额外开销）:
+    - 带有效签名的 X-Profile-Request 请求头
+    - 管理员通过 POST /api/admin/profile 为某个路由预约接下来的N次请求
+    - 每N个请求抽样一次
+    """
+
+    header = 'X-Profile-Request'
+
+    def __init__(self, output_dir: str = 'profiles', secret: Optional[str] = None, sample_every: int = 0,
+                 admin_ids: Iterable[int] = (), interval: float = 0.005, fmt: str = 'collapsed',
+                 max_age: float = 300.0):
+        self.logger = logging.getLogger(__name__)
+        self.output_dir = output_dir
+        self.secret = secret
+        self.sample_every = sample_every
+        self.admin_ids = set(admin_ids)
+        self.interval = interval
+        self.fmt = fmt
+        self.max_age = max_age
+        self._armed = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._ids = itertools.count(1)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.secret or self.sample_every or self.admin_ids)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if self.admin_ids:
+            app.add_url_rule('/api/admin/profile', 'arm_profiler', login_required(self._arm), methods=['POST'])
+
+    def arm(self, endpoint: str, count: int = 1):
+        """为路由（如 /api/generate_story）预约接下来count次请求的分析"""
+        with self._lock:
+            self._armed[endpoint] = self._armed.get(endpoint, 0) + count
+
+    def _arm(self):
+        if g.user_id not in self.admin_ids:
+            return jsonify({'error': '无权限'}), 403
+        data = request.get_json(silent=True) or {}
+        endpoint = data.get('endpoint')
+        if not endpoint:
+            return jsonify({'error': '缺少endpoint参数'}), 400
+        try:
+            count = max(1, min(int(data.get('count', 1)), 100))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'count应为整数'}), 400
+        self.arm(endpoint, count)
+        return jsonify({'endpoint': endpoint, 'armed': self._armed[endpoint]})
+
+    def _should_profile(self) -> bool:
+        if self.secret and self.header in request.headers:
+            if self._valid_signature(request.headers[self.header]):
+                return True
+            self.logger.warning(f"无效的性能分析签名: {request.path}")
+        if self._armed:
+            with self._lock:
+                remaining = self._armed.get(request.path, 0)
+                if remaining:
+                    self._armed[request.path] = remaining - 1
+                    if remaining == 1:
+                        del self._armed[request.path]
+                    return True
+        return bool(self.sample_every) and next(self._counter) % self.sample_every == 0
+
+    def _valid_signature(self, value: str) -> bool:
+        timestamp, _, _ = value.partition(':')
+        if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > self.max_age:
+            return False
+        return hmac.compare_digest(value, sign_profile_request(self.secret, request.path, int(timestamp)))
+
+    def _before_request(self):
+        if self._should_profile():
+            g.profiler = SamplingProfiler(threading.get_ident(), self.interval).start()
+            g.profile_started = time.perf_counter()
+
+    def _after_request(self, response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        started = g.pop('profile_started')
+        route = request.url_rule.rule if request.url_rule else request.path
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._ids)}"
+        response.headers['X-Profile-Id'] = profile_id
+
+        # 流式响应的生成器在视图返回后才执行，等响应关闭后再停止采样
+        def finish():
+            stacks = profiler.stop()
+            duration_ms = (time.perf_counter() - started) * 1000
+            path = os.path.join(self.output_dir, self._filename(route, duration_ms, profile_id))
+            try:
+                if self.fmt == 'speedscope':
+                    write_speedscope(path, stacks, f"{route} {duration_ms:.0f}ms", self.interval)
+                else:
+                    write_collapsed(path, stacks)
+                self.logger.info(f"性能分析已写入 {path} ({sum(stacks.values())} 个样本)")
+            except OSError as e:
+                self.logger.error(f"写入性能分析结果失败: {e}")
+        response.call_on_close(finish)
+        return response
+
+    def _filename(self, route: str, duration_ms: float, profile_id: str) -> str:
+        """文件名包含路由与耗时，如 api_generate_story_5320ms_20240501-101500-3.collapsed.txt"""
+        slug = re.sub(r'[^0-9A-Za-z]+', '_', route).strip('_') or 'root'
+        extension = 'speedscope.json' if self.fmt == 'speedscope' else 'collapsed.txt'
+        return f"{slug}_{duration_ms:.0f}ms_{profile_id}.{extension}"
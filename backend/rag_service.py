@@ -10,6 +10,8 @@ from langchain.retrievers import EnsembleRetriever
 from langchain_community.retrievers import BM25Retriever
 from langchain_core.documents import Document
 
+from metrics import span
+
 
 class RAGService:
     def __init__(self, embeddings_model: str = "text-embedding-v1"):
@@ -101,10 +103,11 @@ class RAGService:
         if not self.vector_db or not self.text_db:
             raise ValueError("RAG系统未初始化")
 
+        # 分别执行向量检索与关键词检索以便单独计时，再按权重做倒数排名融合
         retriever = self.get_retriever(top_k)
-        try:
-            # 优先使用新的invoke方法
-            return retriever.invoke(query)
-        except AttributeError:
-            # 兼容旧版本
-            return retriever.get_relevant_documents(query)
\ No newline at end of file
+        vector_retriever, keyword_retriever = retriever.retrievers
+        with span('rag_vector_search'):
+            vector_docs = vector_retriever.invoke(query)
+        with span('rag_keyword_search'):
+            keyword_docs = keyword_retriever.invoke(query)
+        return retriever.weighted_reciprocal_rank([vector_docs, keyword_docs])
\ No newline at end of file
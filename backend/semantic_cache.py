@@ -0,0 +1,236 @@
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from metrics import span
+from stream_relay import sse_frame
+
+# 提示词里与主题无关的套话，本地向量化前去掉，"讲个关于勇敢的故事"与"讲一个勇敢的故事"都只剩"勇敢"
+STOP_PHRASES = sorted((
+    '请你', '请', '给我', '帮我', '为我', '我想听', '我要听', '想听', '能不能', '可以',
+    '讲一个', '讲一讲', '讲个', '讲讲', '讲', '说一个', '说个', '来一个', '来个', '编一个', '编个',
+    '一个', '关于', '有关', '的故事', '故事', '吧', '呢', '吗', '好吗', '好不好',
+), key=len, reverse=True)
+_STOP_RE = re.compile('|'.join(map(re.escape, STOP_PHRASES)))
+_PUNCT_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def normalize_prompt(prompt: str) -> str:
+    text = _STOP_RE.sub('', _PUNCT_RE.sub('', prompt))
+    return text or _PUNCT_RE.sub('', prompt)
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class HashingEmbedder:
+    """本地字符n-gram哈希向量（1-2字），无需网络与模型，适合措辞接近的改写"""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            chars = normalize_prompt(text)
+            for n, weight in ((1, 0.5), (2, 1.0)):
+                for i in range(len(chars) - n + 1):
+                    vectors[row, zlib.crc32(chars[i:i + n].encode()) % self.dim] += weight
+        return _normalize_rows(vectors)
+
+
+class DashScopeEmbedder:
+    """通义text-embedding接口，能匹配用词不同但语义相同的提示词，每次查询多一次网络请求"""
+
+    url = 'https://dashscope.aliyuncs.com/api/v1/services/embeddings/text-embedding/text-embedding'
+
+    def __init__(self, api_key: str, model: str = 'text-embedding-v2', batch_size: int = 25, timeout: float = 10):
+        self.api_key = api_key
+        self.model = model
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        import requests
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = requests.post(
+                self.url,
+                json={'model': self.model, 'input': {'texts': texts[start:start + self.batch_size]}},
+                headers={'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            embeddings = sorted(response.json()['output']['embeddings'], key=lambda e: e['text_index'])
+            vectors += [e['embedding'] for e in embeddings]
+        return _normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+class SemanticStoryCache:
+    """按提示词相似度复用已生成的故事，命中时按设定节奏以SSE回放
+
+    索引只保存提示词向量与少量元数据，故事正文命中后再从storage读取。
+    新故事通过sync()增量加入；内容相同的故事（包括回放写入的记录）只索引一次。
+
+    多样性与新鲜度控制:
+    - scope: 'user' 只复用本人的故事，'global' 复用所有用户的故事
+    - max_age: 超过该秒数的故事不再复用
+    - max_replays_per_user / max_replays: 同一故事对同一用户 / 总共最多回放次数
+    - explore: 按该概率跳过缓存重新生成，让故事库持续扩充
+    命中时在满足条件的候选中随机挑选，而不总是返回最相似的一个。
+    """
+
+    def __init__(self, storage, embedder=None, threshold: float = 0.9, scope: str = 'user',
+                 max_age: Optional[float] = 30 * 86400, max_replays_per_user: int = 1, max_replays: int = 20,
+                 explore: float = 0.1, top_k: int = 5, max_entries: int = 20000,
+                 chunk_chars: int = 8, chunk_interval: float = 0.03, max_tracked_replays: int = 100000):
+        if scope not in ('user', 'global'):
+            raise ValueError(f"未知的缓存范围: {scope}")
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.scope = scope
+        self.max_age = max_age
+        self.max_replays_per_user = max_replays_per_user
+        self.max_replays = max_replays
+        self.explore = explore
+        self.top_k = top_k
+        self.max_entries = max_entries
+        self.chunk_chars = chunk_chars
+        self.chunk_interval = chunk_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._resync = False
+        self._vectors = None
+        self._story_ids = np.zeros(0, dtype=np.int64)
+        self._user_ids = np.zeros(0, dtype=np.int64)
+        self._created = np.zeros(0, dtype=np.float64)
+        self._digests = set()
+        self._last_id = 0
+        # 回放计数按最近使用淘汰，最多保留max_tracked_replays个键
+        self._replays = OrderedDict()
+        self.max_tracked_replays = max_tracked_replays
+        self._metrics = {'lookups': 0, 'hits': 0, 'explored': 0, 'indexed': 0}
+
+    def sync(self) -> dict:
+        """把last_id之后写入的故事加入索引，首次调用只取最近max_entries条
+
+        查询与向量化在索引锁之外进行，不阻塞lookup；成功后才追加向量并推进last_id，
+        向量化失败时这批故事下次sync重试。已有sync进行时只做标记，由它完成后再同步一轮。
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            self._resync = True
+            return {'indexed': len(self._story_ids), 'added': 0}
+        try:
+            added = 0
+            self._resync = True
+            while self._resync:
+                self._resync = False
+                added += self._sync_once()
+            return {'indexed': len(self._story_ids), 'added': added}
+        finally:
+            self._sync_lock.release()
+
+    def _sync_once(self) -> int:
+        rows = self.storage.list_recent_stories(self.max_entries, after_id=self._last_id)
+        fresh, digests = [], set()
+        for row in rows:
+            digest = hashlib.sha1((row['story'] or '').encode()).digest()
+            if row['story'] and row['input_prompt'] and digest not in self._digests and digest not in digests:
+                digests.add(digest)
+                fresh.append(row)
+        vectors = self.embedder.embed([row['input_prompt'] for row in fresh]) if fresh else None
+        with self._lock:
+            if fresh:
+                self._append(fresh, vectors)
+            if rows:
+                self._last_id = max(row['id'] for row in rows)
+        self._digests |= digests
+        return len(fresh)
+
+    def lookup(self, user_id, prompt: str) -> Optional[dict]:
+        """返回 {story_id, similarity, thinking, story}，未命中返回None"""
+        self._metrics['lookups'] += 1
+        if self.explore and random.random() < self.explore:
+            self._metrics['explored'] += 1
+            return None
+        with span('semantic_cache_embed'):
+            query = self.embedder.embed([prompt])[0]
+
+        with self._lock:
+            if self._vectors is None or not len(self._story_ids):
+                return None
+            similarities = self._vectors[:len(self._story_ids)] @ query
+            eligible = similarities >= self.threshold
+            if self.scope == 'user':
+                eligible &= self._user_ids == user_id
+            if self.max_age:
+                eligible &= self._created >= time.time() - self.max_age
+            candidates = [i for i in np.flatnonzero(eligible) if self._replayable(user_id, int(self._story_ids[i]))]
+            candidates = sorted(candidates, key=lambda i: similarities[i], reverse=True)[:self.top_k]
+            if not candidates:
+                return None
+            chosen = random.choice(candidates)
+            story_id, similarity = int(self._story_ids[chosen]), float(similarities[chosen])
+            for key in (story_id, (user_id, story_id)):
+                self._replays[key] = self._replays.get(key, 0) + 1
+                self._replays.move_to_end(key)
+            while len(self._replays) > self.max_tracked_replays:
+                self._replays.popitem(last=False)
+
+        row = self.storage.get_story(story_id)
+        if row is None:
+            return None
+        self._metrics['hits'] += 1
+        return {'story_id': story_id, 'similarity': similarity,
+                'thinking': row['thinking'] or '', 'story': row['story']}
+
+    def replay(self, hit: dict) -> Iterator[str]:
+        """与上游流式输出格式相同的SSE事件，每chunk_chars个字一帧，帧间隔chunk_interval秒"""
+        text = f"{hit['thinking']}\n-\n{hit['story']}" if hit['thinking'] else hit['story']
+        for start in range(0, len(text), self.chunk_chars):
+            if start and self.chunk_interval:
+                time.sleep(self.chunk_interval)
+            yield sse_frame(text[start:start + self.chunk_chars])
+
+    def stats(self) -> dict:
+        return dict(self._metrics, entries=len(self._story_ids), scope=self.scope, threshold=self.threshold)
+
+    def _replayable(self, user_id, story_id) -> bool:
+        return (self._replays.get((user_id, story_id), 0) < self.max_replays_per_user
+                and self._replays.get(story_id, 0) < self.max_replays)
+
+    def _append(self, rows, vectors):
+        count = len(self._story_ids)
+        if self._vectors is None:
+            self._vectors = np.zeros((max(len(rows), 1024), vectors.shape[1]), dtype=np.float32)
+        elif count + len(rows) > len(self._vectors):
+            grown = np.zeros((max(2 * len(self._vectors), count + len(rows)), vectors.shape[1]), dtype=np.float32)
+            grown[:count] = self._vectors[:count]
+            self._vectors = grown
+        self._vectors[count:count + len(rows)] = vectors
+        self._story_ids = np.append(self._story_ids, [row['id'] for row in rows])
+        self._user_ids = np.append(self._user_ids, [row['user_id'] for row in rows])
+        self._created = np.append(self._created, [row['timestamp'].timestamp() for row in rows])
+        self._metrics['indexed'] += len(rows)
+
+        # 超出容量时丢弃最早的条目
+        overflow = len(self._story_ids) - self.max_entries
+        if overflow > 0:
+            keep = len(self._story_ids) - overflow
+            self._vectors[:keep] = self._vectors[overflow:overflow + keep]
+            self._story_ids = self._story_ids[overflow:]
+            self._user_ids = self._user_ids[overflow:]
+            self._created = self._created[overflow:]
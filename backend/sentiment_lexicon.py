@@ -0,0 +1,140 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# label与数组下标的对应，sentiment_service也从这里导入
+LABELS = ('负面', '中性', '正面')
+
+# 情感词及权重，正数为正面，负数为负面；否定组合单独列出以便按最长匹配优先
+LEXICON = {
+    # 正面
+    '开心': 1.0, '高兴': 1.0, '快乐': 1.0, '快活': 1.0, '愉快': 1.0, '欢乐': 1.0, '幸福': 1.2,
+    '喜欢': 1.0, '喜爱': 1.0, '热爱': 1.2, '爱你': 1.0, '我爱': 1.0, '爱上': 0.8,
+    '好玩': 1.0, '有趣': 1.0, '有意思': 1.0, '好听': 1.0, '好看': 1.0, '好吃': 0.8, '精彩': 1.0,
+    '棒': 1.0, '厉害': 0.8, '优秀': 1.0, '漂亮': 0.8, '可爱': 0.8, '美好': 1.0, '美丽': 0.8,
+    '温暖': 1.0, '感动': 0.8, '感谢': 0.8, '谢谢': 0.6, '满意': 1.0, '放心': 0.6, '安心': 0.8,
+    '舒服': 0.8, '轻松': 0.6, '兴奋': 1.0, '激动': 0.6, '期待': 0.8, '自豪': 1.0, '勇敢': 0.8,
+    '成功': 0.8, '友好': 0.8, '善良': 0.8, '哈哈': 1.0, '嘻嘻': 1.0, '嘿嘿': 0.6, '笑了': 0.8,
+    '微笑': 0.8, '大笑': 1.0, '甜': 0.6, '赞': 0.8, '爽': 0.8, '太好了': 1.5, '真好': 1.0,
+    '好朋友': 0.6, '不错': 0.8, '表扬': 0.8, '夸我': 0.8, '学会': 0.6, '得了第一': 1.0,
+    '😊': 1.0, '😄': 1.0, '😁': 1.0, '❤': 1.0, '👍': 1.0,
+    # 负面
+    '难过': -1.0, '伤心': -1.2, '悲伤': -1.2, '难受': -1.0, '痛苦': -1.2, '委屈': -1.0,
+    '害怕': -1.0, '恐怖': -1.0, '可怕': -1.0, '吓人': -0.8, '吓死': -1.0, '噩梦': -1.0,
+    '生气': -1.0, '愤怒': -1.2, '气死': -1.2, '讨厌': -1.0, '烦': -0.8, '烦人': -1.0, '烦躁': -1.0,
+    '孤单': -1.0, '孤独': -1.0, '寂寞': -1.0, '无聊': -0.8, '没意思': -0.8, '没劲': -0.8,
+    '担心': -0.8, '紧张': -0.6, '焦虑': -1.0, '失望': -1.0, '沮丧': -1.0, '郁闷': -1.0, '绝望': -1.5,
+    '后悔': -0.8, '糟糕': -1.0, '倒霉': -0.8, '哭': -1.0, '想哭': -1.2, '哭了': -1.2,
+    '疼': -0.8, '痛': -0.8, '累': -0.6, '欺负': -1.2, '吵架': -1.0, '打我': -1.2, '骂我': -1.2,
+    '被骂': -1.0, '舍不得': -0.6, '没有朋友': -1.0, '没人陪': -1.0,
+    '不开心': -1.2, '不高兴': -1.2, '不喜欢': -1.0, '不快乐': -1.2, '不好玩': -0.8, '不好': -0.8,
+    '不想活': -2.0, '不舒服': -0.8, '坏人': -0.6, '笨蛋': -0.8,
+    '😢': -1.0, '😭': -1.2, '😡': -1.2, '😞': -1.0,
+}
+
+# 否定词：翻转并减弱其后情感词的极性，第二个值为强度系数
+NEGATORS = {
+    '不': 1.0, '没': 1.0, '没有': 1.0, '别': 1.0, '不要': 1.0, '不是': 1.0, '并不': 1.0,
+    '从不': 1.0, '从来不': 1.0, '毫不': 1.0, '一点也不': 1.2, '一点都不': 1.2, '不太': 0.6, '不怎么': 0.6,
+}
+
+# 程度副词：放大或减弱其后情感词的强度
+INTENSIFIERS = {
+    '非常': 2.0, '特别': 1.8, '超级': 2.0, '超': 1.6, '太': 1.8, '十分': 1.8, '极其': 2.0, '最': 2.0,
+    '好': 1.5, '很': 1.5, '真': 1.5, '真的': 1.5, '挺': 1.3, '更': 1.3, '越来越': 1.3,
+    '有点': 0.6, '有些': 0.6, '有一点': 0.5, '稍微': 0.5, '比较': 0.8, '好像': 0.7, '可能': 0.7,
+}
+
+# 否定后的极性：翻转并打折，例如"不难过"只算弱正面
+NEGATION_FLIP = -0.6
+# 转折词之前的内容权重减半，"虽然…但是…"以后半句为主
+CONTRAST_DISCOUNT = 0.5
+
+_CLAUSE_RE = re.compile(r'[，。！？!?,.；;：:\n、~…]+')
+_CONTRAST_RE = re.compile(r'但是|可是|不过|然而|但')
+
+
+def _alternation(words) -> re.Pattern:
+    # 长词在前，保证最长匹配
+    return re.compile('|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True)))
+
+
+class LexiconScorer:
+    """离线中文情感打分：情感词典 + 否定词 + 程度副词，批量用numpy汇总
+
+    输出与模型相同的 (负面/中性/正面, 0-1置信度)。没有命中情感词的长文本、
+    正负相互抵消的文本置信度较低，可交给模型复核。
+    """
+
+    def __init__(self, lexicon: Optional[Dict[str, float]] = None, negators: Optional[Dict[str, float]] = None,
+                 intensifiers: Optional[Dict[str, float]] = None, window: int = 4,
+                 neutral_margin: float = 0.25, short_length: int = 15):
+        self.lexicon = lexicon or LEXICON
+        self.modifiers = {word: (True, factor) for word, factor in (negators or NEGATORS).items()}
+        self.modifiers.update({word: (False, factor) for word, factor in (intensifiers or INTENSIFIERS).items()})
+        self.window = window
+        self.neutral_margin = neutral_margin
+        self.short_length = short_length
+        self._word_re = _alternation(self.lexicon)
+        self._modifier_re = _alternation(self.modifiers)
+
+    def score(self, contents: List[str]) -> List[Tuple[str, float]]:
+        labels, confidence = self.score_batch(contents)
+        return [(LABELS[label], round(float(score), 4)) for label, score in zip(labels, confidence)]
+
+    def score_batch(self, contents: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (label下标数组, 置信度数组)"""
+        count = len(contents)
+        indexes, values = [], []
+        for i, content in enumerate(contents):
+            for value in self._hits(content or ''):
+                indexes.append(i)
+                values.append(value)
+
+        indexes = np.asarray(indexes, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        positive = np.bincount(indexes, weights=np.clip(values, 0, None), minlength=count)
+        negative = np.bincount(indexes, weights=np.clip(-values, 0, None), minlength=count)
+        total = positive + negative
+        polarity = np.divide(positive - negative, total, out=np.zeros(count), where=total > 0)
+
+        labels = np.ones(count, dtype=np.int64)
+        labels[polarity > self.neutral_margin] = 2
+        labels[polarity < -self.neutral_margin] = 0
+
+        # 置信度随极性纯度与命中强度增长，强度按 1-e^-x 饱和
+        confidence = 0.5 + 0.5 * np.abs(polarity) * (1 - np.exp(-total))
+        neutral = labels == 1
+        lengths = np.fromiter((len((content or '').strip()) for content in contents), dtype=np.int64, count=count)
+        # 没有情感词的短句视为可信的中性，长文本或正负抵消则不确定
+        confidence[neutral] = 0.5
+        confidence[neutral & (total == 0) & (lengths <= self.short_length)] = 0.75
+        return labels, confidence
+
+    def _hits(self, content: str) -> List[float]:
+        values = []
+        segments = _CONTRAST_RE.split(content)
+        for index, segment in enumerate(segments):
+            weight = CONTRAST_DISCOUNT if index < len(segments) - 1 else 1.0
+            for clause in _CLAUSE_RE.split(segment):
+                values.extend(value * weight for value in self._clause_hits(clause))
+        return values
+
+    def _clause_hits(self, clause: str) -> List[float]:
+        values = []
+        previous_end = 0
+        for match in self._word_re.finditer(clause):
+            prefix = clause[max(previous_end, match.start() - self.window):match.start()]
+            previous_end = match.end()
+            value = self.lexicon[match.group()]
+            negations = 0
+            for modifier in self._modifier_re.finditer(prefix):
+                is_negator, factor = self.modifiers[modifier.group()]
+                value *= factor
+                negations += is_negator
+            if negations % 2:
+                value *= NEGATION_FLIP
+            values.append(value)
+        return values
+
@@ -0,0 +1,264 @@
+import datetime
+import hashlib
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+
+from cache_service import LRUCacheBackend
+from sentiment_lexicon import LABELS
+from storage import SENTIMENT_COLUMNS, StorageError
+
+RECOMMENDATIONS = {
+    '正面': '孩子近期情绪积极，可以继续通过鼓励和陪伴阅读保持这种状态，适当引入新的主题拓展兴趣。',
+    '中性': '孩子情绪整体平稳，可以多用开放式问题了解孩子的想法，选择温暖有趣的故事增进交流。',
+    '负面': '孩子近期流露出较多负面情绪，建议家长多倾听、多陪伴，选择关于勇气与安慰的故事，必要时寻求专业帮助。',
+}
+
+BATCH_PROMPT = """请逐条判断以下消息的情感倾向，严格只返回JSON数组，不要包含其他内容:
+[{{"i": 消息编号, "label": "负面/中性/正面", "score": 0.85}}]
+
+要求：
+1. 每条消息都必须返回一项，i与消息编号对应
+2. label只能使用"负面"、"中性"、"正面"三种值
+3. score是对该label的置信度，必须是0-1之间的小数
+
+消息:
+{messages}"""
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.strip().encode('utf-8')).hexdigest()
+
+
+def normalize_timestamp(timestamp) -> str:
+    """统一为ISO格式，缺失或无效时使用当前时间"""
+    if timestamp and isinstance(timestamp, str) and 'T' in timestamp:
+        try:
+            return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00')).isoformat()
+        except ValueError:
+            pass
+    return datetime.datetime.now().isoformat()
+
+
+def reduce_sentiments(items: List[Tuple[str, float]]) -> Dict:
+    """把多条 (label, score) 归约为一个整体结果
+
+    取置信度之和最大的label，score为该label置信度之和除以消息总数，
+    既反映情绪强度也反映该情绪所占的比例。
+    """
+    weights = {label: 0.0 for label in LABELS}
+    for label, score in items:
+        weights[label] += score
+    return _dominant(weights, len(items))
+
+
+def summarize_daily(rows: List[dict]) -> Dict:
+    """把sentiment_daily的若干行合并为与reduce_sentiments一致的结果，附带条数、平均分与label分布"""
+    count = sum(row['message_count'] for row in rows)
+    weights = {label: sum(float(row[f'{prefix}_score']) for row in rows)
+               for label, prefix in SENTIMENT_COLUMNS.items()}
+    result = _dominant(weights, count)
+    result['count'] = count
+    result['mean_score'] = round(sum(float(row['score_sum']) for row in rows) / count, 4) if count else 0.0
+    result['distribution'] = {label: sum(row[f'{prefix}_count'] for row in rows)
+                              for label, prefix in SENTIMENT_COLUMNS.items()}
+    return result
+
+
+def _dominant(weights: Dict[str, float], count: int) -> Dict:
+    label = max(LABELS, key=lambda name: weights[name])
+    return {'label': label, 'score': round(weights[label] / count, 4) if count else 0.0}
+
+
+class SentimentService:
+    """分批并发打分、按消息内容哈希缓存结果，再在本地归约为 overall/daily/samples
+
+    配置了lexicon时先用本地词典打分，只有置信度低于min_confidence的消息才请求模型；
+    未配置api_key时全部使用词典结果。
+    """
+
+    def __init__(self, storage, api_key: str, api_url: str, model: str = 'qwen-turbo',
+                 batch_size: int = 20, max_workers: int = 4, timeout: float = 30.0,
+                 max_content_length: int = 500, on_recorded=None, lexicon=None,
+                 min_confidence: float = 0.7):
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.api_key = api_key
+        self.api_url = api_url
+        self.model = model
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_content_length = max_content_length
+        self.lexicon = lexicon
+        self.min_confidence = min_confidence
+        # 后台打分写入后的回调，参数为涉及的用户ID集合
+        self.on_recorded = on_recorded
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sentiment')
+        self._local_cache = LRUCacheBackend(max_entries=10000)
+        self._cache_ttl = 24 * 3600
+        # 新消息的后台打分队列，由单个线程合并成批处理
+        self._pending = queue.Queue()
+        self._recorder = threading.Thread(target=self._recorder_loop, name='sentiment-recorder', daemon=True)
+        self._recorder.start()
+
+    def analyze(self, messages: List[dict]) -> Dict:
+        """返回与原接口一致的 {'overall', 'daily', 'samples'}"""
+        scored = self.score_messages([msg.get('content', '') for msg in messages])
+        timestamps = [normalize_timestamp(msg.get('timestamp')) for msg in messages]
+
+        by_day = {}
+        for (label, score), timestamp in zip(scored, timestamps):
+            by_day.setdefault(timestamp[:10], []).append((label, score))
+
+        overall = reduce_sentiments(scored)
+        overall['recommendation'] = RECOMMENDATIONS[overall['label']]
+        return {
+            'overall': overall,
+            'daily': [{'date': day, **reduce_sentiments(items)} for day, items in sorted(by_day.items())],
+            'samples': self._pick_samples(messages, scored, timestamps),
+        }
+
+    def score_messages(self, contents: List[str]) -> List[Tuple[str, float]]:
+        """为每条消息打分：已缓存的直接复用，其余先用词典打分，低置信度的去重后分批并发请求模型"""
+        hashes = [content_hash(content) for content in contents]
+        results = {}
+        for digest in set(hashes):
+            cached = self._local_cache.get(digest)
+            if cached is not None:
+                results[digest] = (cached['label'], cached['score'])
+
+        missing = [digest for digest in set(hashes) if digest not in results]
+        if missing:
+            for digest, value in self.storage.get_cached_sentiments(missing).items():
+                results[digest] = value
+                self._remember(digest, value)
+
+        pending = {}
+        for digest, content in zip(hashes, contents):
+            if digest not in results:
+                pending.setdefault(digest, content)
+        local = 0
+        if pending and self.lexicon is not None:
+            # 词典结果计算代价很低，不写入缓存，词典更新后即可生效
+            for (digest, _), value in zip(list(pending.items()), self.lexicon.score(list(pending.values()))):
+                if value[1] >= self.min_confidence or not self.api_key:
+                    results[digest] = value
+                    del pending[digest]
+                    local += 1
+        if pending:
+            items = list(pending.items())
+            batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            fresh = {}
+            for batch, scores in zip(batches, self._executor.map(self._score_batch, batches)):
+                for (digest, _), value in zip(batch, scores):
+                    fresh[digest] = value
+            self.storage.save_cached_sentiments(
+                [(digest, label, score) for digest, (label, score) in fresh.items()])
+            for digest, value in fresh.items():
+                self._remember(digest, value)
+            results.update(fresh)
+            self.logger.info(f"情感分析: {len(contents)} 条消息，词典 {local} 条，模型 {len(pending)} 条，"
+                             f"{len(batches)} 次模型调用")
+
+        return [results[digest] for digest in hashes]
+
+    def submit(self, message_id, content):
+        """消息保存后排队打分，结果写回消息行并累加到每日汇总，不阻塞请求"""
+        self._pending.put((message_id, content))
+
+    def record(self, messages: List[dict]) -> int:
+        """为 [{'id', 'content'}] 打分并写入存储，返回记录的条数"""
+        if not messages:
+            return 0
+        scored = self.score_messages([msg['content'] for msg in messages])
+        user_ids = self.storage.record_message_sentiments(
+            [(msg['id'], label, score) for msg, (label, score) in zip(messages, scored)])
+        if user_ids and self.on_recorded:
+            self.on_recorded(set(user_ids))
+        return len(user_ids)
+
+    def _recorder_loop(self):
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.record([{'id': message_id, 'content': content} for message_id, content in batch])
+            except (requests.RequestException, ValueError, StorageError) as e:
+                # 失败的消息保持未打分，可通过 flask backfill-sentiment 补齐
+                self.logger.error(f"后台情感打分失败({len(batch)} 条): {e}")
+            except Exception as e:
+                # 其他异常同样只放弃本批，不结束后台线程
+                self.logger.error(f"后台情感打分出错({len(batch)} 条): {e}", exc_info=True)
+
+    def _remember(self, digest, value):
+        self._local_cache.set(digest, {'label': value[0], 'score': value[1]}, self._cache_ttl)
+
+    def _score_batch(self, batch: List[Tuple[str, str]]) -> List[Tuple[str, float]]:
+        lines = [f"{i + 1}. {content[:self.max_content_length]}" for i, (_, content) in enumerate(batch)]
+        response = requests.post(
+            self.api_url,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": self.model,
+                "input": {"messages": [{"role": "user", "content": BATCH_PROMPT.format(messages='\n'.join(lines))}]}
+            },
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        result = response.json()
+        if 'output' not in result or 'text' not in result['output']:
+            raise ValueError('无效的API响应格式')
+        return self._parse_batch(result['output']['text'], len(batch))
+
+    @staticmethod
+    def _parse_batch(text: str, size: int) -> List[Tuple[str, float]]:
+        # 模型可能用```json包裹结果，只取数组部分
+        start, end = text.find('['), text.rfind(']')
+        if start < 0 or end < start:
+            raise ValueError(f'API返回格式不正确: {text[:200]}')
+        items = json.loads(text[start:end + 1])
+
+        scores = [None] * size
+        for position, item in enumerate(items):
+            number = item.get('i', position + 1) if isinstance(item, dict) else None
+            # 序号必须是整数，"1"之类的字符串按无效结果处理
+            index = number - 1 if isinstance(number, int) and not isinstance(number, bool) else -1
+            if not 0 <= index < size:
+                continue
+            label = item.get('label')
+            score = item.get('score', 0.5)
+            if label not in LABELS or not isinstance(score, (int, float)):
+                continue
+            scores[index] = (label, round(score / 100.0 if score > 1 else float(score), 4))
+        if any(score is None for score in scores):
+            raise ValueError(f'API返回的情感结果不完整: {text[:200]}')
+        return scores
+
+    @staticmethod
+    def _pick_samples(messages, scored, timestamps, limit=5) -> List[dict]:
+        """每种情绪先取置信度最高的一条，再按置信度补足"""
+        order = sorted(range(len(messages)), key=lambda i: scored[i][1], reverse=True)
+        picked = []
+        for label in LABELS:
+            for i in order:
+                if scored[i][0] == label:
+                    picked.append(i)
+                    break
+        picked += [i for i in order if i not in picked]
+        return [{
+            'content': messages[i].get('content', ''),
+            'sentiment': {'label': scored[i][0], 'score': scored[i][1]},
+            'timestamp': timestamps[i]
+        } for i in picked[:limit]]
@@ -0,0 +1,449 @@
+import datetime
+import functools
+import math
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from storage import SEARCH_SOURCES, Session, Storage, StorageError, story_search_text
+from text_search import query_terms, term_frequencies
+
+# DATETIME列与MySQL一样读写为datetime对象
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATETIME', lambda raw: datetime.datetime.fromisoformat(raw.decode()))
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_converter('DATE', lambda raw: datetime.date.fromisoformat(raw.decode()))
+
+# 与MySQL的CURRENT_TIMESTAMP保持一致，使用本地时间
+NOW = "(datetime('now', 'localtime'))"
+
+
+@functools.lru_cache(maxsize=512)
+def _to_qmark(sql: str) -> str:
+    """%s占位符转换为sqlite3的?，同一语句文本保持不变以复用预编译语句"""
+    return sql.replace('%s', '?')
+
+
+class SQLiteStorage(Storage):
+    """嵌入式SQLite存储：WAL模式，单个写线程串行提交，读线程各自持有连接并发读取"""
+
+    name = 'sqlite'
+    insert_ignore = 'INSERT OR IGNORE'
+    # 写线程一次最多合并提交的事务数
+    max_batch = 64
+    # BM25参数
+    bm25_k1 = 1.2
+    bm25_b = 0.75
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        super().__init__()
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._startup_error = None
+        self._metrics = {'writes': 0, 'batches': 0}
+
+        self._writer = threading.Thread(target=self._writer_loop, name='sqlite-writer', daemon=True)
+        self._writer.start()
+        self._ready.wait()
+        if self._startup_error:
+            raise StorageError(f"无法打开SQLite数据库 {path}: {self._startup_error}")
+
+    def _connect(self, readonly=False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,  # 手动管理事务
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    # ---- 写线程 ----
+    def _writer_loop(self):
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            self._startup_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            # 合并排队中的写入为一次提交，每个写入用SAVEPOINT隔离失败
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)
+                    break
+                batch.append(job)
+            self._run_batch(conn, batch)
+        conn.close()
+
+    def _run_batch(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT job")
+                cursor = conn.cursor()
+                try:
+                    result = fn(Session(cursor, _to_qmark))
+                    conn.execute("RELEASE SAVEPOINT job")
+                    outcomes.append((future, result, None))
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO SAVEPOINT job")
+                    conn.execute("RELEASE SAVEPOINT job")
+                    outcomes.append((future, None, e))
+                finally:
+                    cursor.close()
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for fn, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._metrics['writes'] += len(outcomes)
+        self._metrics['batches'] += 1
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _write(self, fn):
+        if threading.current_thread() is self._writer:
+            raise RuntimeError("不能在SQLite写线程内嵌套提交写入")
+        future = Future()
+        self._queue.put((fn, future))
+        try:
+            return future.result()
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    # ---- 读连接 ----
+    def _read(self, fn):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = self._local.conn = self._connect(readonly=True)
+            except sqlite3.Error as e:
+                raise StorageError(str(e)) from e
+        cursor = conn.cursor()
+        try:
+            # 显式事务让多条查询读到同一快照
+            conn.execute("BEGIN")
+            result = fn(Session(cursor, _to_qmark))
+            conn.execute("COMMIT")
+            return result
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            cursor.close()
+
+    def stats(self) -> dict:
+        return {'path': self.path, 'pending_writes': self._queue.qsize(), **self._metrics}
+
+    # ---- 全文检索：本地中文n-gram倒排索引，随写入在同一事务中增量维护 ----
+    def _upsert_increment(self, keys, columns) -> str:
+        updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in columns)
+        return f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+
+    def _index_document(self, db, user_id, source, doc_id, text):
+        frequencies = term_frequencies(text)
+        if not frequencies:
+            return
+        db.executemany(
+            "INSERT OR REPLACE INTO search_postings (user_id, term, source, doc_id, tf) VALUES (%s, %s, %s, %s, %s)",
+            [(user_id, term, source, doc_id, tf) for term, tf in frequencies.items()]
+        )
+        db.execute(
+            "INSERT OR REPLACE INTO search_docs (user_id, source, doc_id, length) VALUES (%s, %s, %s, %s)",
+            (user_id, source, doc_id, sum(frequencies.values()))
+        )
+
+    def _bulk_insert_stories(self, db, rows):
+        super()._bulk_insert_stories(db, rows)
+        # 单写线程的同一事务内自增ID连续，由最后一个ID推算每行ID并建立索引
+        last_id = db.execute("SELECT last_insert_rowid() AS id").scalar()
+        for story_id, (user_id, input_prompt, _, story) in zip(range(last_id - len(rows) + 1, last_id + 1), rows):
+            self._index_document(db, user_id, 'story', story_id, story_search_text(input_prompt, story))
+
+    def _unindex_document(self, db, user_id, source, doc_id, text):
+        # 按原文重新切分得到词项，按主键删除，无需额外的doc_id索引
+        db.executemany(
+            "DELETE FROM search_postings WHERE user_id = %s AND term = %s AND source = %s AND doc_id = %s",
+            [(user_id, term, source, doc_id) for term in term_frequencies(text)]
+        )
+        db.execute("DELETE FROM search_docs WHERE user_id = %s AND source = %s AND doc_id = %s",
+                   (user_id, source, doc_id))
+
+    def rebuild_search_index(self) -> int:
+        def work(db):
+            db.execute("DELETE FROM search_postings")
+            db.execute("DELETE FROM search_docs")
+            count = 0
+            stories = db.execute("SELECT id, user_id, input_prompt, story, archived FROM story_history").fetchall()
+            for row in self._hydrate_archived(db, 'story', stories):
+                self._index_document(db, row['user_id'], 'story', row['id'],
+                                     story_search_text(row['input_prompt'], row['story']))
+                count += 1
+            messages = db.execute("SELECT id, user_id, content, archived FROM chat_history").fetchall()
+            for row in self._hydrate_archived(db, 'chat', messages):
+                self._index_document(db, row['user_id'], 'chat', row['id'], row['content'])
+                count += 1
+            return count
+        return self._write(work)
+
+    def search_history(self, user_id, query, sources=SEARCH_SOURCES, limit=20, offset=0):
+        """BM25排序，命中查询词越多越靠前"""
+        terms = query_terms(query)
+        if not terms or not sources:
+            return {'total': 0, 'hits': []}
+        source_placeholders = ', '.join(['%s'] * len(sources))
+        term_placeholders = ', '.join(['%s'] * len(terms))
+
+        def work(db):
+            corpus = db.execute(
+                f"SELECT COUNT(*) AS n, AVG(length) AS avgdl FROM search_docs "
+                f"WHERE user_id = %s AND source IN ({source_placeholders})",
+                (user_id, *sources)
+            ).fetchone()
+            if not corpus['n']:
+                return {'total': 0, 'hits': []}
+            postings = db.execute(
+                f"""
+                SELECT p.term, p.source, p.doc_id, p.tf, d.length
+                FROM search_postings p
+                JOIN search_docs d ON d.user_id = p.user_id AND d.source = p.source AND d.doc_id = p.doc_id
+                WHERE p.user_id = %s AND p.term IN ({term_placeholders}) AND p.source IN ({source_placeholders})
+                """,
+                (user_id, *terms, *sources)
+            ).fetchall()
+
+            document_frequency = {}
+            for posting in postings:
+                document_frequency[posting['term']] = document_frequency.get(posting['term'], 0) + 1
+            n = corpus['n']
+            idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+            k1, b = self.bm25_k1, self.bm25_b
+            length_norm = b / (corpus['avgdl'] or 1.0)
+            scores, matched = {}, {}
+            for posting in postings:
+                tf = posting['tf']
+                key = (posting['source'], posting['doc_id'])
+                score = idf[posting['term']] * tf * (k1 + 1) / (tf + k1 * (1 - b + length_norm * posting['length']))
+                scores[key] = scores.get(key, 0.0) + score
+                matched[key] = matched.get(key, 0) + 1
+
+            ranked = sorted(scores, key=lambda key: (matched[key], scores[key], key[1]), reverse=True)
+            page = [(source, doc_id, scores[(source, doc_id)]) for source, doc_id in ranked[offset:offset + limit]]
+            return {'total': len(ranked), 'hits': self._load_search_hits(db, page, terms)}
+        return self._read(work)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(timeout=self.busy_timeout)
+
+    def init_schema(self):
+        def work(db):
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL
+                )
+            """)
+            db.execute(f"""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                    title TEXT NOT NULL,
+                    created_at DATETIME DEFAULT {NOW},
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    last_updated DATETIME,
+                    last_message TEXT
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_updated "
+                       "ON conversations (user_id, last_updated)")
+            db.execute(f"""
+                CREATE TABLE IF NOT EXISTS chat_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                    role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
+                    content TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT {NOW},
+                    conversation_id INTEGER REFERENCES conversations (id) ON DELETE CASCADE,
+                    sentiment_label TEXT,
+                    sentiment_score REAL,
+                    archived INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._ensure_column(db, 'chat_history', 'sentiment_label', 'TEXT')
+            self._ensure_column(db, 'chat_history', 'sentiment_score', 'REAL')
+            self._ensure_column(db, 'chat_history', 'archived', 'INTEGER NOT NULL DEFAULT 0')
+            db.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts ON chat_history (user_id, timestamp)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_conversation "
+                       "ON chat_history (conversation_id, timestamp)")
+            db.execute(f"""
+                CREATE TABLE IF NOT EXISTS story_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                    input_prompt TEXT,
+                    thinking TEXT,
+                    story TEXT,
+                    timestamp DATETIME DEFAULT {NOW},
+                    archived INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._ensure_column(db, 'story_history', 'archived', 'INTEGER NOT NULL DEFAULT 0')
+            db.execute("CREATE INDEX IF NOT EXISTS idx_story_history_user_ts ON story_history (user_id, timestamp)")
+
+            # 全文检索倒排索引
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS search_postings (
+                    user_id INTEGER NOT NULL,
+                    term TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, term, source, doc_id)
+                ) WITHOUT ROWID
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS search_docs (
+                    user_id INTEGER NOT NULL,
+                    source TEXT NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, source, doc_id)
+                ) WITHOUT ROWID
+            """)
+
+            # 情感分析结果缓存，按消息内容哈希去重
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS sentiment_cache (
+                    content_hash TEXT PRIMARY KEY,
+                    label TEXT NOT NULL,
+                    score REAL NOT NULL,
+                    created_at DATETIME DEFAULT (datetime('now','localtime'))
+                ) WITHOUT ROWID
+            """)
+            # 每用户每日情感汇总，随消息打分与删除增量维护
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS sentiment_daily (
+                    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                    day DATE NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    score_sum REAL NOT NULL DEFAULT 0,
+                    negative_count INTEGER NOT NULL DEFAULT 0,
+                    negative_score REAL NOT NULL DEFAULT 0,
+                    neutral_count INTEGER NOT NULL DEFAULT 0,
+                    neutral_score REAL NOT NULL DEFAULT 0,
+                    positive_count INTEGER NOT NULL DEFAULT 0,
+                    positive_score REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, day)
+                ) WITHOUT ROWID
+            """)
+            # 冷归档：较早记录的正文压缩后移到这里，原表只保留元数据与供检索的正文前缀（archived=1）
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS history_archive (
+                    source TEXT NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    dict_id INTEGER,
+                    payload BLOB NOT NULL,
+                    raw_size INTEGER NOT NULL,
+                    PRIMARY KEY (source, doc_id)
+                ) WITHOUT ROWID
+            """)
+            db.execute(f"""
+                CREATE TABLE IF NOT EXISTS archive_dicts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source TEXT NOT NULL,
+                    codec TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at DATETIME DEFAULT {NOW}
+                )
+            """)
+            # 多轮对话的滚动摘要，summarized_until为已并入摘要的最后一条消息ID
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_contexts (
+                    conversation_id INTEGER PRIMARY KEY REFERENCES conversations (id) ON DELETE CASCADE,
+                    summary TEXT NOT NULL,
+                    summarized_until INTEGER NOT NULL,
+                    updated_at DATETIME
+                )
+            """)
+            # 批量故事任务与条目，条目状态持久化以便进程重启后继续
+            db.execute(f"""
+                CREATE TABLE IF NOT EXISTS story_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                    status TEXT NOT NULL DEFAULT 'pending'
+                        CHECK (status IN ('pending', 'running', 'completed', 'cancelled')),
+                    total INTEGER NOT NULL,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    created_at DATETIME DEFAULT {NOW},
+                    updated_at DATETIME
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_story_jobs_user ON story_jobs (user_id, id)")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS story_job_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL REFERENCES story_jobs (id) ON DELETE CASCADE,
+                    position INTEGER NOT NULL,
+                    prompt TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending'
+                        CHECK (status IN ('pending', 'running', 'done', 'failed', 'cancelled')),
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at DATETIME
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_story_job_items_status ON story_job_items (status, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_story_job_items_job ON story_job_items (job_id, position)")
+
+            # 旧库首次启用检索时需要回填索引
+            indexed = db.execute("SELECT COUNT(*) AS n FROM search_docs").scalar()
+            existing = db.execute("SELECT (SELECT COUNT(*) FROM story_history) + "
+                                  "(SELECT COUNT(*) FROM chat_history) AS n").scalar()
+            return not indexed and existing
+
+        if self._write(work):
+            indexed = self.rebuild_search_index()
+            self.logger.info(f"已为 {indexed} 条历史记录建立检索索引")
+
+    @staticmethod
+    def _ensure_column(db, table, column, definition):
+        """字段不存在时追加，返回是否新增"""
+        columns = {row['name'] for row in db.execute(f"PRAGMA table_info({table})").fetchall()}
+        if column in columns:
+            return False
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
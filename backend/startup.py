@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class LazyComponent:
+    """首次使用时才调用factory创建组件（线程安全），属性访问透明转发到组件本身
+
+    重依赖（LangChain、numpy等）放在factory内部导入，导入app模块时不再加载。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], object]):
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __repr__(self):
+        state = 'initialized' if self.initialized else 'pending'
+        return f"<LazyComponent {self._name} ({state})>"
+
+
+class _Hook:
+    def __init__(self, name: str, fn: Callable[[], Optional[dict]], background: bool):
+        self.name = name
+        self.fn = fn
+        self.background = background
+        self.state = 'pending'
+        self.seconds = None
+        self.result = None
+        self.error = None
+
+    def run(self, logger):
+        self.state = 'running'
+        start = time.perf_counter()
+        try:
+            self.result = self.fn()
+            self.state = 'ready'
+            self.error = None
+        except Exception as e:
+            self.state = 'error'
+            self.error = str(e)
+            logger.error(f"启动钩子 {self.name} 执行失败: {e}", exc_info=True)
+        finally:
+            self.seconds = round(time.perf_counter() - start, 3)
+            logger.info(f"启动钩子 {self.name}: {self.state}，耗时 {self.seconds}s")
+
+    def describe(self) -> dict:
+        info = {'state': self.state, 'background': self.background, 'seconds': self.seconds}
+        if self.result:
+            info['result'] = self.result
+        if self.error:
+            info['error'] = self.error
+        return info
+
+
+class Startup:
+    """显式的启动钩子：建表、构建索引等不在导入时执行
+
+    同步钩子在ensure_started()中依次执行，全部成功后服务才算就绪；
+    后台钩子（如RAG索引）在独立线程中执行，完成前相关功能降级。
+    同步钩子失败时，retry_interval秒后的下一次ensure_started()会重试。
+    """
+
+    def __init__(self, retry_interval: float = 5.0):
+        self.logger = logging.getLogger(__name__)
+        self.retry_interval = retry_interval
+        self.started_at = time.time()
+        self._hooks: Dict[str, _Hook] = {}
+        self._lock = threading.Lock()
+        self._ready = False
+        self._background_started = False
+        self._last_attempt = 0.0
+
+    def hook(self, name: str, background: bool = False):
+        """装饰器：注册启动钩子，返回值（dict）会出现在健康检查中"""
+        def register(fn):
+            self._hooks[name] = _Hook(name, fn, background)
+            return fn
+        return register
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def done(self, name: str) -> bool:
+        hook = self._hooks.get(name)
+        return hook is not None and hook.state == 'ready'
+
+    def ensure_started(self, background: bool = True) -> bool:
+        """执行尚未成功的同步钩子，并启动后台钩子；返回同步钩子是否全部就绪"""
+        if self._ready and (self._background_started or not background):
+            return True
+        with self._lock:
+            if not self._ready and time.time() - self._last_attempt >= self.retry_interval:
+                self._last_attempt = time.time()
+                for hook in self._hooks.values():
+                    if not hook.background and hook.state != 'ready':
+                        hook.run(self.logger)
+                self._ready = all(h.state == 'ready' for h in self._hooks.values() if not h.background)
+            if self._ready and background and not self._background_started:
+                self._background_started = True
+                for hook in self._hooks.values():
+                    if hook.background:
+                        threading.Thread(target=hook.run, args=(self.logger,),
+                                         name=f'startup-{hook.name}', daemon=True).start()
+        return self._ready
+
+    def status(self, name: Optional[str] = None) -> dict:
+        if name is not None:
+            return self._hooks[name].describe()
+        return {name: hook.describe() for name, hook in self._hooks.items()}
@@ -0,0 +1,702 @@
+import datetime
+import functools
+import json
+import logging
+from typing import Callable, List, Optional
+
+import archive_codec
+from metrics import span
+from text_search import make_snippet
+
+# 对话摘要中last_message的预览长度
+PREVIEW_LENGTH = 100
+# 归档后原表保留的正文字数，全文检索只覆盖这部分
+ARCHIVE_SEARCH_CHARS = 500
+# 检索的数据来源
+SEARCH_SOURCES = ('story', 'chat')
+# 情感label与每日汇总表中字段前缀的对应关系
+SENTIMENT_COLUMNS = {'负面': 'negative', '中性': 'neutral', '正面': 'positive'}
+# sentiment_daily的字段：主键、总数与分数和，以及每种label的条数与分数和
+SENTIMENT_DAILY_COLUMNS = ('user_id', 'day', 'message_count', 'score_sum') + tuple(
+    f"{prefix}_{kind}" for prefix in SENTIMENT_COLUMNS.values() for kind in ('count', 'score'))
+
+
+class StorageError(Exception):
+    """存储层错误，屏蔽具体数据库驱动的异常类型"""
+
+
+@functools.lru_cache(maxsize=512)
+def _statement_stage(sql: str) -> str:
+    """按语句类型汇总SQL耗时，如 sql_select / sql_insert"""
+    verb = sql.split(None, 1)[0].lower() if sql.strip() else 'empty'
+    return f"sql_{verb}"
+
+
+class Session:
+    """单个游标的轻量封装：统一占位符与字典行格式
+
+    业务SQL统一使用 %s 占位符，由translate转换为具体驱动的写法。
+    """
+
+    def __init__(self, cursor, translate: Optional[Callable[[str], str]] = None):
+        self._cursor = cursor
+        self._translate = translate or (lambda sql: sql)
+
+    def execute(self, sql: str, params=()):
+        with span(_statement_stage(sql)):
+            self._cursor.execute(self._translate(sql), params)
+        return self
+
+    def executemany(self, sql: str, seq_of_params):
+        with span(_statement_stage(sql)):
+            self._cursor.executemany(self._translate(sql), seq_of_params)
+        return self
+
+    def fetchone(self) -> Optional[dict]:
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self) -> List[dict]:
+        return [dict(row) for row in self._cursor.fetchall()]
+
+    def scalar(self):
+        row = self.fetchone()
+        return next(iter(row.values())) if row else None
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+
+class Storage:
+    """持久化接口：业务SQL写在基类中，连接管理、事务与DDL由子类按数据库实现"""
+
+    name = 'base'
+    # 行锁语法，SQLite由单写线程串行化写入，不需要
+    for_update = ''
+    # 主键冲突时跳过的插入语法
+    insert_ignore = 'INSERT IGNORE'
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        # 归档字典只增不改，按ID缓存在进程内
+        self._archive_dicts = {}
+
+    # ---- 子类实现 ----
+    def init_schema(self):
+        """建表及旧库升级"""
+        raise NotImplementedError
+
+    def _read(self, fn: Callable[[Session], object]):
+        """在只读连接上执行fn(session)"""
+        raise NotImplementedError
+
+    def _write(self, fn: Callable[[Session], object]):
+        """在单个事务中执行fn(session)，成功后提交"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+    def search_history(self, user_id, query: str, sources=SEARCH_SOURCES,
+                       limit: int = 20, offset: int = 0) -> dict:
+        """检索用户的故事与聊天记录，返回 {'total': 命中总数, 'hits': 当前页结果}"""
+        raise NotImplementedError
+
+    def rebuild_search_index(self) -> int:
+        """重建全文索引，由数据库自动维护索引的后端无需处理"""
+        return 0
+
+    def _upsert_increment(self, keys, columns) -> str:
+        """主键冲突时把columns累加到已有行的子句"""
+        raise NotImplementedError
+
+    def _index_document(self, db, user_id, source, doc_id, text):
+        """记录写入后在同一事务中更新全文索引，默认由数据库自身维护"""
+
+    def _bulk_insert_stories(self, db, rows):
+        """一条语句批量写入故事 [(user_id, input_prompt, thinking, story)]"""
+        db.executemany(
+            "INSERT INTO story_history (user_id, input_prompt, thinking, story) VALUES (%s, %s, %s, %s)", rows)
+
+    def _unindex_document(self, db, user_id, source, doc_id, text):
+        """记录删除后在同一事务中移除全文索引"""
+
+    # ---- 健康检查 ----
+    def ping(self):
+        return self._read(lambda db: db.execute("SELECT 1 AS ok").scalar())
+
+    # ---- 用户 ----
+    def get_user_by_username(self, username) -> Optional[dict]:
+        return self._read(lambda db: db.execute(
+            "SELECT id, password FROM users WHERE username=%s", (username,)).fetchone())
+
+    def create_user(self, username, password_hash) -> Optional[int]:
+        """创建用户，用户名已存在时返回None"""
+        def work(db):
+            if db.execute("SELECT id FROM users WHERE username=%s", (username,)).fetchone():
+                return None
+            db.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, password_hash))
+            return db.lastrowid
+        return self._write(work)
+
+    def update_password(self, user_id, password_hash):
+        self._write(lambda db: db.execute(
+            "UPDATE users SET password=%s WHERE id=%s", (password_hash, user_id)))
+
+    # ---- 聊天记录 ----
+    def save_chat_message(self, user_id, role, content, conversation_id=None,
+                          verify_owner=False) -> Optional[int]:
+        """保存一条消息并在同一事务中更新对话摘要
+
+        verify_owner为True时校验对话属于该用户，不属于时返回None。
+        """
+        def work(db):
+            if conversation_id:
+                if verify_owner and not db.execute(
+                        "SELECT id FROM conversations WHERE id=%s AND user_id=%s",
+                        (conversation_id, user_id)).fetchone():
+                    return None
+                db.execute(
+                    "INSERT INTO chat_history (user_id, role, content, conversation_id) VALUES (%s, %s, %s, %s)",
+                    (user_id, role, content, conversation_id)
+                )
+                message_id = db.lastrowid
+                self._touch_conversation_summary(db, conversation_id, message_id, content)
+            else:
+                db.execute(
+                    "INSERT INTO chat_history (user_id, role, content) VALUES (%s, %s, %s)",
+                    (user_id, role, content)
+                )
+                message_id = db.lastrowid
+            self._index_document(db, user_id, 'chat', message_id, content)
+            return message_id
+        return self._write(work)
+
+    def list_chat_history(self, user_id) -> List[dict]:
+        return self._read(lambda db: self._hydrate_archived(db, 'chat', db.execute(
+            "SELECT * FROM chat_history WHERE user_id=%s ORDER BY timestamp DESC", (user_id,)).fetchall()))
+
+    def delete_chat_message(self, user_id, message_id):
+        """删除消息，返回 (是否删除, 所属对话ID)"""
+        def work(db):
+            row = db.execute(
+                "SELECT id, conversation_id, content, timestamp, sentiment_label, sentiment_score, archived "
+                "FROM chat_history WHERE id=%s AND user_id=%s" + self.for_update,
+                (message_id, user_id)
+            ).fetchone()
+            if not row:
+                return False, None
+            if row['archived']:
+                # 先取回正文用于移除索引，再删除归档
+                self._hydrate_archived(db, 'chat', [row])
+                db.execute("DELETE FROM history_archive WHERE source='chat' AND doc_id=%s", (message_id,))
+            db.execute("DELETE FROM chat_history WHERE id=%s AND user_id=%s", (message_id, user_id))
+            self._unindex_document(db, user_id, 'chat', message_id, row['content'])
+            if row['sentiment_label']:
+                self._bump_sentiment_daily(db, user_id, row['timestamp'].date(),
+                                           row['sentiment_label'], float(row['sentiment_score']), -1)
+            if row['conversation_id']:
+                self._retract_conversation_summary(db, row['conversation_id'])
+                # 已并入滚动摘要的消息被删除时丢弃摘要，下次从剩余消息重新生成
+                db.execute("DELETE FROM conversation_contexts WHERE conversation_id=%s AND summarized_until >= %s",
+                           (row['conversation_id'], message_id))
+            return True, row['conversation_id']
+        return self._write(work)
+
+    # ---- 故事记录 ----
+    def save_story_history(self, user_id, input_prompt, thinking, story) -> int:
+        def work(db):
+            db.execute(
+                "INSERT INTO story_history (user_id, input_prompt, thinking, story) VALUES (%s, %s, %s, %s)",
+                (user_id, input_prompt, thinking, story)
+            )
+            story_id = db.lastrowid
+            self._index_document(db, user_id, 'story', story_id, story_search_text(input_prompt, story))
+            return story_id
+        return self._write(work)
+
+    def list_story_history(self, user_id) -> List[dict]:
+        return self._read(lambda db: self._hydrate_archived(db, 'story', db.execute(
+            "SELECT * FROM story_history WHERE user_id=%s ORDER BY timestamp DESC", (user_id,)).fetchall()))
+
+    def get_story(self, story_id) -> Optional[dict]:
+        rows = self._read(lambda db: self._hydrate_archived(db, 'story', db.execute(
+            "SELECT id, user_id, input_prompt, thinking, story, timestamp, archived FROM story_history WHERE id=%s",
+            (story_id,)).fetchall()))
+        return rows[0] if rows else None
+
+    def list_recent_stories(self, limit, after_id=0) -> List[dict]:
+        """after_id之后最新的limit条未归档故事，按ID升序返回，用于增量构建语义缓存
+
+        已归档的故事原表只有正文前缀，且通常已超出缓存的复用期限，不参与索引。
+        """
+        rows = self._read(lambda db: db.execute(
+            "SELECT id, user_id, input_prompt, story, timestamp FROM story_history WHERE id > %s AND archived = 0 "
+            "ORDER BY id DESC LIMIT %s", (after_id, limit)).fetchall())
+        return rows[::-1]
+
+    # ---- 批量故事任务 ----
+    def create_story_job(self, user_id, prompts) -> int:
+        """创建任务并批量写入条目，返回任务ID"""
+        def work(db):
+            db.execute("INSERT INTO story_jobs (user_id, total, updated_at) VALUES (%s, %s, %s)",
+                       (user_id, len(prompts), datetime.datetime.now()))
+            job_id = db.lastrowid
+            db.executemany("INSERT INTO story_job_items (job_id, position, prompt) VALUES (%s, %s, %s)",
+                           [(job_id, position, prompt) for position, prompt in enumerate(prompts)])
+            return job_id
+        return self._write(work)
+
+    def claim_story_job_items(self, limit) -> List[dict]:
+        """领取最早的待处理条目并标记为running，返回 id/job_id/user_id/prompt/attempts"""
+        def work(db):
+            items = db.execute(
+                "SELECT i.id, i.job_id, j.user_id, i.prompt, i.attempts FROM story_job_items i "
+                "JOIN story_jobs j ON j.id = i.job_id "
+                "WHERE i.status = 'pending' AND j.status IN ('pending', 'running') "
+                "ORDER BY i.id LIMIT %s" + self.for_update, (limit,)
+            ).fetchall()
+            if not items:
+                return []
+            now = datetime.datetime.now()
+            item_ids = [item['id'] for item in items]
+            job_ids = sorted({item['job_id'] for item in items})
+            db.execute(
+                f"UPDATE story_job_items SET status = 'running', attempts = attempts + 1, updated_at = %s "
+                f"WHERE id IN ({', '.join(['%s'] * len(item_ids))})", (now, *item_ids))
+            db.execute(
+                f"UPDATE story_jobs SET status = 'running', updated_at = %s "
+                f"WHERE status = 'pending' AND id IN ({', '.join(['%s'] * len(job_ids))})", (now, *job_ids))
+            for item in items:
+                item['attempts'] += 1
+            return items
+        return self._write(work)
+
+    def finish_story_job_items(self, done, failed) -> List[int]:
+        """在一个事务中写回一批结果，返回写入了故事的用户ID
+
+        done为 [(条目, 思考过程, 故事)]，故事批量插入story_history；
+        failed为 [(条目, 错误信息, 是否重试)]，重试的条目回到pending，否则记为失败。
+        """
+        def work(db):
+            now = datetime.datetime.now()
+            counts = {}
+            if done:
+                self._bulk_insert_stories(db, [(item['user_id'], item['prompt'], thinking, story)
+                                               for item, thinking, story in done])
+                db.executemany("UPDATE story_job_items SET status = 'done', error = NULL, updated_at = %s "
+                               "WHERE id = %s", [(now, item['id']) for item, _, _ in done])
+                for item, _, _ in done:
+                    counts.setdefault(item['job_id'], [0, 0])[0] += 1
+            if failed:
+                db.executemany("UPDATE story_job_items SET status = %s, error = %s, updated_at = %s WHERE id = %s",
+                               [('pending' if retry else 'failed', error, now, item['id'])
+                                for item, error, retry in failed])
+                for item, _, retry in failed:
+                    if not retry:
+                        counts.setdefault(item['job_id'], [0, 0])[1] += 1
+            if counts:
+                db.executemany(
+                    "UPDATE story_jobs SET completed = completed + %s, failed = failed + %s, updated_at = %s "
+                    "WHERE id = %s", [(completed, failures, now, job_id)
+                                      for job_id, (completed, failures) in counts.items()])
+                db.execute(
+                    f"UPDATE story_jobs SET status = 'completed' WHERE status = 'running' "
+                    f"AND completed + failed >= total AND id IN ({', '.join(['%s'] * len(counts))})",
+                    list(counts))
+            return sorted({item['user_id'] for item, _, _ in done})
+        return self._write(work)
+
+    def reset_running_story_job_items(self) -> int:
+        """进程重启后把上次未完成的条目放回待处理，返回条目数"""
+        return self._write(lambda db: db.execute(
+            "UPDATE story_job_items SET status = 'pending' WHERE status = 'running'").rowcount)
+
+    def cancel_story_job(self, user_id, job_id) -> bool:
+        """取消任务，尚未领取的条目不再生成"""
+        def work(db):
+            cancelled = db.execute(
+                "UPDATE story_jobs SET status = 'cancelled', updated_at = %s "
+                "WHERE id = %s AND user_id = %s AND status IN ('pending', 'running')",
+                (datetime.datetime.now(), job_id, user_id)).rowcount
+            if cancelled:
+                db.execute("UPDATE story_job_items SET status = 'cancelled' WHERE job_id = %s AND status = 'pending'",
+                           (job_id,))
+            return bool(cancelled)
+        return self._write(work)
+
+    def get_story_job(self, user_id, job_id, error_limit=50) -> Optional[dict]:
+        """任务进度，附带失败条目的错误信息"""
+        def work(db):
+            job = db.execute(
+                "SELECT id, status, total, completed, failed, created_at, updated_at FROM story_jobs "
+                "WHERE id = %s AND user_id = %s", (job_id, user_id)).fetchone()
+            if job:
+                job['errors'] = db.execute(
+                    "SELECT position, prompt, error FROM story_job_items WHERE job_id = %s AND status = 'failed' "
+                    "ORDER BY position LIMIT %s", (job_id, error_limit)).fetchall()
+            return job
+        return self._read(work)
+
+    def list_story_jobs(self, user_id, limit=20) -> List[dict]:
+        return self._read(lambda db: db.execute(
+            "SELECT id, status, total, completed, failed, created_at, updated_at FROM story_jobs "
+            "WHERE user_id = %s ORDER BY id DESC LIMIT %s", (user_id, limit)).fetchall())
+
+    # ---- 对话 ----
+    def create_conversation(self, user_id, title) -> int:
+        def work(db):
+            db.execute("INSERT INTO conversations (user_id, title) VALUES (%s, %s)", (user_id, title))
+            return db.lastrowid
+        return self._write(work)
+
+    def list_conversations(self, user_id) -> List[dict]:
+        return self._read(lambda db: db.execute(
+            """
+            SELECT id,
+                   title,
+                   created_at,
+                   message_count,
+                   last_updated,
+                   last_message
+            FROM conversations
+            WHERE user_id = %s
+            ORDER BY last_updated DESC
+            """, (user_id,)).fetchall())
+
+    def refresh_conversation_summaries(self, user_id=None) -> int:
+        """按chat_history重新计算对话摘要，用于回填与修复，返回处理的对话数
+
+        已归档的消息在原表保留了不短于PREVIEW_LENGTH的前缀，预览与归档前一致。
+        """
+        sql = f"""
+            UPDATE conversations
+            SET message_count = (SELECT COUNT(*) FROM chat_history m
+                                 WHERE m.conversation_id = conversations.id),
+                last_updated  = (SELECT MAX(m.timestamp) FROM chat_history m
+                                 WHERE m.conversation_id = conversations.id),
+                last_message  = (SELECT SUBSTR(m.content, 1, {PREVIEW_LENGTH}) FROM chat_history m
+                                 WHERE m.conversation_id = conversations.id
+                                 ORDER BY m.timestamp DESC, m.id DESC LIMIT 1)
+        """
+        params = ()
+        if user_id is not None:
+            sql += " WHERE user_id = %s"
+            params = (user_id,)
+        return self._write(lambda db: db.execute(sql, params).rowcount)
+
+    # ---- 对话上下文 ----
+    def get_conversation_context(self, conversation_id) -> dict:
+        """对话的滚动摘要，以及摘要已折叠到的消息ID；尚无摘要时为空"""
+        row = self._read(lambda db: db.execute(
+            "SELECT summary, summarized_until FROM conversation_contexts WHERE conversation_id=%s",
+            (conversation_id,)).fetchone())
+        return row or {'summary': '', 'summarized_until': 0}
+
+    def list_conversation_messages(self, conversation_id, after_id=0, before_id=None, limit=20,
+                                   latest=False) -> List[dict]:
+        """(after_id, before_id) 之间的消息，按ID升序；latest为True时取其中最新的limit条"""
+        sql = "SELECT id, role, content, archived FROM chat_history WHERE conversation_id=%s AND id > %s"
+        params = [conversation_id, after_id]
+        if before_id is not None:
+            sql += " AND id < %s"
+            params.append(before_id)
+        sql += f" ORDER BY id {'DESC' if latest else 'ASC'} LIMIT %s"
+        rows = self._read(lambda db: self._hydrate_archived(db, 'chat', db.execute(sql, (*params, limit)).fetchall()))
+        return rows[::-1] if latest else rows
+
+    def save_conversation_context(self, conversation_id, summary, summarized_until, previous_until=0) -> bool:
+        """摘要仍停留在previous_until时才写入，避免并发更新互相覆盖，返回是否写入"""
+        def work(db):
+            now = datetime.datetime.now()
+            if db.execute(
+                    "UPDATE conversation_contexts SET summary=%s, summarized_until=%s, updated_at=%s "
+                    "WHERE conversation_id=%s AND summarized_until=%s",
+                    (summary, summarized_until, now, conversation_id, previous_until)).rowcount:
+                return True
+            if previous_until or db.execute(
+                    "SELECT conversation_id FROM conversation_contexts WHERE conversation_id=%s",
+                    (conversation_id,)).fetchone():
+                return False
+            db.execute(
+                "INSERT INTO conversation_contexts (conversation_id, summary, summarized_until, updated_at) "
+                "VALUES (%s, %s, %s, %s)", (conversation_id, summary, summarized_until, now))
+            return True
+        return self._write(work)
+
+    # ---- 冷归档 ----
+    def list_archive_candidates(self, source, before, after_id=0, limit=200) -> List[dict]:
+        """before之前、尚未归档的记录，按ID升序；聊天消息需已完成情感打分"""
+        if source == 'story':
+            sql = ("SELECT id, thinking, story FROM story_history "
+                   "WHERE id > %s AND archived = 0 AND timestamp < %s ORDER BY id LIMIT %s")
+        else:
+            sql = ("SELECT id, content FROM chat_history WHERE id > %s AND archived = 0 AND timestamp < %s "
+                   "AND sentiment_label IS NOT NULL ORDER BY id LIMIT %s")
+        return self._read(lambda db: db.execute(sql, (after_id, before, limit)).fetchall())
+
+    def archive_rows(self, source, rows, search_chars: int = ARCHIVE_SEARCH_CHARS) -> List[int]:
+        """rows为 [(记录ID, 字典ID, 压缩正文, 原始字节数)]，在一个短事务中写入归档并截短原表正文
+
+        原表保留正文前search_chars个字（不少于对话预览长度）供全文索引与对话预览使用，
+        完整内容在读取时从归档解压。读取与压缩在事务之外完成；期间被删除或已归档的记录跳过，
+        返回实际归档的记录ID。
+        """
+        keep = max(search_chars, PREVIEW_LENGTH)
+        clear = ("UPDATE story_history SET thinking = NULL, story = SUBSTR(story, 1, %s), archived = 1 "
+                 "WHERE id = %s AND archived = 0") if source == 'story' else \
+                ("UPDATE chat_history SET content = SUBSTR(content, 1, %s), archived = 1 "
+                 "WHERE id = %s AND archived = 0")
+
+        def work(db):
+            archived = []
+            for doc_id, dict_id, payload, raw_size in rows:
+                if db.execute(clear, (keep, doc_id)).rowcount:
+                    db.execute("INSERT INTO history_archive (source, doc_id, dict_id, payload, raw_size) "
+                               "VALUES (%s, %s, %s, %s, %s)", (source, doc_id, dict_id, payload, raw_size))
+                    archived.append(doc_id)
+            return archived
+        return self._write(work)
+
+    def get_archive_dictionary(self, source) -> Optional[dict]:
+        """该类记录最新的压缩字典 {'id', 'codec', 'data'}"""
+        row = self._read(lambda db: db.execute(
+            "SELECT id, codec, data FROM archive_dicts WHERE source=%s ORDER BY id DESC LIMIT 1",
+            (source,)).fetchone())
+        if row:
+            row['data'] = bytes(row['data'])
+        return row
+
+    def save_archive_dictionary(self, source, codec, data) -> int:
+        def work(db):
+            db.execute("INSERT INTO archive_dicts (source, codec, data) VALUES (%s, %s, %s)", (source, codec, data))
+            return db.lastrowid
+        return self._write(work)
+
+    def archive_stats(self) -> dict:
+        """各类记录的归档条数、原始字节数与压缩后字节数"""
+        rows = self._read(lambda db: db.execute(
+            "SELECT source, COUNT(*) AS n, SUM(raw_size) AS raw_size, SUM(LENGTH(payload)) AS stored_size "
+            "FROM history_archive GROUP BY source").fetchall())
+        return {row['source']: {'rows': row['n'], 'raw_bytes': int(row['raw_size'] or 0),
+                                'stored_bytes': int(row['stored_size'] or 0)} for row in rows}
+
+    def _hydrate_archived(self, db, source, rows) -> List[dict]:
+        """已归档行的正文从history_archive解压回填，只解压本次返回的行；archived标记不出现在结果中"""
+        ids = [row['id'] for row in rows if row.pop('archived', 0)]
+        fields = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            for archived in db.execute(
+                    f"SELECT doc_id, dict_id, payload FROM history_archive "
+                    f"WHERE source = %s AND doc_id IN ({placeholders})", (source, *chunk)).fetchall():
+                dictionary = self._archive_dictionary(db, archived['dict_id'])
+                with span('archive_decompress'):
+                    fields[archived['doc_id']] = unpack_archive_fields(
+                        source, archive_codec.decompress(archived['payload'], dictionary))
+        for row in rows:
+            row.update(fields.get(row['id'], {}))
+        return rows
+
+    def _archive_dictionary(self, db, dict_id) -> Optional[bytes]:
+        if not dict_id:
+            return None
+        if dict_id not in self._archive_dicts:
+            self._archive_dicts[dict_id] = bytes(db.execute(
+                "SELECT data FROM archive_dicts WHERE id=%s", (dict_id,)).scalar())
+        return self._archive_dicts[dict_id]
+
+    # ---- 情感分析缓存 ----
+    def get_cached_sentiments(self, content_hashes) -> dict:
+        """按消息内容哈希取回已缓存的情感结果，返回 {hash: (label, score)}"""
+        content_hashes = list(content_hashes)
+        if not content_hashes:
+            return {}
+        placeholders = ', '.join(['%s'] * len(content_hashes))
+        rows = self._read(lambda db: db.execute(
+            f"SELECT content_hash, label, score FROM sentiment_cache WHERE content_hash IN ({placeholders})",
+            content_hashes).fetchall())
+        return {row['content_hash']: (row['label'], float(row['score'])) for row in rows}
+
+    def save_cached_sentiments(self, rows):
+        """批量写入 (hash, label, score)，同一内容的结果不变，已存在时跳过"""
+        rows = list(rows)
+        if rows:
+            self._write(lambda db: db.executemany(
+                f"{self.insert_ignore} INTO sentiment_cache (content_hash, label, score) VALUES (%s, %s, %s)",
+                rows))
+
+    # ---- 情感趋势 ----
+    def record_message_sentiments(self, results) -> List[int]:
+        """写入消息的情感结果 [(message_id, label, score)] 并累加到每日汇总
+
+        已有结果或已删除的消息跳过，返回实际记录的消息所属的用户ID列表。
+        """
+        def work(db):
+            recorded = []
+            for message_id, label, score in results:
+                row = db.execute(
+                    "SELECT user_id, timestamp, sentiment_label FROM chat_history WHERE id=%s" + self.for_update,
+                    (message_id,)
+                ).fetchone()
+                if not row or row['sentiment_label']:
+                    continue
+                db.execute("UPDATE chat_history SET sentiment_label=%s, sentiment_score=%s WHERE id=%s",
+                           (label, score, message_id))
+                self._bump_sentiment_daily(db, row['user_id'], row['timestamp'].date(), label, score, 1)
+                recorded.append(row['user_id'])
+            return recorded
+        return self._write(work)
+
+    def list_unscored_messages(self, limit=500) -> List[dict]:
+        """尚未打分的消息，用于回填"""
+        return self._read(lambda db: db.execute(
+            "SELECT id, content FROM chat_history WHERE sentiment_label IS NULL ORDER BY id LIMIT %s",
+            (limit,)).fetchall())
+
+    def list_sentiment_daily(self, user_id, start, end) -> List[dict]:
+        """[start, end] 日期范围内的每日情感汇总"""
+        return self._read(lambda db: db.execute(
+            "SELECT * FROM sentiment_daily WHERE user_id=%s AND day BETWEEN %s AND %s AND message_count > 0 "
+            "ORDER BY day", (user_id, start, end)).fetchall())
+
+    def rebuild_sentiment_daily(self) -> int:
+        """按chat_history中已记录的情感结果重新计算每日汇总，返回汇总行数"""
+        label_columns = ', '.join(
+            f"SUM(CASE WHEN sentiment_label = '{label}' THEN 1 ELSE 0 END), "
+            f"SUM(CASE WHEN sentiment_label = '{label}' THEN sentiment_score ELSE 0 END)"
+            for label in SENTIMENT_COLUMNS)
+
+        def work(db):
+            db.execute("DELETE FROM sentiment_daily")
+            return db.execute(
+                f"""
+                INSERT INTO sentiment_daily ({', '.join(SENTIMENT_DAILY_COLUMNS)})
+                SELECT user_id, DATE(timestamp), COUNT(*), SUM(sentiment_score), {label_columns}
+                FROM chat_history
+                WHERE sentiment_label IS NOT NULL
+                GROUP BY user_id, DATE(timestamp)
+                """
+            ).rowcount
+        return self._write(work)
+
+    def _bump_sentiment_daily(self, db, user_id, day, label, score, sign):
+        """按一条消息的结果增减当日汇总，sign为1表示计入、-1表示撤销"""
+        values = [user_id, day, sign, sign * score]
+        for name in SENTIMENT_COLUMNS:
+            matched = name == label
+            values += [sign if matched else 0, sign * score if matched else 0.0]
+        counters = SENTIMENT_DAILY_COLUMNS[2:]
+        db.execute(
+            f"INSERT INTO sentiment_daily ({', '.join(SENTIMENT_DAILY_COLUMNS)}) "
+            f"VALUES ({', '.join(['%s'] * len(SENTIMENT_DAILY_COLUMNS))}) "
+            + self._upsert_increment(('user_id', 'day'), counters),
+            values
+        )
+
+    def _load_search_hits(self, db, ranked, terms) -> List[dict]:
+        """按排序结果取回当前页的记录并生成高亮片段，只读取需要返回的行"""
+        ids = {source: [doc_id for s, doc_id, _ in ranked if s == source] for source in SEARCH_SOURCES}
+        docs = {}
+        if ids['story']:
+            placeholders = ', '.join(['%s'] * len(ids['story']))
+            for row in self._hydrate_archived(db, 'story', db.execute(
+                    f"SELECT id, input_prompt, story, timestamp, archived FROM story_history WHERE id IN ({placeholders})",
+                    ids['story']).fetchall()):
+                docs[('story', row['id'])] = row
+        if ids['chat']:
+            placeholders = ', '.join(['%s'] * len(ids['chat']))
+            for row in self._hydrate_archived(db, 'chat', db.execute(
+                    f"SELECT id, role, content, conversation_id, timestamp, archived FROM chat_history "
+                    f"WHERE id IN ({placeholders})", ids['chat']).fetchall()):
+                docs[('chat', row['id'])] = row
+
+        hits = []
+        for source, doc_id, score in ranked:
+            row = docs.get((source, doc_id))
+            if row is None:
+                continue
+            hit = {'source': source, 'id': doc_id, 'score': round(float(score), 4), 'timestamp': row['timestamp']}
+            if source == 'story':
+                hit['input_prompt'] = make_snippet(row['input_prompt'], terms, width=40)
+                hit['snippet'] = make_snippet(row['story'], terms)
+            else:
+                hit['role'] = row['role']
+                hit['conversation_id'] = row['conversation_id']
+                hit['snippet'] = make_snippet(row['content'], terms)
+            hits.append(hit)
+        return hits
+
+    def _touch_conversation_summary(self, db, conversation_id, message_id, content):
+        """新消息写入后累加对话摘要"""
+        db.execute(
+            """
+            UPDATE conversations
+            SET message_count = message_count + 1,
+                last_updated  = (SELECT timestamp FROM chat_history WHERE id = %s),
+                last_message  = %s
+            WHERE id = %s
+            """,
+            (message_id, content[:PREVIEW_LENGTH], conversation_id)
+        )
+
+    def _retract_conversation_summary(self, db, conversation_id):
+        """消息删除后扣减计数并回退到最新一条消息"""
+        latest = db.execute(
+            "SELECT id, timestamp, content, archived FROM chat_history WHERE conversation_id = %s "
+            "ORDER BY timestamp DESC, id DESC LIMIT 1",
+            (conversation_id,)
+        ).fetchone()
+        if latest:
+            self._hydrate_archived(db, 'chat', [latest])
+        db.execute(
+            """
+            UPDATE conversations
+            SET message_count = CASE WHEN message_count > 0 THEN message_count - 1 ELSE 0 END,
+                last_updated  = %s,
+                last_message  = %s
+            WHERE id = %s
+            """,
+            (latest['timestamp'] if latest else None,
+             latest['content'][:PREVIEW_LENGTH] if latest else None,
+             conversation_id)
+        )
+
+
+def story_search_text(input_prompt, story) -> str:
+    """故事记录参与检索的文本：输入提示与故事正文"""
+    return f"{input_prompt or ''}\n{story or ''}"
+
+
+def pack_archive_fields(source, row) -> bytes:
+    """归档的正文字段：故事为 [思考过程, 故事]，聊天为消息内容"""
+    if source == 'story':
+        return json.dumps([row['thinking'], row['story']], ensure_ascii=False).encode('utf-8')
+    return row['content'].encode('utf-8')
+
+
+def unpack_archive_fields(source, data: bytes) -> dict:
+    if source == 'story':
+        thinking, story = json.loads(data)
+        return {'thinking': thinking, 'story': story}
+    return {'content': data.decode('utf-8')}
+
+
+def create_storage(kind: str, **options) -> Storage:
+    """根据配置创建存储后端: mysql / sqlite"""
+    if kind == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(options.get('path', 'story_app.db'))
+    if kind == 'mysql':
+        from mysql_storage import MySQLStorage
+        return MySQLStorage(options['dbconfig'], **options.get('pool', {}))
+    raise ValueError(f"未知的存储后端: {kind}")
@@ -0,0 +1,184 @@
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+# 订阅者落后超过缓冲区、缺失的事件已被淘汰时发送，客户端需重新生成
+EXPIRED_EVENT = f"data: {json.dumps({'error': 'STREAM_EXPIRED', 'message': '故事流已过期，请重新生成'}, ensure_ascii=False)}\n\n"
+
+
+class StreamExpired(Exception):
+    """要读取的事件已被移出缓冲区"""
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Last-Event-ID格式为 "流ID:序号"，无效时返回None"""
+    stream_id, _, seq = (value or '').strip().rpartition(':')
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class StoryStream:
+    """一次生成的事件缓冲：生产线程按序号追加SSE事件，订阅者从任意序号之后读取
+
+    只保留最近buffer_size个事件，更早的序号无法续传。
+    """
+
+    def __init__(self, stream_id: str, user_id, buffer_size: int):
+        self.id = stream_id
+        self.user_id = user_id
+        self._events = deque(maxlen=buffer_size)
+        self._next_seq = 1
+        self._cond = threading.Condition()
+        self._subscribers = 0
+        self._detached_at = time.monotonic()
+        self.done = False
+        self.finished_at = None
+        # 生产线程名，请求级性能分析按此前缀同时采样生产线程及其派生的读取线程
+        self.producer_name = f'story-stream-{stream_id[:8]}'
+
+    def publish(self, event: str):
+        with self._cond:
+            self._events.append((self._next_seq, event))
+            self._next_seq += 1
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def can_resume(self, after_seq: int) -> bool:
+        with self._cond:
+            first = self._events[0][0] if self._events else self._next_seq
+            return first <= after_seq + 1 <= self._next_seq
+
+    def read(self, after_seq: int, timeout: float) -> Tuple[List[Tuple[int, str]], bool]:
+        """返回after_seq之后的事件，以及是否已全部读完；没有新事件时最多等待timeout秒
+
+        after_seq之后的事件已被移出缓冲区时抛出StreamExpired，不返回有缺口的内容。
+        """
+        with self._cond:
+            if after_seq + 1 >= self._next_seq and not self.done:
+                self._cond.wait(timeout)
+            first = self._events[0][0] if self._events else self._next_seq
+            if after_seq + 1 < first:
+                raise StreamExpired(f"序号 {after_seq + 1} 已被移出缓冲区（最早为 {first}）")
+            start = after_seq + 1 - first
+            return list(itertools.islice(self._events, start, None)), self.done
+
+    def attach(self):
+        with self._cond:
+            self._subscribers += 1
+
+    def detach(self):
+        with self._cond:
+            self._subscribers -= 1
+            if not self._subscribers:
+                self._detached_at = time.monotonic()
+
+    def abandoned(self, grace_period: float) -> bool:
+        """没有订阅者已超过grace_period秒"""
+        with self._cond:
+            return not self._subscribers and time.monotonic() - self._detached_at > grace_period
+
+
+class StreamHub:
+    """可续传的SSE故事流：上游读取在独立的生产线程中进行，与客户端连接解耦
+
+    - 每个事件带 "id: 流ID:序号"，客户端断线后带Last-Event-ID重连即可补发并继续实时推送
+    - 客户端全部断开后生产线程继续读取grace_period秒，期间没有重连才中止上游请求
+    - 结束后的流再保留retention秒供迟到的重连补发结尾
+
+    流保存在进程内存中，多进程部署时重连需要路由到同一进程。
+    """
+
+    def __init__(self, buffer_size: int = 4096, grace_period: float = 60.0, retention: float = 300.0,
+                 keepalive: float = 15.0):
+        self.logger = logging.getLogger(__name__)
+        self.buffer_size = buffer_size
+        self.grace_period = grace_period
+        self.retention = retention
+        self.keepalive = keepalive
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._metrics = {'started': 0, 'resumed': 0, 'abandoned': 0, 'expired': 0}
+
+    def start(self, user_id, events: Iterable[str]) -> StoryStream:
+        """在生产线程中迭代events（已格式化的SSE事件），返回可订阅的流"""
+        self._sweep()
+        stream = StoryStream(uuid.uuid4().hex, user_id, self.buffer_size)
+        with self._lock:
+            self._streams[stream.id] = stream
+        self._metrics['started'] += 1
+        threading.Thread(target=self._produce, args=(stream, events),
+                         name=stream.producer_name, daemon=True).start()
+        return stream
+
+    def get(self, user_id, stream_id) -> Optional[StoryStream]:
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        return stream if stream is not None and stream.user_id == user_id else None
+
+    def subscribe(self, stream: StoryStream, after_seq: int = 0) -> Iterator[str]:
+        """从after_seq之后开始输出事件直到流结束，长时间无事件时发送注释行保活"""
+        if after_seq:
+            self._metrics['resumed'] += 1
+        stream.attach()
+        try:
+            seq = after_seq
+            while True:
+                try:
+                    events, done = stream.read(seq, self.keepalive)
+                except StreamExpired as e:
+                    # 读取过慢，落后超过缓冲区：明确结束，而不是输出缺了一段的故事
+                    self._metrics['expired'] += 1
+                    self.logger.warning(f"故事流 {stream.id} 的订阅者落后过多: {e}")
+                    yield EXPIRED_EVENT
+                    return
+                for seq, event in events:
+                    yield f"id: {stream.id}:{seq}\n{event}"
+                # done与事件在同一把锁内读取，结束时已拿到全部事件
+                if done:
+                    return
+                if not events:
+                    yield ": keep-alive\n\n"
+        finally:
+            stream.detach()
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = sum(1 for stream in self._streams.values() if not stream.done)
+            return dict(self._metrics, active=active, retained=len(self._streams) - active)
+
+    def _produce(self, stream: StoryStream, events: Iterable[str]):
+        try:
+            for event in events:
+                stream.publish(event)
+                if stream.abandoned(self.grace_period):
+                    self._metrics['abandoned'] += 1
+                    self.logger.info(f"故事流 {stream.id} 的客户端超过 {self.grace_period}s 未重连，停止读取上游")
+                    break
+        except Exception as e:
+            self.logger.error(f"故事流 {stream.id} 生成失败: {e}", exc_info=True)
+        finally:
+            # 中止时关闭生成器，触发其中的清理逻辑（关闭上游连接）
+            close = getattr(events, 'close', None)
+            if close is not None:
+                close()
+            stream.finish()
+
+    def _sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [stream_id for stream_id, stream in self._streams.items()
+                       if stream.done and now - stream.finished_at > self.retention]
+            for stream_id in expired:
+                del self._streams[stream_id]
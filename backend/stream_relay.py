@@ -0,0 +1,174 @@
+import json
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+
+class SSEDataParser:
+    """增量解析原始字节流中的SSE事件，只取data字段
+
+    上游分块可能在任意字节处截断，未完整的行保留到下一块；
+    一个事件的多行data按规范用换行拼接，空行结束事件。
+    """
+
+    def __init__(self):
+        self._tail = b''
+        self._data = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """返回本块中完整结束的事件的data（字节串）"""
+        lines = (self._tail + chunk if self._tail else chunk).split(b'\n')
+        self._tail = lines.pop()
+        return self._parse(lines)
+
+    def flush(self) -> List[bytes]:
+        """上游结束时调用：最后一个事件可能缺少结尾的空行，按已结束处理"""
+        lines = [self._tail, b''] if self._tail else [b'']
+        self._tail = b''
+        return self._parse(lines)
+
+    def _parse(self, lines: List[bytes]) -> List[bytes]:
+        events = []
+        for line in lines:
+            if line.startswith(b'data:'):
+                value = line[6:] if line[5:6] == b' ' else line[5:]
+                self._data.append(value[:-1] if value.endswith(b'\r') else value)
+            elif (not line or line == b'\r') and self._data:
+                events.append(self._data[0] if len(self._data) == 1 else b'\n'.join(self._data))
+                self._data = []
+        return events
+
+
+def story_deltas(chunks: Iterable[bytes], on_error: Optional[Callable[[Exception], None]] = None
+                 ) -> Iterator[Tuple[str, Optional[int]]]:
+    """从通义的流式响应中取出 (增量文本, 累计输出token数)，token数缺失时为None"""
+    for data in _sse_data(chunks):
+        try:
+            payload = json.loads(data)
+            text = payload['output']['text']
+        except (ValueError, KeyError, TypeError) as e:
+            if on_error is not None:
+                on_error(e)
+            continue
+        if text:
+            yield text, (payload.get('usage') or {}).get('output_tokens')
+
+
+def _sse_data(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    parser = SSEDataParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.flush()
+
+
+def sse_frame(text: str) -> str:
+    return f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
+
+
+class UpstreamReader:
+    """在后台线程中迭代上游增量，读取方可以带超时等待下一段
+
+    coalesce_frames借此在上游停顿时按时发出未满一帧的文本。线程名为当前线程名加 "-upstream"，
+    请求级性能分析按名称前缀一并采样。
+    """
+
+    _END = object()
+
+    def __init__(self, deltas: Iterable[str]):
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._error = None
+        threading.Thread(target=self._run, args=(deltas,),
+                         name=f'{threading.current_thread().name}-upstream', daemon=True).start()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """下一段文本，上游结束时返回None；timeout秒内没有新内容时抛出queue.Empty，上游出错时抛出原异常"""
+        item = self._queue.get(timeout=timeout)
+        if item is self._END:
+            self._queue.put(item)
+            if self._error is not None:
+                raise self._error
+            return None
+        return item
+
+    def close(self):
+        """读取方不再需要后续内容，后台线程在下一段到达或上游连接关闭时退出"""
+        self._closed.set()
+
+    def _run(self, deltas):
+        try:
+            for text in deltas:
+                if self._closed.is_set():
+                    break
+                self._queue.put(text)
+        except Exception as e:
+            self._error = e
+        finally:
+            close = getattr(deltas, 'close', None)
+            if close is not None:
+                close()
+            self._queue.put(self._END)
+
+
+def coalesce_frames(deltas: Iterable[str], max_bytes: int = 64, max_delay: float = 0.04,
+                    clock: Callable[[], float] = time.monotonic) -> Iterator[str]:
+    """把增量文本合并成SSE帧：积累到max_bytes字节或距本帧第一段达到max_delay秒时输出
+
+    第一段文本立即输出，不增加首字延迟。deltas为UpstreamReader时按截止时间等待，
+    上游停顿期间未满一帧的文本也在max_delay秒内发出；普通可迭代对象只能在新片段到达时判断
+    （基准测试用模拟时钟）。
+    """
+    if isinstance(deltas, UpstreamReader):
+        read = deltas.get
+    else:
+        iterator = iter(deltas)
+
+        def read(timeout):
+            return next(iterator, None)
+
+    pending, size, since, first = [], 0, 0.0, True
+    try:
+        while True:
+            try:
+                text = read(max(0.0, since + max_delay - clock()) if pending else None)
+            except queue.Empty:
+                # 截止时间已到，上游仍未送来新片段
+                yield sse_frame(''.join(pending))
+                pending, size = [], 0
+                continue
+            if text is None:
+                break
+            if not pending:
+                since = clock()
+            pending.append(text)
+            size += len(text.encode('utf-8'))
+            if first or size >= max_bytes or clock() - since >= max_delay:
+                yield sse_frame(''.join(pending))
+                pending, size, first = [], 0, False
+    except Exception:
+        # 上游中断时先把已收到的文本发出去，再交给调用方处理
+        if pending:
+            yield sse_frame(''.join(pending))
+        raise
+    finally:
+        close = getattr(deltas, 'close', None)
+        if close is not None:
+            close()
+    if pending:
+        yield sse_frame(''.join(pending))
+
+
+def gzip_frames(frames: Iterable[str], level: int = 6) -> Iterator[bytes]:
+    """逐帧gzip压缩，每帧后同步刷新，客户端收到即可解压出完整的帧"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for frame in frames:
+            yield compressor.compress(frame.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        # 客户端断开时关闭内层生成器，及时释放订阅
+        close = getattr(frames, 'close', None)
+        if close is not None:
+            close()
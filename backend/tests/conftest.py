@@ -0,0 +1,14 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlite_storage import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """已建表的临时SQLite存储"""
+    store = SQLiteStorage(str(tmp_path / 'story_app.db'))
+    store.init_schema()
+    yield store
+    store.close()
@@ -0,0 +1,95 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import archive_codec
+from archive_service import ArchiveService
+
+CODECS = [archive_codec.ZLIB] + ([archive_codec.ZSTD] if archive_codec.zstandard is not None else [])
+
+
+def seed(storage, stories=60):
+    user_id = storage.create_user('alice', 'hashed')
+    for i in range(stories):
+        storage.save_story_history(user_id, f'讲一个小兔子的故事{i}', f'孩子今天很开心，第{i}次',
+                                   f'从前有一只小兔子，它住在森林里。第{i}天，小兔子遇到了小熊，它们成为了好朋友。' * 5)
+    message_id = storage.save_chat_message(user_id, 'user', '我想听小兔子和月亮的故事')
+    storage.record_message_sentiments([(message_id, '积极', 0.9)])
+    storage.save_chat_message(user_id, 'user', '还没有打分的消息')
+    # 全部改为一年前写入
+    storage._write(lambda db: [db.execute(f"UPDATE {table} SET timestamp = datetime('now', '-365 days')")
+                               for table in ('story_history', 'chat_history')])
+    return user_id, message_id
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_compaction_saves_space_and_reads_through(storage, codec):
+    user_id, _ = seed(storage)
+    before = storage.list_story_history(user_id)
+
+    report = ArchiveService(storage, min_age_days=180, batch_size=25, pause=0, codec=codec).compact()
+    assert report['rows'] == 61 and report['batches'] == 4
+    assert report['saved_bytes'] > report['raw_bytes'] / 2
+    assert report['totals']['story']['rows'] == 60
+
+    # 原表正文已清空，接口返回的内容与归档前一致
+    raw = storage._read(lambda db: db.execute("SELECT thinking, archived FROM story_history LIMIT 1").fetchone())
+    assert raw == {'thinking': None, 'archived': 1}
+    assert storage.list_story_history(user_id) == before
+    assert storage.get_story(before[0]['id'])['story'] == before[0]['story']
+    hit = storage.search_history(user_id, '月亮')['hits'][0]
+    assert hit['source'] == 'chat' and '月亮' in hit['snippet']
+
+    # 未打分的消息不归档；再次运行没有新的记录
+    assert {m['content'] for m in storage.list_chat_history(user_id)} == {'我想听小兔子和月亮的故事', '还没有打分的消息'}
+    assert ArchiveService(storage, min_age_days=180, pause=0, codec=codec).compact()['rows'] == 0
+
+
+def test_recent_rows_stay_hot_and_archived_message_can_be_deleted(storage):
+    user_id, message_id = seed(storage, stories=3)
+    storage.save_story_history(user_id, '新故事', '', '刚刚写入的故事')
+
+    ArchiveService(storage, min_age_days=180, pause=0, codec=archive_codec.ZLIB).compact()
+    assert storage._read(lambda db: db.execute(
+        "SELECT archived FROM story_history WHERE input_prompt = '新故事'").scalar()) == 0
+
+    assert storage.delete_chat_message(user_id, message_id) == (True, None)
+    assert storage.search_history(user_id, '月亮')['hits'] == []
+    assert 'chat' not in storage.archive_stats()
+
+
+def test_archived_rows_keep_searchable_prefix_and_previews(storage):
+    """原表保留正文前缀：全文索引（MySQL直接检索原表）与对话预览在归档后不变"""
+    user_id = storage.create_user('alice', 'hashed')
+    conversation_id = storage.create_conversation(user_id, '睡前故事')
+    story = '从前有一只小兔子，它住在森林里。' * 10 + '最后它找到了月亮。'
+    storage.save_story_history(user_id, '讲个故事', '', story)
+    message_id = storage.save_chat_message(user_id, 'user', '我想听小熊找蜂蜜的故事' * 20, conversation_id)
+    storage.record_message_sentiments([(message_id, '积极', 0.9)])
+    storage._write(lambda db: [db.execute(f"UPDATE {table} SET timestamp = datetime('now', '-365 days')")
+                               for table in ('story_history', 'chat_history')])
+    storage.refresh_conversation_summaries(user_id)
+    previews = storage.list_conversations(user_id)
+
+    assert ArchiveService(storage, min_age_days=180, pause=0, codec=archive_codec.ZLIB,
+                          search_chars=50).compact()['rows'] == 2
+    hot = storage._read(lambda db: db.execute("SELECT story FROM story_history").scalar())
+    assert hot == story[:100]
+    assert storage.search_history(user_id, '兔子', sources=('story',))['total'] == 1
+    assert storage.search_history(user_id, '蜂蜜', sources=('chat',))['total'] == 1
+    # 语义缓存不索引只剩前缀的归档故事
+    assert storage.list_recent_stories(10) == []
+
+    storage.refresh_conversation_summaries(user_id)
+    assert storage.list_conversations(user_id) == previews
+    assert storage.get_story(storage.list_story_history(user_id)[0]['id'])['story'] == story
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_codec_roundtrip_with_trained_dictionary(codec):
+    samples = [f'从前有一只小兔子，第{i}天它在森林里遇到了好朋友小熊。'.encode() * 3 for i in range(200)]
+    dictionary = archive_codec.train_dictionary(samples, 4096, codec)
+    data = '从前有一只小兔子，它在森林里遇到了小熊。'.encode()
+    payload = archive_codec.compress(data, dictionary, codec)
+    assert archive_codec.decompress(payload, dictionary) == data
+    assert len(payload) < len(archive_codec.compress(data, None, codec))
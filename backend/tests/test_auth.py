@@ -0,0 +1,66 @@
+import pytest
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import jwt as pyjwt
+from flask import Flask, g, jsonify
+from auth import TokenVerifier, init_auth, login_required
+
+SECRET = 'test-secret-key-for-auth-tests-0123456789'
+
+
+def make_token(user_id=1, expires_in=60, **claims):
+    return pyjwt.encode({'user_id': user_id, 'exp': int(time.time()) + expires_in, **claims},
+                        SECRET, algorithm='HS256')
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET
+    init_auth(app)
+
+    @app.route('/me')
+    @login_required
+    def me():
+        return jsonify({'user_id': g.user_id})
+
+    return app.test_client()
+
+
+def test_login_required_sets_user(client):
+    """有效token写入g.user_id，缺失或错误的token返回401"""
+    response = client.get('/me', headers={'Authorization': f'Bearer {make_token(7)}'})
+    assert response.status_code == 200 and response.get_json() == {'user_id': 7}
+
+    assert client.get('/me').status_code == 401
+    assert client.get('/me', headers={'Authorization': 'Bearer not-a-token'}).get_json() == {'error': '无效的token'}
+    expired = make_token(expires_in=-10)
+    assert client.get('/me', headers={'Authorization': f'Bearer {expired}'}).get_json() == {'error': 'token已过期'}
+
+
+def test_verifier_caches_until_expiry(monkeypatch):
+    """同一token只解码一次，缓存到exp为止"""
+    verifier = TokenVerifier(SECRET)
+    token = make_token(3, expires_in=5)
+    assert verifier.verify(token)['user_id'] == 3
+    assert verifier.verify(token)['user_id'] == 3
+    assert (verifier.stats()['decoded'], verifier.stats()['cache_hits']) == (1, 1)
+
+    monkeypatch.setattr(time, 'time', lambda: pyjwt.decode(token, SECRET, algorithms=['HS256'])['exp'] + 1)
+    with pytest.raises(pyjwt.ExpiredSignatureError):
+        verifier.verify(token)
+    assert verifier.stats()['cached'] == 0
+
+
+def test_revocation_applies_to_cached_tokens():
+    """吊销检查对已缓存的token同样生效"""
+    verifier = TokenVerifier(SECRET)
+    revoked = set()
+    verifier.add_revocation_check(lambda claims: claims['user_id'] in revoked)
+    token = make_token(5)
+    verifier.verify(token)
+    revoked.add(5)
+    with pytest.raises(pyjwt.InvalidTokenError):
+        verifier.verify(token)
@@ -0,0 +1,113 @@
+import pytest
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batch_jobs import RateLimiter, StoryJobRunner, UpstreamThrottled
+
+
+@pytest.fixture
+def user_id(storage):
+    return storage.create_user('curator', 'hashed')
+
+
+def wait_for(storage, user_id, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = storage.get_story_job(user_id, job_id)
+        if job['status'] in ('completed', 'cancelled'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'任务未完成: {job}')
+
+
+def make_runner(storage, generate, **options):
+    options = dict(dict(workers=3, requests_per_minute=0, batch_size=4, flush_interval=0.05, poll_interval=0.05),
+                   **options)
+    return StoryJobRunner(storage, generate, **options)
+
+
+def test_job_runs_retries_and_bulk_stores_stories(storage, user_id):
+    """失败的条目按次数重试，成功的故事写入故事历史并可检索，最终失败的记录错误"""
+    calls = {}
+    throttled = []
+
+    def generate(prompt):
+        calls[prompt] = calls.get(prompt, 0) + 1
+        if prompt == '小兔子' and calls[prompt] == 1:
+            raise ConnectionError('连接被重置')
+        if prompt == '小熊' and not throttled:
+            throttled.append(1)
+            raise UpstreamThrottled(0.01)
+        if prompt == '坏提示':
+            raise ValueError('无效的API响应格式')
+        return '思考', f'关于{prompt}的故事'
+
+    stored_users = []
+    runner = make_runner(storage, generate, max_attempts=2, on_stored=stored_users.extend)
+    runner.start()
+    try:
+        prompts = ['小兔子', '小熊', '坏提示'] + [f'主题{i}' for i in range(7)]
+        job_id = runner.submit(user_id, prompts)
+        job = wait_for(storage, user_id, job_id)
+    finally:
+        runner.stop()
+
+    assert (job['status'], job['total'], job['completed'], job['failed']) == ('completed', 10, 9, 1)
+    assert job['errors'] == [{'position': 2, 'prompt': '坏提示', 'error': '无效的API响应格式'}]
+    assert calls['小兔子'] == 2 and calls['坏提示'] == 2
+    stories = storage.list_story_history(user_id)
+    assert sorted(s['input_prompt'] for s in stories) == sorted(p for p in prompts if p != '坏提示')
+    assert storage.search_history(user_id, '小熊')['hits'][0]['source'] == 'story'
+    assert set(stored_users) == {user_id}
+    assert runner.stats()['throttled'] == 1
+
+
+def test_interrupted_items_resume_after_restart(storage, user_id):
+    """进程中断时已领取的条目在下次启动时重新生成，已完成的不重复"""
+    job_id = storage.create_story_job(user_id, ['一', '二', '三'])
+    first = storage.claim_story_job_items(2)
+    storage.finish_story_job_items([(first[0], '', '故事一')], [])
+    # 此时 '二' 仍为running，模拟进程崩溃后重启
+
+    generated = []
+    runner = make_runner(storage, lambda prompt: generated.append(prompt) or ('', f'故事{prompt}'))
+    runner.start()
+    try:
+        job = wait_for(storage, user_id, job_id)
+    finally:
+        runner.stop()
+    assert sorted(generated) == ['三', '二']
+    assert (job['completed'], job['failed']) == (3, 0)
+    assert len(storage.list_story_history(user_id)) == 3
+
+
+def test_failing_on_stored_callback_does_not_stop_flushing(storage, user_id):
+    """写回后的回调出错时，后续结果仍然写回"""
+    def on_stored(user_ids):
+        raise RuntimeError('语义缓存同步失败')
+
+    runner = make_runner(storage, lambda prompt: ('', f'故事{prompt}'), batch_size=1, on_stored=on_stored)
+    runner.start()
+    try:
+        first = wait_for(storage, user_id, runner.submit(user_id, ['一']))
+        second = wait_for(storage, user_id, runner.submit(user_id, ['二', '三']))
+    finally:
+        runner.stop()
+    assert first['completed'] == 1 and second['completed'] == 2
+
+
+def test_cancelled_job_skips_pending_items(storage, user_id):
+    job_id = storage.create_story_job(user_id, ['一', '二'])
+    assert storage.cancel_story_job(user_id, job_id)
+    assert not storage.cancel_story_job(user_id, job_id)
+    assert storage.claim_story_job_items(10) == []
+    assert storage.get_story_job(user_id, job_id)['status'] == 'cancelled'
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(requests_per_minute=1200, burst=1)  # 每50ms一次
+    start = time.monotonic()
+    for _ in range(4):
+        assert limiter.acquire()
+    assert time.monotonic() - start >= 0.14
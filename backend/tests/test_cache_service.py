@@ -0,0 +1,82 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache_service import LRUCacheBackend, LocalSharedBackend, ReadThroughCache
+
+
+def make_loader(calls, body='[]'):
+    def loader():
+        calls.append(1)
+        return body
+    return loader
+
+
+def test_read_through_hit_and_etag():
+    """第二次读取命中缓存且ETag不变"""
+    cache = ReadThroughCache(LRUCacheBackend())
+    calls = []
+    first = cache.get_or_load(1, 'story_history', {}, make_loader(calls, '[1]'))
+    second = cache.get_or_load(1, 'story_history', {}, make_loader(calls, '[1]'))
+    assert len(calls) == 1
+    assert first['etag'] == second['etag']
+
+
+def test_invalidate_is_scoped_to_user_and_kind():
+    """失效只影响指定用户的指定类型"""
+    cache = ReadThroughCache(LRUCacheBackend())
+    calls = []
+    for user_id in (1, 2):
+        for kind in ('chat_history', 'conversations'):
+            cache.get_or_load(user_id, kind, {}, make_loader(calls))
+    cache.invalidate(1, 'chat_history')
+    calls.clear()
+    for user_id in (1, 2):
+        for kind in ('chat_history', 'conversations'):
+            cache.get_or_load(user_id, kind, {}, make_loader(calls))
+    assert len(calls) == 1
+
+
+def test_query_shape_is_part_of_key():
+    """不同查询形态分别缓存"""
+    cache = ReadThroughCache(LRUCacheBackend())
+    calls = []
+    cache.get_or_load(1, 'story_history', {'page': 1}, make_loader(calls))
+    cache.get_or_load(1, 'story_history', {'page': 2}, make_loader(calls))
+    assert len(calls) == 2
+
+
+def test_lru_eviction_keeps_versions():
+    """LRU淘汰数据条目但不淘汰版本号"""
+    backend = LRUCacheBackend(max_entries=1)
+    cache = ReadThroughCache(backend)
+    calls = []
+    cache.get_or_load(1, 'chat_history', {}, make_loader(calls, '"old"'))
+    cache.invalidate(1, 'chat_history')
+    cache.get_or_load(2, 'chat_history', {}, make_loader(calls))
+    entry = cache.get_or_load(1, 'chat_history', {}, make_loader(calls, '"new"'))
+    assert entry['body'] == '"new"'
+
+
+def test_shared_backend_invalidation_visible_across_nodes():
+    """共享后端上一个节点的失效对其他节点可见"""
+    store = {}
+    node_a = ReadThroughCache(LocalSharedBackend(store))
+    node_b = ReadThroughCache(LocalSharedBackend(store))
+    calls = []
+    node_a.get_or_load(1, 'conversations', {}, make_loader(calls))
+    node_b.get_or_load(1, 'conversations', {}, make_loader(calls))
+    assert len(calls) == 1
+    node_b.invalidate(1, 'conversations')
+    node_a.get_or_load(1, 'conversations', {}, make_loader(calls))
+    assert len(calls) == 2
+
+
+def test_backend_outage_falls_back_to_loader():
+    """缓存后端不可用（如Redis宕机）时直接加载，不抛出异常"""
+    class DownBackend(LRUCacheBackend):
+        def get_counter(self, key):
+            raise ConnectionError('redis down')
+
+    calls = []
+    entry = ReadThroughCache(DownBackend()).get_or_load(1, 'story_history', {}, make_loader(calls, '[1]'))
+    assert entry['body'] == '[1]' and len(calls) == 1
@@ -0,0 +1,93 @@
+import pytest
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conversation_context import ConversationContext, clip_tokens, estimate_tokens
+
+
+@pytest.fixture
+def conversation(storage):
+    user_id = storage.create_user('alice', 'hashed')
+    return user_id, storage.create_conversation(user_id, '睡前故事')
+
+
+def chat(storage, conversation, turns, start=0):
+    user_id, conversation_id = conversation
+    for i in range(start, start + turns):
+        storage.save_chat_message(user_id, 'user', f'第{i}轮：我今天有点难过，想听小熊的故事', conversation_id)
+        storage.save_chat_message(user_id, 'assistant', f'第{i}轮故事：' + '小熊在森林里' * 40, conversation_id)
+
+
+def test_context_size_stays_constant_as_conversation_grows(storage, conversation):
+    calls = []
+
+    def summarize(previous, messages, max_tokens):
+        calls.append(len(messages))
+        return clip_tokens(previous + ''.join(m['content'][:10] for m in messages), max_tokens)
+
+    _, conversation_id = conversation
+    context = ConversationContext(storage, summarize, token_budget=300, summary_tokens=100, recent_turns=2,
+                                  message_tokens=50)
+    sizes = []
+    for turn in range(0, 30, 5):
+        chat(storage, conversation, 5, start=turn)
+        context.update(conversation_id)
+        sizes.append(estimate_tokens(context.build(conversation_id)))
+
+    assert max(sizes) <= 300 + 20  # 另加段落标题
+    assert sizes[-1] == sizes[-2]
+    built = context.build(conversation_id)
+    assert '此前对话摘要' in built and '第29轮' in built and '第0轮：' not in built.split('最近的对话')[1]
+    # 每次只折叠新增的部分，不重复摘要整个对话
+    assert sum(calls) == 30 * 2 - 4
+
+
+def test_build_excludes_current_message_and_falls_back_on_summary_error(storage, conversation):
+    user_id, conversation_id = conversation
+
+    def broken(previous, messages, max_tokens):
+        raise ValueError('无效的API响应格式')
+
+    context = ConversationContext(storage, broken, recent_turns=1)
+    chat(storage, conversation, 3)
+    assert context.update(conversation_id) == 4
+    assert context.stats()['fallbacks'] == 1
+    assert '第0轮' in storage.get_conversation_context(conversation_id)['summary']
+
+    current = storage.save_chat_message(user_id, 'user', '再讲一个', conversation_id)
+    built = context.build(conversation_id, before_id=current)
+    assert '第2轮' in built and '再讲一个' not in built
+
+
+def test_deleting_summarized_message_drops_summary(storage, conversation):
+    user_id, conversation_id = conversation
+    chat(storage, conversation, 3)
+    ConversationContext(storage, recent_turns=1).update(conversation_id)
+    first = storage.list_conversation_messages(conversation_id, limit=1)[0]
+    assert storage.get_conversation_context(conversation_id)['summarized_until'] > first['id']
+
+    storage.delete_chat_message(user_id, first['id'])
+    assert storage.get_conversation_context(conversation_id) == {'summary': '', 'summarized_until': 0}
+    # 旧的折叠进度已失效，不会覆盖
+    assert not storage.save_conversation_context(conversation_id, '旧摘要', 10, previous_until=4)
+
+
+def test_worker_survives_malformed_summaries(storage, conversation):
+    """摘要返回异常类型时退回抽取式摘要，后台线程继续处理后续对话"""
+    user_id, conversation_id = conversation
+    other_id = storage.create_conversation(user_id, '第二个对话')
+
+    def malformed(previous, messages, max_tokens):
+        return None.strip()
+
+    context = ConversationContext(storage, malformed, recent_turns=1)
+    chat(storage, conversation, 2)
+    chat(storage, (user_id, other_id), 2)
+    context.submit(conversation_id)
+    context.submit(other_id)
+    deadline = time.monotonic() + 2
+    while context.stats()['folds'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert context.stats()['fallbacks'] == 2
+    assert storage.get_conversation_context(other_id)['summarized_until'] > 0
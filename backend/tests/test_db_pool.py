@@ -0,0 +1,93 @@
+import pytest
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mysql.connector import errors
+import db_pool
+from db_pool import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.pings = 0
+        self.in_transaction = False
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self.pings += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(db_pool.mysql.connector, 'connect', lambda **kwargs: FakeConnection())
+    return ConnectionPool({}, min_size=1, max_size=2, validate_after=0.05,
+                          idle_timeout=0.05, checkout_timeout=0.1, leak_threshold=0.05)
+
+
+def test_checkout_skips_validation_for_recently_used(pool):
+    """刚归还的连接不做校验"""
+    with pool.connection() as conn:
+        pass
+    with pool.connection() as again:
+        assert again is conn
+    assert conn.pings == 0
+
+
+def test_idle_connection_is_validated(pool):
+    """空闲超过阈值的连接借出前校验"""
+    with pool.connection() as conn:
+        pass
+    time.sleep(0.06)
+    with pool.connection():
+        pass
+    assert conn.pings == 1
+    assert pool.stats()['validations'] == 1
+
+
+def test_grows_to_max_and_times_out(pool):
+    """池在max_size内扩容，耗尽后等待超时"""
+    with pool.connection(), pool.connection():
+        assert pool.stats()['in_use'] == 2
+        with pytest.raises(errors.PoolError):
+            with pool.connection():
+                pass
+    assert pool.stats()['checkout_timeouts'] == 1
+
+
+def test_connection_returned_on_exception_and_rolled_back(pool):
+    """异常退出时连接仍归还，未提交事务被回滚"""
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.in_transaction = True
+            raise RuntimeError('boom')
+    stats = pool.stats()
+    assert stats['in_use'] == 0
+    assert conn.rollbacks == 1
+
+
+def test_shrinks_back_to_min_size(pool):
+    """多余的空闲连接超时后回收"""
+    with pool.connection(), pool.connection():
+        pass
+    assert pool.stats()['size'] == 2
+    time.sleep(0.06)
+    with pool.connection():
+        pass
+    assert pool.stats()['size'] == 1
+
+
+def test_long_checkout_reports_leak(pool):
+    """长时间占用连接会产生泄漏告警"""
+    with pool.connection():
+        time.sleep(0.06)
+        assert pool.stats()['leak_warnings'] == 1
+    assert pool.stats()['leak_warnings'] == 1
@@ -0,0 +1,45 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import Flask
+from metrics import init_metrics, register_stats, server_timing_header, span
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    init_metrics(app)
+
+    @app.route('/work')
+    def work():
+        with span('test_stage'):
+            pass
+        with span('test_stage'):
+            pass
+        return 'ok'
+
+    register_stats('test_pool', lambda: {'size': 3, 'backend': 'mysql'})
+    return app.test_client()
+
+
+def test_server_timing_header(client):
+    """同一阶段多次计时合并为一项，附带total"""
+    header = client.get('/work').headers['Server-Timing']
+    assert header.startswith('test_stage;dur=')
+    assert 'desc="2x"' in header
+    assert ', total;dur=' in header
+
+
+def test_metrics_endpoint_exports_stages_and_stats(client):
+    """/metrics 导出阶段直方图与注册的stats数值"""
+    client.get('/work')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'story_stage_seconds_count{stage="test_stage"}' in body
+    assert 'story_http_request_seconds_count{endpoint="/work",method="GET",status="200"}' in body
+    assert 'story_test_pool_size 3.0' in body
+    assert 'story_test_pool_backend' not in body
+
+
+def test_server_timing_format():
+    assert server_timing_header({'sql_select': (0.0015, 1)}, 0.01) == 'sql_select;dur=1.50, total;dur=10.00'
@@ -0,0 +1,54 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from werkzeug.security import generate_password_hash
+from password_hasher import HasherBusy, PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    return PasswordHasher(method='pbkdf2:sha256:1000', workers=0, max_pending=2)
+
+
+def test_hash_and_verify_in_process_pool():
+    """子进程中计算的哈希与校验结果正确"""
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1)
+    try:
+        stored = hasher.hash('secret')
+        assert stored.startswith('pbkdf2:sha256:1000$')
+        assert hasher.verify(stored, 'secret')
+        assert not hasher.verify(stored, 'wrong')
+    finally:
+        hasher.close()
+
+
+def test_needs_rehash_when_parameters_change(hasher):
+    """旧参数生成的哈希需要升级，升级结果交给保存回调"""
+    old = generate_password_hash('secret', method='pbkdf2:sha256:500')
+    assert hasher.needs_rehash(old)
+    assert not hasher.needs_rehash(hasher.hash('secret'))
+
+    saved = []
+    hasher.rehash_later('secret', saved.append)
+    assert saved and hasher.verify(saved[0], 'secret') and not hasher.needs_rehash(saved[0])
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'pbkdf2', 'pbkdf2:sha512', 'scrypt:16384:8:1'])
+def test_needs_rehash_without_hashing(method):
+    """省略参数的方法名按默认值比较，判断本身不计算哈希"""
+    hasher = PasswordHasher(method=method, workers=0)
+    assert not hasher.needs_rehash(generate_password_hash('secret', method=method))
+    assert hasher.stats()['hashed'] == 0
+
+
+def test_rejects_when_queue_is_full(hasher):
+    """等待中的任务达到上限时立即拒绝，完成后释放名额"""
+    hasher._slots.acquire()
+    hasher._slots.acquire()
+    with pytest.raises(HasherBusy):
+        hasher.hash('secret')
+    assert hasher.stats()['rejected'] == 1
+    hasher._slots.release()
+    hasher._slots.release()
+    assert hasher.verify(hasher.hash('secret'), 'secret')
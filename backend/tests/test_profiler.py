@@ -0,0 +1,101 @@
+import pytest
+import sys
+import os
+import time
+import jwt as pyjwt
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import Flask, Response
+from auth import init_auth
+from profiler import RequestProfiler, follow_threads, sign_profile_request
+from stream_hub import StreamHub
+
+SECRET = 'profile-secret'
+
+
+def busy_stream():
+    for i in range(3):
+        deadline = time.perf_counter() + 0.03
+        while time.perf_counter() < deadline:
+            pass
+        yield f"data: {i}\n\n"
+
+
+hub = StreamHub()
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+
+    @app.route('/api/stream')
+    def stream():
+        return Response(busy_stream(), mimetype='text/event-stream')
+
+    @app.route('/api/hub_stream')
+    def hub_stream():
+        stream = hub.start(1, busy_stream())
+        follow_threads(stream.producer_name)
+        return Response(hub.subscribe(stream), mimetype='text/event-stream')
+    return app
+
+
+def test_signed_request_profiles_generator_body(app, tmp_path):
+    """签名正确时分析整个流式响应，结果文件名包含路由与耗时"""
+    RequestProfiler(output_dir=str(tmp_path), secret=SECRET, interval=0.002).init_app(app)
+    client = app.test_client()
+
+    assert 'X-Profile-Id' not in client.get('/api/stream', headers={'X-Profile-Request': '1:bad'}).headers
+    response = client.get('/api/stream', headers={'X-Profile-Request': sign_profile_request(SECRET, '/api/stream')})
+    response.get_data()
+    response.close()
+
+    files = os.listdir(tmp_path)
+    assert len(files) == 1 and files[0].startswith('api_stream_') and response.headers['X-Profile-Id'] in files[0]
+    collapsed = (tmp_path / files[0]).read_text(encoding='utf-8')
+    assert 'busy_stream (test_profiler.py:' in collapsed
+
+
+def test_profile_covers_stream_hub_producer_thread(app, tmp_path):
+    """经StreamHub转发时生成器在生产线程中执行，样本应包含该线程"""
+    RequestProfiler(output_dir=str(tmp_path), secret=SECRET, interval=0.002).init_app(app)
+    response = app.test_client().get(
+        '/api/hub_stream', headers={'X-Profile-Request': sign_profile_request(SECRET, '/api/hub_stream')})
+    assert response.get_data().count(b'data: ') == 3
+    response.close()
+
+    collapsed = (tmp_path / os.listdir(tmp_path)[0]).read_text(encoding='utf-8')
+    assert 'busy_stream (test_profiler.py:' in collapsed and '_produce (stream_hub.py:' in collapsed
+
+
+def test_sample_every_n_requests(app, tmp_path):
+    RequestProfiler(output_dir=str(tmp_path), sample_every=2, fmt='speedscope').init_app(app)
+    client = app.test_client()
+    profiled = []
+    for _ in range(4):
+        response = client.get('/api/stream')
+        response.get_data()
+        response.close()
+        profiled.append('X-Profile-Id' in response.headers)
+    assert profiled == [False, True, False, True]
+    assert all(name.endswith('.speedscope.json') for name in os.listdir(tmp_path))
+
+
+def test_arm_endpoint_validates_count(app, tmp_path):
+    app.config['SECRET_KEY'] = 'test-secret-key-for-profiler-tests-0123'
+    init_auth(app)
+    profiler = RequestProfiler(output_dir=str(tmp_path), admin_ids=[1])
+    profiler.init_app(app)
+    token = pyjwt.encode({'user_id': 1, 'exp': int(time.time()) + 60}, app.config['SECRET_KEY'], algorithm='HS256')
+    client, headers = app.test_client(), {'Authorization': f'Bearer {token}'}
+
+    for count in ('abc', None, [2]):
+        response = client.post('/api/admin/profile', json={'endpoint': '/api/stream', 'count': count}, headers=headers)
+        assert response.status_code == 400 and 'error' in response.get_json()
+    response = client.post('/api/admin/profile', json={'endpoint': '/api/stream', 'count': '2'}, headers=headers)
+    assert response.get_json() == {'endpoint': '/api/stream', 'armed': 2}
+
+
+def test_disabled_profiler_registers_nothing(app):
+    RequestProfiler().init_app(app)
+    assert not app.before_request_funcs and not app.after_request_funcs
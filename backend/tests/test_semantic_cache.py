@@ -0,0 +1,104 @@
+import pytest
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from semantic_cache import HashingEmbedder, SemanticStoryCache, normalize_prompt
+
+
+@pytest.fixture
+def users(storage):
+    return storage.create_user('alice', 'hashed'), storage.create_user('bob', 'hashed')
+
+
+def make_cache(storage, **options):
+    options = dict(dict(explore=0.0, chunk_interval=0.0), **options)
+    cache = SemanticStoryCache(storage, **options)
+    cache.sync()
+    return cache
+
+
+def test_paraphrase_hits_and_other_topic_misses(storage, users):
+    """套话不同、主题相同的提示词命中，主题不同的不命中"""
+    alice, _ = users
+    assert normalize_prompt('讲个关于勇敢的故事！') == normalize_prompt('讲一个勇敢的故事') == '勇敢'
+    story_id = storage.save_story_history(alice, '讲个关于勇敢的故事', '孩子需要鼓励', '小狮子克服了害怕')
+    cache = make_cache(storage)
+
+    hit = cache.lookup(alice, '讲一个勇敢的故事')
+    assert hit['story_id'] == story_id and hit['similarity'] > 0.99
+    assert hit['story'] == '小狮子克服了害怕'
+    assert cache.lookup(alice, '讲一个关于小猫钓鱼的故事') is None
+
+    # 回放内容与上游输出格式一致，拼起来即为 "思考 - 故事"
+    events = list(cache.replay(hit))
+    text = ''.join(json.loads(event[len('data: '):])['text'] for event in events)
+    assert text == '孩子需要鼓励\n-\n小狮子克服了害怕'
+    assert all(event.endswith('\n\n') for event in events)
+
+
+def test_scope_and_replay_limits(storage, users):
+    """user范围不复用他人的故事；同一故事对同一用户只回放设定次数"""
+    alice, bob = users
+    storage.save_story_history(alice, '讲一个恐龙的故事', '', '恐龙的故事')
+    user_cache = make_cache(storage, scope='user', max_replays_per_user=1)
+    assert user_cache.lookup(bob, '恐龙故事') is None
+    assert user_cache.lookup(alice, '恐龙故事') is not None
+    assert user_cache.lookup(alice, '恐龙故事') is None
+
+    global_cache = make_cache(storage, scope='global', max_replays_per_user=5, max_replays=2)
+    assert global_cache.lookup(bob, '恐龙故事') is not None
+    assert global_cache.lookup(alice, '恐龙故事') is not None
+    assert global_cache.lookup(bob, '恐龙故事') is None
+
+
+def test_sync_adds_new_stories_once_and_respects_max_age(storage, users):
+    alice, _ = users
+    cache = make_cache(storage, max_age=3600)
+    assert cache.lookup(alice, '月亮的故事') is None
+
+    storage.save_story_history(alice, '讲一个月亮的故事', '', '月亮姐姐')
+    storage.save_story_history(alice, '月亮的故事', '', '月亮姐姐')  # 回放写入的相同内容
+    assert cache.sync() == {'indexed': 1, 'added': 1}
+    assert cache.lookup(alice, '月亮的故事') is not None
+
+    cache.max_age = 1e-6
+    cache.max_replays_per_user = 10
+    assert cache.lookup(alice, '月亮的故事') is None
+
+
+def test_failed_embedding_is_retried_on_next_sync(storage, users):
+    """向量化失败时不推进last_id，下次sync补上这批故事"""
+    alice, _ = users
+    storage.save_story_history(alice, '讲一个星星的故事', '', '星星眨眼睛')
+
+    class FlakyEmbedder(HashingEmbedder):
+        failures = 1
+
+        def embed(self, texts):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError('embedding超时')
+            return super().embed(texts)
+
+    cache = SemanticStoryCache(storage, embedder=FlakyEmbedder(), explore=0.0)
+    with pytest.raises(ConnectionError):
+        cache.sync()
+    assert cache.sync() == {'indexed': 1, 'added': 1}
+    assert cache.lookup(alice, '星星的故事') is not None
+
+
+def test_replay_counts_are_bounded(storage, users):
+    alice, bob = users
+    story_id = storage.save_story_history(alice, '讲一个恐龙的故事', '', '恐龙的故事')
+    cache = make_cache(storage, scope='global', max_replays_per_user=5, max_replays=10, max_tracked_replays=2)
+    for user_id in (alice, bob, alice):
+        assert cache.lookup(user_id, '恐龙故事') is not None
+    # 最久未用的键被淘汰，总回放次数保留
+    assert dict(cache._replays) == {story_id: 3, (alice, story_id): 1}
+
+
+def test_hashing_embedder_vectors_are_normalized():
+    vectors = HashingEmbedder(dim=64).embed(['小兔子', '讲故事', ''])
+    assert vectors.shape == (3, 64)
+    assert abs(float((vectors[0] ** 2).sum()) - 1.0) < 1e-5
@@ -0,0 +1,39 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sentiment_lexicon import LexiconScorer
+
+
+@pytest.fixture
+def scorer():
+    return LexiconScorer()
+
+
+@pytest.mark.parametrize('content, label', [
+    ('今天好开心！', '正面'),
+    ('哈哈哈太好玩了', '正面'),
+    ('我有点难过', '负面'),
+    ('我一点都不开心', '负面'),
+    ('不难过了', '正面'),
+    ('我被同学欺负了，想哭', '负面'),
+    ('给我讲个故事吧', '中性'),
+    ('虽然输了比赛，但是我不害怕', '正面'),
+])
+def test_labels(scorer, content, label):
+    assert scorer.score([content])[0][0] == label
+
+
+def test_modifiers_change_confidence(scorer):
+    """程度副词增强、弱化置信度，否定后的极性被打折"""
+    (_, strong), (_, plain), (_, weak), (_, negated) = scorer.score(['非常开心', '开心', '有点开心', '不难过'])
+    assert strong > plain > weak
+    assert negated < plain
+
+
+def test_ambiguous_text_has_low_confidence(scorer):
+    """正负抵消或没有情感词的长文本置信度低，需要交给模型复核"""
+    results = scorer.score(['我很开心，也很难过', '今天上午我们去了公园然后下午去了图书馆看书', ''])
+    assert results[0] == ('中性', 0.5)
+    assert results[1] == ('中性', 0.5)
+    assert results[2] == ('中性', 0.75)
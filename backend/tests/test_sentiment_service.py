@@ -0,0 +1,84 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache_service import LRUCacheBackend
+from sentiment_lexicon import LexiconScorer
+from sentiment_service import SentimentService, reduce_sentiments, summarize_daily
+
+
+@pytest.fixture
+def service(storage, monkeypatch):
+    service = SentimentService(storage, api_key='test', api_url='http://localhost', batch_size=2)
+    service.calls = []
+
+    def fake_score_batch(batch):
+        service.calls.append([content for _, content in batch])
+        return [('负面', 0.8) if '难过' in content else ('正面', 0.9) for _, content in batch]
+    monkeypatch.setattr(service, '_score_batch', fake_score_batch)
+    return service
+
+
+def test_reduce_sentiments_weights_by_confidence():
+    """整体label取置信度之和最大者，score按消息总数平均"""
+    assert reduce_sentiments([('正面', 0.9), ('正面', 0.7), ('负面', 0.8)]) == {'label': '正面', 'score': 0.5333}
+    assert reduce_sentiments([]) == {'label': '负面', 'score': 0.0}
+
+
+def test_analyze_keeps_response_shape(service):
+    """结果保持 overall/daily/samples 结构，按日期分组"""
+    result = service.analyze([
+        {'role': 'user', 'content': '今天很开心', 'timestamp': '2024-05-01T10:00:00Z'},
+        {'role': 'user', 'content': '我有点难过', 'timestamp': '2024-05-02T10:00:00Z'},
+        {'role': 'user', 'content': '故事真好听', 'timestamp': '2024-05-02T11:00:00Z'},
+    ])
+    assert result['overall']['label'] == '正面'
+    assert result['overall']['recommendation']
+    assert [day['date'] for day in result['daily']] == ['2024-05-01', '2024-05-02']
+    assert {sample['sentiment']['label'] for sample in result['samples']} == {'正面', '负面'}
+
+
+def test_reanalysis_only_scores_new_messages(service, storage):
+    """已打分的消息走缓存，新增一条只触发一次小批量调用"""
+    messages = [{'role': 'user', 'content': f'第{i}条很开心'} for i in range(5)]
+    service.analyze(messages)
+    assert [len(batch) for batch in service.calls] == [2, 2, 1]
+
+    service.calls.clear()
+    service.analyze(messages + [{'role': 'user', 'content': '我有点难过'}])
+    assert service.calls == [['我有点难过']]
+
+    # 进程内缓存丢失后仍可从存储中取回
+    service._local_cache = LRUCacheBackend()
+    service.calls.clear()
+    service.analyze(messages)
+    assert service.calls == []
+
+
+def test_recorded_scores_feed_daily_summary(service, storage):
+    """写回消息的结果汇总为与analyze一致的label与分布"""
+    user_id = storage.create_user('testuser', 'hashed')
+    ids = [storage.save_chat_message(user_id, 'user', content) for content in ('很开心', '很开心', '我有点难过')]
+    assert service.record([{'id': i, 'content': c} for i, c in zip(ids, ('很开心', '很开心', '我有点难过'))]) == 3
+    assert len(service.calls) == 1
+
+    rows = storage.list_sentiment_daily(user_id, '2000-01-01', '2999-12-31')
+    summary = summarize_daily(rows)
+    assert summary == {'label': '正面', 'score': 0.6, 'count': 3, 'mean_score': 0.8667,
+                       'distribution': {'负面': 1, '中性': 0, '正面': 2}}
+    assert summary['label'] == reduce_sentiments([('正面', 0.9), ('正面', 0.9), ('负面', 0.8)])['label']
+
+
+def test_lexicon_handles_confident_messages(service):
+    """词典能确定的消息不请求模型，低置信度的才进入模型批次"""
+    service.lexicon = LexiconScorer()
+    result = service.score_messages(['今天好开心！', '今天上午我们去了公园然后下午去了图书馆看书'])
+    assert result[0][0] == '正面'
+    assert service.calls == [['今天上午我们去了公园然后下午去了图书馆看书']]
+
+
+def test_parse_batch_rejects_non_integer_index():
+    text = '[{"i": 1, "label": "正面", "score": 0.9}, {"i": "2", "label": "负面", "score": 0.8}]'
+    with pytest.raises(ValueError):
+        SentimentService._parse_batch(text, 2)
+    assert SentimentService._parse_batch(text, 1) == [('正面', 0.9)]
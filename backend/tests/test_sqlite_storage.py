@@ -0,0 +1,127 @@
+import pytest
+import sys
+import os
+import datetime
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def user_id(storage):
+    return storage.create_user('testuser', 'hashed')
+
+
+def test_create_user_rejects_duplicate(storage, user_id):
+    """重复用户名返回None"""
+    assert storage.create_user('testuser', 'other') is None
+    assert storage.get_user_by_username('testuser') == {'id': user_id, 'password': 'hashed'}
+
+
+def test_conversation_summary_follows_inserts_and_deletes(storage, user_id):
+    """对话摘要随消息写入与删除同步更新"""
+    conversation_id = storage.create_conversation(user_id, '新对话')
+    storage.save_chat_message(user_id, 'user', '第一条', conversation_id)
+    second = storage.save_chat_message(user_id, 'assistant', '第二条', conversation_id)
+
+    conversation = storage.list_conversations(user_id)[0]
+    assert conversation['message_count'] == 2
+    assert conversation['last_message'] == '第二条'
+    assert isinstance(conversation['last_updated'], datetime.datetime)
+
+    assert storage.delete_chat_message(user_id, second) == (True, conversation_id)
+    conversation = storage.list_conversations(user_id)[0]
+    assert conversation['message_count'] == 1
+    assert conversation['last_message'] == '第一条'
+
+
+def test_refresh_conversation_summaries(storage, user_id):
+    """修复命令按chat_history重新计算摘要"""
+    conversation_id = storage.create_conversation(user_id, '新对话')
+    storage.save_chat_message(user_id, 'user', '你好', conversation_id)
+    storage._write(lambda db: db.execute("UPDATE conversations SET message_count = 0, last_message = NULL"))
+
+    assert storage.refresh_conversation_summaries(user_id) == 1
+    conversation = storage.list_conversations(user_id)[0]
+    assert conversation['message_count'] == 1
+    assert conversation['last_message'] == '你好'
+
+
+def test_verify_owner_rejects_foreign_conversation(storage, user_id):
+    """不属于当前用户的对话不能写入"""
+    other = storage.create_user('other', 'hashed')
+    conversation_id = storage.create_conversation(other, '别人的对话')
+    assert storage.save_chat_message(user_id, 'user', '你好', conversation_id, verify_owner=True) is None
+    assert storage.list_chat_history(user_id) == []
+
+
+def test_failed_write_does_not_affect_batched_writes(storage, user_id):
+    """合并提交中单个写入失败只回滚它自己"""
+    errors = []
+
+    def bad_write():
+        try:
+            storage.save_chat_message(user_id, 'robot', '非法角色')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=bad_write)]
+    threads += [threading.Thread(target=storage.save_story_history, args=(user_id, f'提示{i}', '', '故事'))
+                for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(errors) == 1
+    assert len(storage.list_story_history(user_id)) == 10
+
+
+def test_search_ranks_and_highlights(storage, user_id):
+    """检索按相关度排序并高亮命中词"""
+    storage.save_story_history(user_id, '讲一个勇敢的故事', '', '小兔子很勇敢，勇敢地跳过了小河。')
+    storage.save_story_history(user_id, '讲一个关于友谊的故事', '', '小熊和小狗是好朋友。')
+    storage.save_chat_message(user_id, 'user', '我想听勇敢的小兔子')
+
+    result = storage.search_history(user_id, '勇敢')
+    assert result['total'] == 2
+    assert result['hits'][0]['source'] == 'story'
+    assert '<mark>勇敢</mark>' in result['hits'][0]['snippet']
+
+    page = storage.search_history(user_id, '勇敢', sources=('chat',), limit=1)
+    assert [hit['source'] for hit in page['hits']] == ['chat']
+
+
+def test_search_index_follows_deletes_and_users(storage, user_id):
+    """删除消息后不再命中，其他用户的记录不可见"""
+    message_id = storage.save_chat_message(user_id, 'user', '今天的月亮很圆')
+    other = storage.create_user('other', 'hashed')
+    storage.save_chat_message(other, 'user', '月亮上有嫦娥')
+
+    assert storage.search_history(user_id, '月亮')['total'] == 1
+    storage.delete_chat_message(user_id, message_id)
+    assert storage.search_history(user_id, '月亮')['total'] == 0
+    assert storage.rebuild_search_index() == 1
+    assert storage.search_history(other, '月亮')['total'] == 1
+
+
+def test_sentiment_daily_follows_scores_and_deletes(storage, user_id):
+    """打分累加到当日汇总，删除消息时扣减，与重建结果一致"""
+    first = storage.save_chat_message(user_id, 'user', '今天很开心')
+    second = storage.save_chat_message(user_id, 'user', '有点难过')
+    assert storage.record_message_sentiments([(first, '正面', 0.9), (second, '负面', 0.6)]) == [user_id, user_id]
+    # 重复记录不会重复计入
+    assert storage.record_message_sentiments([(first, '正面', 0.9)]) == []
+    assert storage.list_unscored_messages() == []
+
+    today = datetime.date.today()
+    row = storage.list_sentiment_daily(user_id, today, today)[0]
+    assert row['day'] == today
+    assert (row['message_count'], row['positive_count'], row['negative_count']) == (2, 1, 1)
+    assert row['score_sum'] == pytest.approx(1.5)
+
+    storage.delete_chat_message(user_id, second)
+    row = storage.list_sentiment_daily(user_id, today, today)[0]
+    assert (row['message_count'], row['negative_count'], row['negative_score']) == (1, 0, pytest.approx(0))
+
+    assert storage.rebuild_sentiment_daily() == 1
+    assert storage.list_sentiment_daily(user_id, today, today)[0]['score_sum'] == pytest.approx(0.9)
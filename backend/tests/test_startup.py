@@ -0,0 +1,70 @@
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from startup import LazyComponent, Startup
+
+
+def test_lazy_component_created_once_on_first_use():
+    """首次访问属性时才创建组件，并发访问也只创建一次"""
+    created = []
+
+    def factory():
+        time.sleep(0.01)
+        created.append(1)
+        return {'name': 'sqlite'}
+
+    component = LazyComponent('storage', factory)
+    assert not component.initialized and created == []
+
+    threads = [threading.Thread(target=lambda: component.copy()) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert component.initialized and created == [1]
+    assert component.get() == {'name': 'sqlite'}
+
+
+def test_failed_sync_hook_retried_after_interval():
+    """同步钩子失败时服务未就绪，间隔过后的下一次调用会重试"""
+    startup = Startup(retry_interval=0.05)
+    attempts = []
+
+    @startup.hook('storage')
+    def init_storage():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError('数据库不可用')
+        return {'backend': 'sqlite'}
+
+    assert not startup.ensure_started()
+    assert startup.status('storage')['error'] == '数据库不可用'
+    assert not startup.ensure_started()  # 重试间隔内不再尝试
+    assert len(attempts) == 1
+
+    time.sleep(0.06)
+    assert startup.ensure_started()
+    assert startup.status('storage')['state'] == 'ready'
+    assert startup.status('storage')['result'] == {'backend': 'sqlite'}
+
+
+def test_background_hook_does_not_block_readiness():
+    """后台钩子在就绪之后启动，执行期间服务已经就绪"""
+    startup = Startup()
+    release = threading.Event()
+
+    @startup.hook('rag', background=True)
+    def init_rag():
+        release.wait(1)
+        return {'status': 'success'}
+
+    assert startup.ensure_started()
+    assert not startup.done('rag')
+    release.set()
+    for _ in range(100):
+        if startup.done('rag'):
+            break
+        time.sleep(0.01)
+    assert startup.status('rag')['result'] == {'status': 'success'}
@@ -0,0 +1,92 @@
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stream_hub import EXPIRED_EVENT, StreamHub, parse_last_event_id
+
+
+def event(text):
+    return f"data: {text}\n\n"
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_reconnect_replays_missed_events_without_second_generation():
+    """客户端读到第2个事件后断开，生产继续；带最后序号重连补发其余事件"""
+    calls = []
+    release = threading.Event()
+
+    def generate():
+        calls.append(1)
+        for i in range(1, 6):
+            if i == 3:
+                release.wait(2)
+            yield event(i)
+
+    hub = StreamHub(grace_period=5, keepalive=0.05)
+    stream = hub.start('alice', generate())
+    first = hub.subscribe(stream)
+    received = [next(first), next(first)]
+    first.close()
+    assert received[-1].startswith(f"id: {stream.id}:2\n")
+
+    release.set()
+    assert wait_until(lambda: stream.done)
+    stream_id, seq = parse_last_event_id(received[-1].split('\n')[0][len('id: '):])
+    assert hub.get('bob', stream_id) is None
+    resumed = list(hub.subscribe(hub.get('alice', stream_id), seq))
+    assert resumed == [f"id: {stream.id}:{i}\n{event(i)}" for i in range(3, 6)]
+    assert len(calls) == 1
+    assert hub.stats()['resumed'] == 1
+
+
+def test_abandoned_stream_stops_upstream_after_grace_period():
+    closed = threading.Event()
+
+    def generate():
+        try:
+            while True:
+                time.sleep(0.01)
+                yield event('chunk')
+        finally:
+            closed.set()
+
+    hub = StreamHub(grace_period=0.1)
+    stream = hub.start('alice', generate())
+    assert closed.wait(2)
+    assert wait_until(lambda: stream.done)
+    assert hub.stats()['abandoned'] == 1
+
+
+def test_resume_beyond_ring_buffer_is_rejected():
+    hub = StreamHub(buffer_size=3)
+    stream = hub.start('alice', (event(i) for i in range(10)))
+    assert wait_until(lambda: stream.done)
+    assert not stream.can_resume(2)
+    assert stream.can_resume(7) and stream.can_resume(10)
+    assert not stream.can_resume(11)
+
+
+def test_slow_subscriber_gets_expired_event_instead_of_gap():
+    """实时订阅者落后超过缓冲区时以过期事件结束，不跳过被淘汰的事件"""
+    hub = StreamHub(buffer_size=3)
+    stream = hub.start('alice', (event(i) for i in range(10)))
+    frames = hub.subscribe(stream)
+    assert wait_until(lambda: stream.done)
+    assert list(frames) == [EXPIRED_EVENT]
+    assert hub.stats()['expired'] == 1
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id('abc:12') == ('abc', 12)
+    assert parse_last_event_id(' abc:0 ') == ('abc', 0)
+    for value in (None, '', '12', 'abc:', 'abc:x', ':3'):
+        assert parse_last_event_id(value) is None
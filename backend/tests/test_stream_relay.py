@@ -0,0 +1,99 @@
+import sys
+import os
+import json
+import threading
+import time
+import zlib
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stream_relay import SSEDataParser, UpstreamReader, coalesce_frames, gzip_frames, story_deltas
+
+
+def upstream_event(text, tokens):
+    payload = {'output': {'text': text}, 'usage': {'output_tokens': tokens}}
+    return f"id:{tokens}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(payload, ensure_ascii=False)}\r\n\n".encode()
+
+
+def frame_texts(frames):
+    return [json.loads(frame[len('data: '):])['text'] for frame in frames]
+
+
+def test_parser_handles_events_split_at_any_byte():
+    raw = b''.join(upstream_event(text, i) for i, text in enumerate(['从前', '有一只', '小兔子'], 1))
+    raw += b'data: {"a":\ndata: 1}\n\n' + b'data:{"output":'
+    for size in (1, 3, 7, len(raw)):
+        parser = SSEDataParser()
+        events = []
+        for i in range(0, len(raw), size):
+            events += parser.feed(raw[i:i + size])
+        assert len(events) == 4
+        assert json.loads(events[1])['output']['text'] == '有一只'
+        assert events[3] == b'{"a":\n1}'
+
+
+def test_story_deltas_flush_last_event_without_blank_line():
+    chunks = [upstream_event('从前', 1), upstream_event('小兔子', 2).rstrip(b'\n')]
+    assert list(story_deltas(chunks)) == [('从前', 1), ('小兔子', 2)]
+
+
+def test_story_deltas_skip_bad_events():
+    errors = []
+    chunks = [upstream_event('从前', 1), b'data:not json\n\n', b'data:{"code":"Throttling"}\n\n', upstream_event('有', 2)]
+    assert list(story_deltas(chunks, errors.append)) == [('从前', 1), ('有', 2)]
+    assert len(errors) == 2
+
+
+def test_coalesce_by_size_and_time_window():
+    now = [0.0]
+
+    def deltas():
+        for text, gap in [('从', 0), ('前', 0.01), ('有', 0.01), ('一', 0.01), ('只', 0.05), ('小兔子' * 4, 0.001)]:
+            now[0] += gap
+            yield text
+
+    frames = list(coalesce_frames(deltas(), max_bytes=30, max_delay=0.04, clock=lambda: now[0]))
+    # 第一段立即发出；'有一只'在40ms窗口到期时合并发出；超过30字节的立即发出
+    assert frame_texts(frames) == ['从', '前有一只', '小兔子' * 4]
+    assert all(frame.endswith('\n\n') for frame in frames)
+
+
+def test_coalesce_flushes_on_deadline_while_upstream_stalls():
+    """上游停顿时，未满一帧的文本在max_delay内发出，而不是等到下一个片段"""
+    resume = threading.Event()
+
+    def deltas():
+        yield '从'
+        yield '前'
+        resume.wait(2)
+        yield '有一只'
+
+    frames = coalesce_frames(UpstreamReader(deltas()), max_bytes=64, max_delay=0.05)
+    assert frame_texts([next(frames)]) == ['从']
+    started = time.monotonic()
+    assert frame_texts([next(frames)]) == ['前']
+    assert time.monotonic() - started < 0.5 and not resume.is_set()
+    resume.set()
+    assert frame_texts(frames) == ['有一只']
+
+
+def test_coalesce_flushes_pending_text_before_upstream_error():
+    def deltas():
+        yield '从前'
+        yield '有'
+        raise ConnectionError('连接被重置')
+
+    frames = coalesce_frames(deltas(), max_bytes=64, max_delay=10)
+    assert frame_texts([next(frames), next(frames)]) == ['从前', '有']
+    try:
+        next(frames)
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError('应抛出上游错误')
+
+
+def test_gzip_frames_are_decodable_frame_by_frame():
+    frames = ['data: {"text": "从前"}\n\n', 'data: {"text": "有一只小兔子"}\n\n']
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    parts = list(gzip_frames(iter(frames)))
+    assert [decompressor.decompress(part).decode() for part in parts[:2]] == frames
+    assert decompressor.decompress(parts[2]) == b'' and decompressor.eof
@@ -0,0 +1,69 @@
+import html
+import re
+from collections import Counter
+from typing import Iterable, List
+
+# 中文按字符n-gram切分（与MySQL ngram解析器的ngram_token_size=2一致），字母数字按词切分
+NGRAM_SIZE = 2
+_CJK_RANGES = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[{_CJK_RANGES}]+|[0-9A-Za-z]+')
+_CJK_RE = re.compile(f'[{_CJK_RANGES}]')
+
+
+def tokenize(text: str, n: int = NGRAM_SIZE) -> List[str]:
+    """切分为检索词：中文连续片段取n-gram，不足n个字时保留原片段"""
+    terms = []
+    for run in _TOKEN_RE.findall(text or ''):
+        if _CJK_RE.match(run):
+            if len(run) <= n:
+                terms.append(run)
+            else:
+                terms.extend(run[i:i + n] for i in range(len(run) - n + 1))
+        else:
+            terms.append(run.lower())
+    return terms
+
+
+def term_frequencies(text: str) -> Counter:
+    return Counter(tokenize(text))
+
+
+def query_terms(query: str) -> List[str]:
+    """查询词去重并保持顺序"""
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def make_snippet(text: str, terms: Iterable[str], width: int = 80) -> str:
+    """截取命中词附近的片段并用<mark>高亮，其余内容做HTML转义"""
+    text = text or ''
+    spans = []
+    for term in terms:
+        for match in re.finditer(re.escape(term), text, re.IGNORECASE):
+            spans.append((match.start(), match.end()))
+    if not spans:
+        return html.escape(text[:width]) + ('…' if len(text) > width else '')
+
+    # 合并重叠的命中区间（二元切分的相邻词会互相重叠）
+    spans.sort()
+    merged = [list(spans[0])]
+    for start, end in spans[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    window_start = max(0, merged[0][0] - width // 4)
+    window_end = min(len(text), window_start + width)
+    parts = ['…'] if window_start > 0 else []
+    cursor = window_start
+    for start, end in merged:
+        if start >= window_end:
+            break
+        start, end = max(start, cursor), min(end, window_end)
+        parts.append(html.escape(text[cursor:start]))
+        parts.append(f"<mark>{html.escape(text[start:end])}</mark>")
+        cursor = end
+    parts.append(html.escape(text[cursor:window_end]))
+    if window_end < len(text):
+        parts.append('…')
+    return ''.join(parts)